@@ -1,7 +1,7 @@
 # Archivo: addon_main.py (v3.4 - Sensores detallados y Pánico)
-import os, sys, logging, subprocess, threading, signal, time
+import os, sys, json, itertools, logging, queue, subprocess, threading, signal, time, configparser
 import paho.mqtt.client as mqtt
-from client import Client as AlarmClient, CommunicationError, AuthError
+from client import Client as AlarmClient, CommunicationError, AuthError, zones_in_mask
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] - %(levelname)s - %(message)s', stream=sys.stdout)
 
@@ -9,131 +9,400 @@ logging.basicConfig(level=logging.INFO, format='[%(asctime)s] - %(levelname)s -
 ALARM_IP = os.environ.get('ALARM_IP'); ALARM_PORT = int(os.environ.get('ALARM_PORT', 9009)); ALARM_PASS = os.environ.get('ALARM_PASS')
 MQTT_BROKER = os.environ.get('MQTT_BROKER'); MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883)); MQTT_USER = os.environ.get('MQTT_USER'); MQTT_PASS = os.environ.get('MQTT_PASS')
 POLLING_INTERVAL_MINUTES = int(os.environ.get('POLLING_INTERVAL_MINUTES', 5))
+POLL_DEBOUNCE_SECONDS = int(os.environ.get('POLL_DEBOUNCE_SECONDS', 5)) # Tras un evento, espera antes del sondeo dirigido (agrupa ráfagas de eventos)
+POLL_BACKOFF_MAX = int(os.environ.get('POLL_BACKOFF_MAX', 4)) # En calma y con heartbeats de la central, el intervalo se duplica hasta este factor
 ZONE_COUNT = int(os.environ.get('ZONE_COUNT', 0))
+KEEPALIVE_SECONDS = int(os.environ.get('KEEPALIVE_SECONDS', 30)) # 0 desactiva el keepalive
+FULL_RESYNC_MINUTES = int(os.environ.get('FULL_RESYNC_MINUTES', 60)) # Republicación completa periódica; 0 = nunca
+COMPACT_STATE = os.environ.get('COMPACT_STATE', 'false').lower() == 'true' # Un solo documento JSON en lugar de un tópico por valor
+AUTO_ZONES = os.environ.get('AUTO_ZONES', 'true').lower() == 'true' # Solo zonas con sensor emparejado (hasta ZONE_COUNT)
+PAIRED_REFRESH_MINUTES = int(os.environ.get('PAIRED_REFRESH_MINUTES', 60)) # Frecuencia de consulta de sensores emparejados
+EMBEDDED_RECEPTOR = os.environ.get('EMBEDDED_RECEPTOR', 'false').lower() == 'true' # Receptor IP en este proceso, con eventos estructurados
+RECEPTOR_DIR = "/alarme-intelbras"; RECEPTOR_CONFIG = f"{RECEPTOR_DIR}/config.cfg"
+COMMAND_DEADLINE_SECONDS = 30 # Un comando que no llegó a la central en este tiempo se descarta
+PANEL_ALIVE_SECONDS = 600 # Un heartbeat más reciente que esto prueba que la central está viva
 AVAILABILITY_TOPIC = "intelbras/alarm/availability"; COMMAND_TOPIC = "intelbras/alarm/command"; BASE_TOPIC = "intelbras/alarm"
-alarm_client = AlarmClient(host=ALARM_IP, port=ALARM_PORT)
+STATE_JSON_TOPIC = f"{BASE_TOPIC}/json"; COMMAND_RESULT_TOPIC = f"{BASE_TOPIC}/command/result"; DISCOVERY_PREFIX = "homeassistant"; DEVICE_ID = "intelbras_alarm"
+alarm_client = AlarmClient(host=ALARM_IP, port=ALARM_PORT, keepalive_interval=KEEPALIVE_SECONDS)
 mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-shutdown_event = threading.Event(); alarm_lock = threading.Lock()
+shutdown_event = threading.Event()
+state_queue = queue.Queue() # Mensajes para el actor de estado
 
-# --- Almacén Central de Estados ---
-zone_states = {str(i): "Desconocido" for i in range(1, ZONE_COUNT + 1)}
+# --- Cola de la central: un único hilo hace E/S con la central, por prioridad ---
+PANEL_PRIORITY = {"PANIC": 0, "DISARM": 1, "ARM_AWAY": 2, "POLL": 3, "KEEPALIVE": 4}
+PANEL_GROUP = {"ARM_AWAY": "arm", "DISARM": "arm"} # El último pedido de armado/desarmado reemplaza al pendiente
+panel_queue = queue.PriorityQueue(); pending_jobs = {}; pending_lock = threading.Lock(); panel_seq = itertools.count()
+
+# --- Sondeo adaptativo: sondeos dirigidos tras eventos, intervalo mayor en calma ---
+poll_wakeup = threading.Event(); poll_lock = threading.Lock(); poll_due_at = None; panel_seen_at = None
+
+# --- Almacén Central de Estados (solo el actor de estado lo modifica) ---
+zone_states = {str(i): "Desconocido" for i in range(1, ZONE_COUNT + 1)} # Vista publicada en MQTT
+# Bitmasks (bit n-1 = zona n): 'active' = gestionadas, 'open' = mostradas como Abierta, 'alarm' = Disparada, 'known' = ya sondeadas
+ZONES_MASK = (1 << ZONE_COUNT) - 1
+zone_masks = {"active": ZONES_MASK, "open": 0, "alarm": 0, "known": 0}
+paired_refreshed_at = None
+panel_state = {} # Estados generales (state, model, battery_percentage, tamper, ac_power, ...)
+
+# --- Caché de lo último publicado: solo se publican los valores que cambiaron ---
+last_published = {}; last_full_resync = time.monotonic()
+
+# --- Actor de estado: único hilo que modifica los estados y publica en MQTT ---
+# Los demás hilos (sondeo, receptorip, paho) solo le envían mensajes, así la
+# publicación de eventos nunca espera por la E/S con la central.
+def submit(fn, *args):
+    state_queue.put((fn, args))
+
+def state_actor_thread():
+    while True:
+        item = state_queue.get()
+        if item is None: break
+        fn, args = item
+        try: fn(*args)
+        except Exception as e: logging.error(f"Error en actor de estado ({fn.__name__}): {e}", exc_info=True)
+    logging.info("Actor de estado terminado.")
 
 # --- Funciones de MQTT ---
+def publish_retained(topic, value):
+    value = str(value)
+    if last_published.get(topic) == value: return False
+    last_published[topic] = value
+    if mqtt_client.publish(topic, value, retain=True).rc != mqtt.MQTT_ERR_SUCCESS:
+        last_published.pop(topic, None) # Reintentar en la próxima publicación
+    return True
+
+def invalidate_published():
+    last_published.clear()
+
+def republish_all():
+    # Actor de estado: vuelve a publicar todo lo conocido (state, ac_power, zonas, ...) desde la caché
+    invalidate_published()
+    if not COMPACT_STATE:
+        for key, value in panel_state.items(): publish_retained(f"{BASE_TOPIC}/{key}", value)
+    refresh_zone_discovery(); publish_zone_states()
+
+def publish_value(key, value):
+    panel_state[key] = value
+    if not COMPACT_STATE: publish_retained(f"{BASE_TOPIC}/{key}", value)
+
+def publish_state_document():
+    # Modo compacto: todos los estados en un único mensaje retenido, solo si algo cambió
+    if not COMPACT_STATE: return
+    document = json.dumps(dict(panel_state, zones=zone_states), ensure_ascii=False, sort_keys=True)
+    if publish_retained(STATE_JSON_TOPIC, document): logging.info(f"Documento de estado publicado a MQTT: {document}")
+
 def publish_zone_states():
-    for zone_id, state in zone_states.items():
-        mqtt_client.publish(f"{BASE_TOPIC}/zone_{zone_id}", state, retain=True)
-    logging.info(f"Estados de zona publicados a MQTT: {zone_states}")
+    if COMPACT_STATE: publish_state_document(); return
+    changed = {zone_id: state for zone_id, state in zone_states.items() if publish_retained(f"{BASE_TOPIC}/zone_{zone_id}", state)}
+    if changed: logging.info(f"Estados de zona publicados a MQTT: {changed}")
+
+# --- Discovery de zonas (solo las gestionadas; el resto de entidades lo publica run.sh) ---
+def zone_discovery_payload(zone):
+    uid = f"zone_{zone}"
+    payload = {"name": f"Zona {zone}", "unique_id": uid, "icon": "mdi:door", "availability_topic": AVAILABILITY_TOPIC,
+               "device": {"identifiers": [DEVICE_ID], "name": "Alarme Intelbras", "model": "AMT-8000", "manufacturer": "Intelbras"}}
+    if COMPACT_STATE: payload.update(state_topic=STATE_JSON_TOPIC, value_template=f"{{{{ value_json.zones['{zone}'] }}}}")
+    else: payload["state_topic"] = f"{BASE_TOPIC}/{uid}"
+    return json.dumps(payload, ensure_ascii=False)
+
+def set_active_zones(mask):
+    # Publica discovery de las zonas gestionadas y retira las demás (payload vacío = HA elimina la entidad)
+    mask &= ZONES_MASK
+    added = mask & ~zone_masks["active"]; removed = zone_masks["active"] & ~mask
+    for zone in zones_in_mask(added): zone_states[str(zone)] = "Desconocido"
+    for zone in zones_in_mask(removed): zone_states.pop(str(zone), None)
+    zone_masks.update(active=mask, open=zone_masks["open"] & mask, alarm=zone_masks["alarm"] & mask, known=zone_masks["known"] & mask)
+    for zone in range(1, ZONE_COUNT + 1):
+        config_topic = f"{DISCOVERY_PREFIX}/sensor/{DEVICE_ID}/zone_{zone}/config"
+        if (mask >> (zone - 1)) & 1: publish_retained(config_topic, zone_discovery_payload(zone))
+        else:
+            publish_retained(config_topic, "")
+            if not COMPACT_STATE: publish_retained(f"{BASE_TOPIC}/zone_{zone}", "")
+    if added or removed: logging.info(f"Zonas gestionadas: {zones_in_mask(mask)}")
+
+def refresh_zone_discovery():
+    set_active_zones(zone_masks["active"]) # Solo publica lo que no esté ya publicado
+
+def read_paired_zones():
+    # Hilo de la central; el resultado se aplica en el actor
+    global paired_refreshed_at
+    try: paired = alarm_client.get_paired_sensors_mask()
+    except (CommunicationError, AuthError) as e: logging.warning(f"No se pudo consultar sensores emparejados: {e}"); paired = 0
+    if paired: paired_refreshed_at = time.monotonic()
+    elif paired_refreshed_at is None: logging.warning("Sin mapa de sensores emparejados, se gestionan todas las zonas.")
+    return paired
+
+def mqtt_connected():
+    mqtt_client.publish(AVAILABILITY_TOPIC, "online", retain=True)
+    # --- INICIO: Publicar estado inicial de nuevos sensores (o el último conocido) ---
+    panel_state.setdefault("ac_power", "on")
+    panel_state.setdefault("system_battery", "on")
+    # --- FIN: Publicar estado inicial ---
+    republish_all() # El broker pudo haber perdido los retenidos; las zonas existen aunque no se pueda autenticar
 
 def on_connect(client, userdata, flags, reason_code, properties):
     if reason_code == 0:
         logging.info("Conectado a MQTT y suscrito.")
         client.subscribe(COMMAND_TOPIC)
-        client.publish(AVAILABILITY_TOPIC, "online", retain=True)
-        # --- INICIO: Publicar estado inicial de nuevos sensores ---
-        client.publish(f"{BASE_TOPIC}/ac_power", "on", retain=True)
-        client.publish(f"{BASE_TOPIC}/system_battery", "on", retain=True)
-        # --- FIN: Publicar estado inicial ---
+        submit(mqtt_connected)
     else:
         logging.error(f"Fallo al conectar a MQTT: {reason_code}")
 
 def on_message(client, userdata, msg):
+    # Hilo de paho: solo encola, nunca espera por la central
     command = msg.payload.decode()
     logging.info(f"Comando MQTT recibido: '{command}'")
-    with alarm_lock:
-        if not connect_and_auth_alarm(): logging.error("Fallo de auth, comando no ejecutado."); return
+    if command not in PANEL_GROUP and command != "PANIC": logging.warning(f"Comando desconocido: '{command}'"); return
+    enqueue_panel(command, COMMAND_DEADLINE_SECONDS)
+
+def publish_command_result(command, result, detail=""):
+    # Actor de estado
+    mqtt_client.publish(COMMAND_RESULT_TOPIC, json.dumps({"command": command, "result": result, "detail": detail}), retain=False)
+
+def enqueue_panel(command, deadline_seconds=None):
+    # Un trabajo igual ya pendiente absorbe al nuevo; devuelve el trabajo encolado
+    key = PANEL_GROUP.get(command, command)
+    with pending_lock:
+        job = pending_jobs.get(key)
+        if job and job["command"] == command:
+            if deadline_seconds: job["deadline"] = time.monotonic() + deadline_seconds
+            logging.info(f"'{command}' ya pendiente, se agrupa con el anterior.")
+            return job
+        if job:
+            job["cancelled"] = True; logging.info(f"'{job['command']}' pendiente reemplazado por '{command}'.")
+            submit(publish_command_result, job["command"], "superseded", command)
+        job = {"command": command, "key": key, "cancelled": False, "done": threading.Event(),
+               "deadline": deadline_seconds and time.monotonic() + deadline_seconds}
+        pending_jobs[key] = job
+    panel_queue.put((PANEL_PRIORITY[command], next(panel_seq), job))
+    return job
+
+def panel_worker_thread():
+    while True:
+        _, _, job = panel_queue.get()
+        if job is None: break
+        with pending_lock:
+            if pending_jobs.get(job["key"]) is job: del pending_jobs[job["key"]]
         try:
-            if command == "ARM_AWAY":
-                alarm_client.arm_system(0)
-            elif command == "DISARM":
-                alarm_client.disarm_system(0)
-            elif command == "PANIC":
-                logging.info("¡Activando pánico audible desde Home Assistant!")
-                alarm_client.panic(1) # El tipo 1 suele ser pánico audible
-        except (CommunicationError, AuthError) as e: logging.error(f"Error de comunicación en comando: {e}")
+            if job["cancelled"]: continue
+            if job["deadline"] and time.monotonic() > job["deadline"]:
+                logging.warning(f"'{job['command']}' descartado, plazo vencido."); submit(publish_command_result, job["command"], "expired"); continue
+            run_panel_job(job["command"])
+        except Exception as e: logging.error(f"Error en trabajo '{job['command']}': {e}", exc_info=True)
+        finally: job["done"].set()
+    logging.info("Hilo de la central terminado.")
+
+def run_panel_job(command):
+    if command == "POLL": return poll_panel()
+    if command == "KEEPALIVE":
+        try: alarm_client.keepalive()
+        except (CommunicationError, AuthError) as e: logging.warning(f"Fallo de keepalive: {e}")
+        return
+    if not connect_and_auth_alarm():
+        logging.error("Fallo de auth, comando no ejecutado."); submit(publish_command_result, command, "error", "auth"); return
+    try:
+        if command == "ARM_AWAY":
+            alarm_client.arm_system(0)
+        elif command == "DISARM":
+            alarm_client.disarm_system(0)
+        elif command == "PANIC":
+            logging.info("¡Activando pánico audible desde Home Assistant!")
+            alarm_client.panic(1) # El tipo 1 suele ser pánico audible
+        submit(publish_command_result, command, "ok")
+    except (CommunicationError, AuthError) as e:
+        logging.error(f"Error de comunicación en comando: {e}"); submit(publish_command_result, command, "error", str(e))
 
 # --- Funciones de la Alarma ---
+# La sesión se reutiliza: solo se autentica tras una reconexión (o NAK 0x1f, dentro del cliente)
 def connect_and_auth_alarm():
-    try: alarm_client.connect(); alarm_client.auth(ALARM_PASS); return True
+    try: return alarm_client.ensure_session(ALARM_PASS)
     except (CommunicationError, AuthError) as e: logging.error(f"Fallo de conexión/auth: {e}"); return False
 
+def request_poll(reason):
+    # Cualquier hilo: sondeo dirigido en POLL_DEBOUNCE_SECONDS; los pedidos en ese lapso se agrupan
+    global poll_due_at
+    with poll_lock:
+        if poll_due_at is not None: return
+        poll_due_at = time.monotonic() + POLL_DEBOUNCE_SECONDS
+    logging.info(f"Sondeo dirigido en {POLL_DEBOUNCE_SECONDS}s ({reason}).")
+    poll_wakeup.set()
+
+def panel_seen():
+    # Hilo del receptor: heartbeat u otra señal de vida de la central
+    global panel_seen_at
+    panel_seen_at = time.monotonic()
+
+def panel_reconnected():
+    panel_seen(); request_poll("reconexión de la central")
+
+def next_poll_interval(interval, targeted):
+    # Tras actividad se vuelve al intervalo configurado; en calma, con la central viva, se duplica
+    base = POLLING_INTERVAL_MINUTES * 60
+    if targeted or not interval or panel_seen_at is None or time.monotonic() - panel_seen_at > PANEL_ALIVE_SECONDS: return base
+    return min(interval * 2, base * POLL_BACKOFF_MAX)
+
+def wait_next_poll(interval):
+    # Espera el intervalo (0 = sin sondeo periódico) o un sondeo dirigido, manteniendo viva la sesión
+    deadline = time.monotonic() + interval if interval else None
+    next_keepalive = time.monotonic() + KEEPALIVE_SECONDS
+    while not shutdown_event.is_set():
+        poll_wakeup.clear()
+        with poll_lock: due = poll_due_at
+        if due is not None and (deadline is None or due < deadline): deadline = due
+        now = time.monotonic()
+        if deadline is not None and deadline <= now: return
+        waits = [t - now for t in (deadline, KEEPALIVE_SECONDS and next_keepalive) if t]
+        if poll_wakeup.wait(max(0, min(waits)) if waits else None): continue
+        if KEEPALIVE_SECONDS and time.monotonic() >= next_keepalive:
+            enqueue_panel("KEEPALIVE"); next_keepalive = time.monotonic() + KEEPALIVE_SECONDS
+
 def _map_battery_status_to_percentage(status: str) -> int:
     return {"full": 100, "middle": 75, "low": 25, "dead": 0}.get(status, 0)
 
+def apply_status(status):
+    # Actor de estado: aplica el resultado de un sondeo
+    publish_value("model", status.get("model", "Desconocido"))
+    publish_value("version", status.get("version", "Desconocido"))
+    battery_level = _map_battery_status_to_percentage(status.get("batteryStatus"))
+    publish_value("battery_percentage", battery_level)
+    tamper_state = "on" if status.get("tamper", False) else "off"
+    publish_value("tamper", tamper_state)
+    logging.debug(f"Estados generales: Batería={battery_level}%, Tamper={tamper_state}")
+    # Solo se tocan las zonas que cambiaron (XOR) o nunca sondeadas; las disparadas se mantienen
+    open_mask = status.get("zonesOpenMask", 0) & zone_masks["active"]
+    applied = ((open_mask ^ zone_masks["open"]) | (zone_masks["active"] & ~zone_masks["known"])) & ~zone_masks["alarm"]
+    for zone in zones_in_mask(applied):
+        zone_states[str(zone)] = "Abierta" if (open_mask >> (zone - 1)) & 1 else "Cerrada"
+    zone_masks["open"] = (zone_masks["open"] & ~applied) | (open_mask & applied); zone_masks["known"] |= applied
+    publish_zone_states()
+
+def poll_panel():
+    # Hilo de la central; los resultados se aplican en el actor de estado
+    status = None; paired = 0
+    if not connect_and_auth_alarm():
+        logging.warning("Sondeo omitido, no se pudo autenticar."); submit(refresh_zone_discovery); return
+    if AUTO_ZONES and (paired_refreshed_at is None or time.monotonic() - paired_refreshed_at >= PAIRED_REFRESH_MINUTES * 60):
+        paired = read_paired_zones()
+    try:
+        logging.info("Sondeando estado de la central...")
+        status = alarm_client.status()
+    except (CommunicationError, AuthError) as e: logging.warning(f"Error durante sondeo: {e}.")
+    if paired: submit(set_active_zones, paired)
+    submit(refresh_zone_discovery)
+    if status: submit(apply_status, status)
+
 def status_polling_thread():
-    logging.info(f"Iniciando sondeo cada {POLLING_INTERVAL_MINUTES} minutos.")
+    # Solo programa los sondeos; los ejecuta el hilo de la central detrás de los comandos
+    global last_full_resync, poll_due_at
+    logging.info(f"Iniciando sondeo cada {POLLING_INTERVAL_MINUTES} minutos (hasta x{POLL_BACKOFF_MAX} en calma) y tras eventos.")
+    interval = POLLING_INTERVAL_MINUTES * 60
     while not shutdown_event.is_set():
-        with alarm_lock:
-            if not connect_and_auth_alarm(): logging.warning("Sondeo omitido, no se pudo autenticar.")
-            else:
-                try:
-                    logging.info("Sondeando estado de la central...")
-                    status = alarm_client.status()
-                    mqtt_client.publish(f"{BASE_TOPIC}/model", status.get("model", "Desconocido"), retain=True)
-                    mqtt_client.publish(f"{BASE_TOPIC}/version", status.get("version", "Desconocido"), retain=True)
-                    battery_level = _map_battery_status_to_percentage(status.get("batteryStatus"))
-                    mqtt_client.publish(f"{BASE_TOPIC}/battery_percentage", battery_level, retain=True)
-                    tamper_state = "on" if status.get("tamper", False) else "off"
-                    mqtt_client.publish(f"{BASE_TOPIC}/tamper", tamper_state, retain=True)
-                    logging.info(f"Publicados estados generales: Batería={battery_level}%, Tamper={tamper_state}")
-                    if 'zones' in status and isinstance(status['zones'], dict):
-                        for zone_id, new_state_str in status['zones'].items():
-                            if int(zone_id) <= ZONE_COUNT:
-                                if zone_states.get(zone_id) != "Disparada":
-                                    zone_states[zone_id] = "Abierta" if new_state_str == "open" else "Cerrada"
-                    publish_zone_states()
-                except (CommunicationError, AuthError) as e: logging.warning(f"Error durante sondeo: {e}.")
-        shutdown_event.wait(POLLING_INTERVAL_MINUTES * 60)
+        if FULL_RESYNC_MINUTES and time.monotonic() - last_full_resync >= FULL_RESYNC_MINUTES * 60:
+            logging.info("Republicación completa de estados."); submit(republish_all); last_full_resync = time.monotonic()
+        with poll_lock: targeted = poll_due_at is not None; poll_due_at = None
+        enqueue_panel("POLL")["done"].wait()
+        new_interval = next_poll_interval(interval, targeted)
+        if new_interval != interval: logging.info(f"Intervalo de sondeo: {new_interval / 60:g} minutos.")
+        interval = new_interval
+        wait_next_poll(interval)
     logging.info("Hilo de sondeo terminado.")
 
+# --- Acciones del actor de estado, comunes al receptor embebido y al proceso receptorip ---
+def set_armed(armed):
+    request_poll("armado" if armed else "desarmado")
+    publish_value("state", "Armada" if armed else "Desarmada")
+    if not armed:
+        for zone_id in zone_states: zone_states[zone_id] = "Cerrada"
+        zone_masks.update(open=0, alarm=0, known=zone_masks["active"])
+    publish_zone_states()
+
+def panic_event(description):
+    logging.info(f"¡Evento de pánico detectado: {description}!")
+    mqtt_client.publish(f"{BASE_TOPIC}/panic", "on", retain=False)
+    threading.Timer(30.0, submit, (mqtt_client.publish, f"{BASE_TOPIC}/panic", "off")).start()
+
+def set_panel_flag(key, value):
+    publish_value(key, value); publish_zone_states()
+
+def zone_triggered(zone):
+    request_poll(f"disparo de zona {zone}")
+    if str(zone) not in zone_states: return
+    zone_states[str(zone)] = "Disparada"; zone_masks["alarm"] |= 1 << (zone - 1)
+    publish_value("state", "Disparada")
+    logging.info(f"Panel de alarma puesto en estado 'Disparada' debido a zona {zone}")
+    publish_zone_states()
+
+def zone_restored(zone):
+    request_poll(f"restauración de zona {zone}")
+    if str(zone) not in zone_states: return
+    zone_states[str(zone)] = "Cerrada"; bit = 1 << (zone - 1)
+    zone_masks["alarm"] &= ~bit; zone_masks["open"] &= ~bit; zone_masks["known"] |= bit
+    publish_zone_states()
+
+# Códigos Contact ID (ver alarmeitbl/tratador.py); qualificador 1 = apertura/disparo, 3 = restauración
+ARM_EVENT_CODES = (401, 403, 404, 407) # Restauración = activación
+PANIC_EVENT_CODES = (120, 122)
+ZONE_ALARM_CODES = (133, 146) # Disparos sin restauración (130 tiene ambos)
+
+def handle_alarm_event(event):
+    # Actor de estado: evento del receptor embebido (alarmeitbl.plugins.EventoAlarme)
+    if event.tipo_msg != 18: return
+    code, qualifier = event.codigo, event.qualificador
+    if code in PANIC_EVENT_CODES: panic_event(event.descricao or code)
+    elif code in ZONE_ALARM_CODES: zone_triggered(event.zona)
+    elif qualifier not in (1, 3): return
+    elif code in ARM_EVENT_CODES: set_armed(qualifier == 3)
+    elif code == 301: set_panel_flag("ac_power", "off" if qualifier == 1 else "on")
+    elif code == 302: set_panel_flag("system_battery", "on" if qualifier == 1 else "off")
+    elif code == 130: zone_triggered(event.zona) if qualifier == 1 else zone_restored(event.zona)
+
+def handle_receptorip_line(line):
+    # Actor de estado: línea de texto del proceso receptorip (embedded_receptor desactivado)
+    if "identificacao central conta" in line: panel_reconnected() # Los heartbeats no aparecen en el texto
+    elif "Ativacao remota app" in line: set_armed(True)
+    elif "Desativacao remota app" in line: set_armed(False)
+    elif "Panico" in line: panic_event(line)
+    # --- INICIO: Lógica para nuevos sensores de estado ---
+    elif "Falta de energia AC" in line: set_panel_flag("ac_power", "off")
+    elif "Retorno de energia AC" in line: set_panel_flag("ac_power", "on")
+    elif "Bateria do sistema baixa" in line: set_panel_flag("system_battery", "on")
+    elif "Recuperacao bateria do sistema baixa" in line: set_panel_flag("system_battery", "off")
+    # --- FIN: Lógica para nuevos sensores ---
+    elif "Disparo de zona" in line or "Restauracao de zona" in line:
+        try: zone = int(line.split()[-1])
+        except ValueError: logging.warning(f"No se pudo extraer ID de zona de: {line}"); return
+        zone_triggered(zone) if "Disparo" in line else zone_restored(zone)
+
 def process_receptorip_output(proc):
     for line in iter(proc.stdout.readline, ''):
         line = line.strip()
         if not line: continue
         logging.info(f"Evento (receptorip): {line}")
-        publish_required = False
-        with alarm_lock:
-            if "Ativacao remota app" in line: mqtt_client.publish(f"{BASE_TOPIC}/state", "Armada", retain=True)
-            elif "Desativacao remota app" in line:
-                mqtt_client.publish(f"{BASE_TOPIC}/state", "Desarmada", retain=True)
-                for zone_id in zone_states: zone_states[zone_id] = "Cerrada"
-                publish_required = True
-            elif "Panico" in line:
-                logging.info(f"¡Evento de pánico detectado: {line}!")
-                mqtt_client.publish(f"{BASE_TOPIC}/panic", "on", retain=False)
-                threading.Timer(30.0, lambda: mqtt_client.publish(f"{BASE_TOPIC}/panic", "off", retain=False)).start()
-            # --- INICIO: Lógica para nuevos sensores de estado ---
-            elif "Falta de energia AC" in line:
-                mqtt_client.publish(f"{BASE_TOPIC}/ac_power", "off", retain=True)
-            elif "Retorno de energia AC" in line:
-                mqtt_client.publish(f"{BASE_TOPIC}/ac_power", "on", retain=True)
-            elif "Bateria do sistema baixa" in line:
-                mqtt_client.publish(f"{BASE_TOPIC}/system_battery", "on", retain=True)
-            elif "Recuperacao bateria do sistema baixa" in line:
-                mqtt_client.publish(f"{BASE_TOPIC}/system_battery", "off", retain=True)
-            # --- FIN: Lógica para nuevos sensores ---
-            elif "Disparo de zona" in line:
-                try:
-                    zone_id = line.split()[-1]
-                    if int(zone_id) <= ZONE_COUNT:
-                        zone_states[zone_id] = "Disparada"
-                        mqtt_client.publish(f"{BASE_TOPIC}/state", "Disparada", retain=True)
-                        logging.info(f"Panel de alarma puesto en estado 'Disparada' debido a zona {zone_id}")
-                        publish_required = True
-                except: logging.warning(f"No se pudo extraer ID de zona de: {line}")
-            elif "Restauracao de zona" in line:
-                try:
-                    zone_id = line.split()[-1]
-                    if int(zone_id) <= ZONE_COUNT:
-                        zone_states[zone_id] = "Cerrada"
-                        publish_required = True
-                except: logging.warning(f"No se pudo extraer ID de zona de: {line}")
-        if publish_required:
-            with alarm_lock:
-                publish_zone_states()
+        submit(handle_receptorip_line, line)
     logging.warning("Proceso 'receptorip' terminado.")
 
+def start_embedded_receptor():
+    # El event loop se crea aquí, en el hilo principal (instala SIGPIPE), y corre en un hilo propio.
+    # Los eventos llegan ya decodificados por un plugin que solo los pasa al actor de estado.
+    from alarmeitbl.myeventloop import Log
+    from alarmeitbl.tratador import Tratador
+    from alarmeitbl.receptor import configura_receptor
+    cfg = configparser.ConfigParser(); cfg.read(RECEPTOR_CONFIG); config = cfg["receptorip"]
+    Log.set_level(Log.INFO)
+    logfile = config.get("logfile", "receptorip.log")
+    if logfile.lower() != "none": Log.set_file(logfile)
+    ev = configura_receptor(config)
+    Tratador.plugins.registrar(evento_alarme=lambda event: submit(handle_alarm_event, event),
+                               heartbeat=lambda central: panel_seen(), central_identificada=lambda central: panel_reconnected())
+    threading.Thread(target=run_embedded_receptor, args=(ev,), daemon=True).start()
+
+def run_embedded_receptor(ev):
+    try: ev.loop()
+    except Exception as e: logging.error(f"Error fatal en el receptor embebido: {e}", exc_info=True)
+    logging.warning("Receptor embebido terminado.")
+
 def handle_shutdown(signum, frame):
-    logging.info("Cerrando addon..."); shutdown_event.set()
+    logging.info("Cerrando addon..."); shutdown_event.set(); poll_wakeup.set()
     mqtt_client.publish(AVAILABILITY_TOPIC, "offline", retain=True); time.sleep(1)
     mqtt_client.loop_stop(); alarm_client.close(); sys.exit(0)
 
@@ -145,11 +414,18 @@ if __name__ == "__main__":
     if MQTT_USER: mqtt_client.username_pw_set(MQTT_USER, MQTT_PASS)
     try: mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
     except Exception as e: logging.error(f"Fallo al conectar a MQTT: {e}"); sys.exit(1)
+    threading.Thread(target=state_actor_thread, daemon=True).start()
+    threading.Thread(target=panel_worker_thread, daemon=True).start()
     mqtt_client.loop_start()
     threading.Thread(target=status_polling_thread, daemon=True).start()
-    try:
-        logging.info("Iniciando 'receptorip'...")
-        proc = subprocess.Popen(["/alarme-intelbras/receptorip", "/alarme-intelbras/config.cfg"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-        threading.Thread(target=process_receptorip_output, args=(proc,), daemon=True).start()
-    except FileNotFoundError: logging.error("No se encontró 'receptorip'."); sys.exit(1)
+    if EMBEDDED_RECEPTOR:
+        logging.info("Iniciando receptor IP embebido...")
+        try: start_embedded_receptor()
+        except Exception as e: logging.error(f"No se pudo iniciar el receptor embebido: {e}"); sys.exit(1)
+    else:
+        try:
+            logging.info("Iniciando 'receptorip'...")
+            proc = subprocess.Popen([f"{RECEPTOR_DIR}/receptorip", RECEPTOR_CONFIG], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            threading.Thread(target=process_receptorip_output, args=(proc,), daemon=True).start()
+        except FileNotFoundError: logging.error("No se encontró 'receptorip'."); sys.exit(1)
     logging.info("Addon en funcionamiento. Esperando eventos..."); shutdown_event.wait()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os, json, socket, stat, time
+from .myeventloop import Handler, Log
+from .myeventloop.buffer import Buffer
+
+# Canal de eventos estruturados do Receptor IP (opcional).
+#
+# Socket Unix ao qual qualquer número de consumidores pode se conectar
+# para receber um registro JSON por linha para cada frame decodificado
+# (eventos de alarme, identificação, heartbeats, pedidos de data/hora,
+# frames desconhecidos) e para cada foto obtida, sem interpretar o log.
+#
+# Todo registro tem "seq" (sequencial do receptor), "ts" e "tipo"; os
+# referentes a uma central trazem "central", e os eventos de alarme os
+# campos de EventoAlarme.
+#
+# O event loop nunca espera por um consumidor lento: cada um tem um buffer
+# limitado, e registros que não cabem são descartados e contados. Quando
+# o buffer esvazia, o consumidor recebe um registro "descartados" com o
+# total "n" e o "seq" do último registro publicado (não consome um número
+# de sequência); lacunas em "seq" indicam o mesmo.
+
+class ConsumidorEventos(Handler):
+    # Bytes pendentes a partir dos quais novos registros são descartados
+    max_pendente = 64 * 1024
+
+    def __init__(self, canal, sock):
+        sock.setblocking(False)
+        super().__init__("consumidor de eventos %d" % sock.fileno(), sock, OSError)
+        self.canal = canal
+        self.send_buf = Buffer()
+        self.descartados = 0
+
+    def enviar(self, linha):
+        if len(self.send_buf) >= ConsumidorEventos.max_pendente:
+            self.descartados += 1
+            return
+        self.send_buf += linha
+        self.interest_changed()
+
+    def is_writable(self):
+        return not not self.send_buf
+
+    # Consumidores não enviam nada; a leitura só detecta o fechamento
+    def read_callback(self):
+        try:
+            dados = self.fd.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            dados = b""
+        if not dados:
+            self.destroy()
+
+    def write_callback(self):
+        try:
+            enviados = self.fd.send(self.send_buf[0:65536])
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self.log_debug("erro enviando", err)
+            self.destroy()
+            return
+        self.send_buf.consume(enviados)
+
+        if not self.send_buf and self.descartados:
+            self.log_warn("lento, %d registros descartados" % self.descartados)
+            registro = self.canal.carimbar({"tipo": "descartados", "n": self.descartados})
+            self.send_buf += CanalEventos.serializar(registro)
+            self.descartados = 0
+
+    def destroyed_callback(self):
+        self.canal.consumidores.discard(self)
+        self.log_info("desconectado")
+
+
+class CanalEventos(Handler):
+    def __init__(self, caminho):
+        # Remove o socket deixado por uma execução anterior
+        if os.path.exists(caminho) and stat.S_ISSOCK(os.stat(caminho).st_mode):
+            os.unlink(caminho)
+        fd = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        fd.bind(caminho)
+        fd.listen(5)
+        fd.setblocking(False)
+        super().__init__("canal de eventos", fd, OSError)
+        self.caminho = caminho
+        self.consumidores = set()
+        self.seq = 0
+        Log.info("canal de eventos em %s" % caminho)
+
+    def read_callback(self):
+        try:
+            sock, _ = self.fd.accept()
+        except OSError:
+            return
+        self.consumidores.add(ConsumidorEventos(self, sock))
+        self.log_info("consumidor conectado (%d)" % len(self.consumidores))
+
+    @staticmethod
+    def serializar(registro):
+        return (json.dumps(registro, separators=(",", ":"), ensure_ascii=False) + "\n").encode()
+
+    def carimbar(self, registro):
+        registro["seq"] = self.seq
+        registro["ts"] = round(time.time(), 3)
+        return registro
+
+    # Serializa uma única vez para todos os consumidores
+    def publicar(self, registro):
+        self.seq += 1
+        if not self.consumidores:
+            return
+        linha = CanalEventos.serializar(self.carimbar(registro))
+        for consumidor in self.consumidores:
+            consumidor.enviar(linha)
+
+    # Registrado como plugin foto_obtida
+    def foto(self, foto):
+        self.publicar({"tipo": "foto", "central": foto.central, "indice": foto.indice,
+                       "nrfoto": foto.nrfoto, "arquivo": foto.arquivo})
+
+    def destroyed_callback(self):
+        try:
+            os.unlink(self.caminho)
+        except OSError:
+            pass
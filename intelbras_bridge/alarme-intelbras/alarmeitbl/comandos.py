@@ -17,6 +17,8 @@ class ComandarCentral(TCPClientHandler, UtilsProtocolo):
         self.tam_senha = tam_senha
         self.extra = extra
         self.status = 1
+        # Motivo do último NAK (ou 0xf0f7 = central ocupada), se houver
+        self.motivo = None
         self.tratador = None
 
     def destroyed_callback(self):
@@ -50,34 +52,43 @@ class ComandarCentral(TCPClientHandler, UtilsProtocolo):
     def recv_callback(self, latest):
         self.log_debug("Recv", self.hexprint(latest))
 
-        compr = self.pacote_isecnet2_completo(self.recv_buf)
-        if not compr:
-            self.log_debug("Pacote incompleto")
-            return
+        # Pode haver mais de um pacote no buffer (e.g. pedidos em paralelo)
+        while not self.destroyed:
+            compr = self.pacote_isecnet2_completo(self.recv_buf)
+            if not compr:
+                if self.recv_buf:
+                    self.log_debug("Pacote incompleto")
+                return
 
-        pct, self.recv_buf = self.recv_buf[:compr], self.recv_buf[compr:]
+            # pct é uma memoryview, válida durante o tratamento da resposta
+            pct = self.recv_buf[:compr]
+            self.recv_buf.consume(compr)
 
-        if not self.pacote_isecnet2_correto(pct):
-            self.log_info("Pacote incorreto, desistindo")
-            self.destroy()
-            return
+            if not self.pacote_isecnet2_correto(pct):
+                self.log_info("Pacote incorreto, desistindo")
+                self.destroy()
+                return
 
-        cmd, payload = self.pacote_isecnet2_parse(pct)
-        self.log_debug("Resposta %04x" % cmd)
+            cmd, payload = self.pacote_isecnet2_parse(pct)
+            self.log_debug("Resposta %04x" % cmd)
 
-        if not self.tratador:
-            self.log_info("Sem tratador")
-            self.destroy()
-            return
+            if not self.tratador:
+                self.log_info("Sem tratador")
+                self.destroy()
+                return
 
-        self.conn_timeout.cancel()
-        self.tratador(cmd, payload)
+            self.conn_timeout.cancel()
+            self.tratador(cmd, payload)
 
     def resposta_autenticacao(self, cmd, payload):
         if cmd == 0xf0fd:
             self.nak(payload)
             return
 
+        if cmd == 0xf0f7:
+            self.ocupada()
+            return
+
         if cmd != 0xf0f0:
             self.log_info("Autenticacao: resp inesperada %04x" % cmd)
             self.destroy()
@@ -119,8 +130,7 @@ class ComandarCentral(TCPClientHandler, UtilsProtocolo):
             return
 
         if cmd == 0xf0f7:
-            self.log_info("Erro central ocupada")
-            self.destroy()
+            self.ocupada()
             return
 
         if cmd != self.cmd and cmd != 0xf0fe:
@@ -146,11 +156,17 @@ class ComandarCentral(TCPClientHandler, UtilsProtocolo):
         if len(payload) != 1:
             self.log_info("NAK invalido")
         else:
-            motivo = payload[0]
-            self.log_info("NAK motivo %02x" % motivo)
+            self.motivo = payload[0]
+            self.log_info("NAK motivo %02x" % self.motivo)
             self.status = 1
         self.destroy()
 
+    def ocupada(self):
+        self.log_info("Erro central ocupada")
+        self.motivo = 0xf0f7
+        self.status = 1
+        self.destroy()
+
 
 class AtivarDesativarCentral(ComandarCentral):
     def __init__(self, observer, ip_addr, cport, senha, tam_senha, extra, subcmd):
@@ -246,7 +262,7 @@ class SolicitarStatus(ComandarCentral):
 
     def resposta_comando_in(self, payload):
         # Documentação é base 1
-        payload = [0] + payload
+        payload = [0] + list(payload)
         print()
         print("*******************************************")
         if payload[1] == 0x01:
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import sqlite3, time
+
+# Fila persistente de fotos a obter, em SQLite (modo WAL).
+#
+# Cada foto é identificada por central + índice + nr. da foto, de modo que
+# um evento 0xb5 retransmitido não enfileira a mesma foto de novo. Também
+# guarda o progresso do download (fragmentos já gravados no arquivo
+# temporário), para que uma nova tentativa, inclusive após reiniciar o
+# programa, continue de onde parou.
+#
+# Fotos concluídas ou descartadas permanecem na tabela por algum tempo,
+# apenas para a deduplicação.
+
+class FilaFotos:
+    # Tempo (s) que fotos encerradas permanecem para deduplicação
+    retencao = 86400
+    # Intervalo mínimo (s) entre remoções das fotos encerradas expiradas
+    intervalo_expurgo = 3600
+
+    def __init__(self, caminho=":memory:"):
+        self.db = sqlite3.connect(caminho, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS fotos (
+            central TEXT NOT NULL,
+            indice INTEGER NOT NULL,
+            nrfoto INTEGER NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL,
+            nr_fragmentos INTEGER,
+            gravados INTEGER NOT NULL DEFAULT 0,
+            bytes_gravados INTEGER NOT NULL DEFAULT 0,
+            temporario TEXT,
+            atualizado REAL NOT NULL,
+            PRIMARY KEY (central, indice, nrfoto))""")
+        self.expurgar()
+
+    # Remove as fotos encerradas há mais que o tempo de retenção. Chamado na
+    # abertura e, num programa de longa duração, a cada foto encerrada.
+    def expurgar(self):
+        self.expurgado = time.monotonic()
+        self.db.execute("DELETE FROM fotos WHERE estado != 'pendente' AND atualizado < ?",
+                        (time.time() - FilaFotos.retencao,))
+
+    # Retorna False se a foto já está (ou esteve recentemente) na fila
+    def adicionar(self, central, indice, nrfoto, tentativas):
+        cur = self.db.execute("""INSERT OR IGNORE INTO fotos
+            (central, indice, nrfoto, tentativas, atualizado) VALUES (?, ?, ?, ?, ?)""",
+            (central, indice, nrfoto, tentativas, time.time()))
+        return cur.rowcount == 1
+
+    # Fotos pendentes deixadas por uma execução anterior
+    def pendentes(self):
+        return self.db.execute("""SELECT central, indice, nrfoto, tentativas,
+            nr_fragmentos, gravados, bytes_gravados, temporario
+            FROM fotos WHERE estado = 'pendente' ORDER BY atualizado""").fetchall()
+
+    def atualizar(self, item):
+        self.db.execute("""UPDATE fotos SET tentativas = ?, nr_fragmentos = ?,
+            gravados = ?, bytes_gravados = ?, temporario = ?, atualizado = ?
+            WHERE central = ? AND indice = ? AND nrfoto = ?""",
+            (item.tentativas, item.nr_fragmentos, item.gravados, item.bytes_gravados,
+             item.temporario, time.time(), item.ip_addr_cli, item.indice, item.nrfoto))
+
+    # estado: 'concluida' ou 'descartada'
+    def encerrar(self, item, estado):
+        self.db.execute("""UPDATE fotos SET estado = ?, temporario = NULL, atualizado = ?
+            WHERE central = ? AND indice = ? AND nrfoto = ?""",
+            (estado, time.time(), item.ip_addr_cli, item.indice, item.nrfoto))
+        if time.monotonic() - self.expurgado >= FilaFotos.intervalo_expurgo:
+            self.expurgar()
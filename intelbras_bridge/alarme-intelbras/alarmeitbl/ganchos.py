@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os, shlex, subprocess
+from collections import deque
+from .myeventloop import Handler, Log
+
+# Execução assíncrona dos ganchos (scripts externos).
+#
+# Cada gancho roda num processo filho cuja saída é lida pelo event loop,
+# de modo que o tratamento dos eventos (e o ACK para a central) não espera
+# o script terminar. Ganchos de uma mesma chave (em geral, o endereço da
+# central) rodam em ordem, um de cada vez; chaves diferentes rodam em
+# paralelo até o limite de concorrência.
+
+class ProcessoGancho(Handler):
+    # Tamanho máximo da saída guardada para o log
+    max_saida = 4096
+    # Espera máxima pelo término do processo após o EOF da saída. Em geral
+    # é imediata: o EOF vem do próprio término do processo.
+    espera_coleta = 0.5
+
+    def __init__(self, executor, chave, comando, tempo_limite):
+        self.proc = subprocess.Popen(comando, shell=True,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        super().__init__("gancho %d" % self.proc.pid, self.proc.stdout, OSError)
+
+        self.executor = executor
+        self.chave = chave
+        self.comando = comando
+        self.saida = bytearray()
+        self.eof = False
+        self.status = None
+        self.to_limite = self.timeout("limite", tempo_limite, self.timeout_limite)
+        self.log_debug2("executando", comando)
+
+    def is_readable(self):
+        return not self.eof
+
+    def read_callback(self):
+        try:
+            data = os.read(self.fd.fileno(), 4096)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self.log_warn("erro lendo saida", err)
+            data = b''
+
+        if data:
+            self.saida += data[:max(0, ProcessoGancho.max_saida - len(self.saida))]
+            return
+
+        self.eof = True
+        try:
+            status = self.proc.wait(ProcessoGancho.espera_coleta)
+        except subprocess.TimeoutExpired:
+            # Fechou a saída mas continua rodando: fica a cargo do tempo limite
+            self.log_debug("saida fechada, processo ainda em execucao")
+            return
+        self.terminou(status)
+
+    def timeout_limite(self, _):
+        self.log_warn("tempo limite excedido, encerrando:", self.comando)
+        self.proc.kill()
+        # Netos do processo podem manter o pipe aberto; não esperar EOF
+        self.terminou(self.proc.wait())
+
+    def terminou(self, status):
+        self.status = status
+        saida = self.saida.decode(errors="replace").strip()
+        if status:
+            self.log_warn("terminou com status %d: %s" % (status, self.comando), saida)
+        else:
+            self.log_debug("terminou: %s" % self.comando, saida)
+        self.destroy()
+
+    def destroyed_callback(self):
+        self.executor.terminado(self)
+
+
+class ExecutorGanchos:
+    def __init__(self, max_simultaneos=4, tempo_limite=60):
+        self.max_simultaneos = max_simultaneos
+        self.tempo_limite = tempo_limite
+        self.filas = {}         # chave -> deque de comandos pendentes
+        self.executando = {}    # chave -> ProcessoGancho
+        self.espera = deque()   # chaves com comandos pendentes e nada executando
+
+    # Ganchos que não fazem nada não justificam criar um processo
+    @staticmethod
+    def nulo(gancho):
+        return not gancho or gancho.strip() in (":", "true", "/bin/true")
+
+    def executar(self, chave, gancho, *args):
+        if ExecutorGanchos.nulo(gancho):
+            return
+        comando = " ".join([gancho] + [shlex.quote(str(arg)) for arg in args])
+
+        fila = self.filas.setdefault(chave, deque())
+        fila.append(comando)
+        if len(fila) == 1 and chave not in self.executando:
+            self.espera.append(chave)
+        self._despachar()
+
+    def _despachar(self):
+        while self.espera and len(self.executando) < self.max_simultaneos:
+            chave = self.espera.popleft()
+            fila = self.filas[chave]
+            comando = fila.popleft()
+            if not fila:
+                del self.filas[chave]
+            try:
+                self.executando[chave] = ProcessoGancho(self, chave, comando, self.tempo_limite)
+            except OSError as err:
+                Log.warn("falha ao executar gancho", comando, err)
+                if chave in self.filas:
+                    self.espera.append(chave)
+
+    def terminado(self, processo):
+        del self.executando[processo.chave]
+        if processo.chave in self.filas:
+            self.espera.append(processo.chave)
+        self._despachar()
+
+    def pendentes(self):
+        return len(self.executando) + sum(len(fila) for fila in self.filas.values())
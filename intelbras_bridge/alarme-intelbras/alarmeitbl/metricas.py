@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+# Métricas simples de latência, acumuladas em memória e reportadas
+# periodicamente no log (e.g. pelo watchdog do receptorip)
+
+class Latencia:
+    def __init__(self, nome):
+        self.nome = nome
+        self.zerar()
+
+    def zerar(self):
+        self.amostras = 0
+        self.soma = 0.0
+        self.maxima = 0.0
+        self.ultima = 0.0
+
+    def registrar(self, segundos):
+        self.amostras += 1
+        self.soma += segundos
+        self.maxima = max(self.maxima, segundos)
+        self.ultima = segundos
+
+    def media(self):
+        if not self.amostras:
+            return 0.0
+        return self.soma / self.amostras
+
+    def resumo(self):
+        if not self.amostras:
+            return "%s: sem amostras" % self.nome
+        return "%s: n=%d media=%.1fms max=%.1fms ultima=%.1fms" % \
+            (self.nome, self.amostras, self.media() * 1000, \
+             self.maxima * 1000, self.ultima * 1000)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import time, select, datetime, os, signal
+import time, select, selectors, datetime, os, signal, heapq, itertools
 from abc import ABC, abstractmethod
 
 class Log:
@@ -64,6 +64,9 @@ class Log:
 
     @staticmethod
     def log(level, *msg):
+        if level > Log.log_level and level > Log.mail_level:
+            # Filtered out; avoid formatting (hot path for debug2)
+            return
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         msgw = now
         for item in msg:
@@ -179,22 +182,53 @@ class Timeout:
     It is generally better not to instantiate it directly, but by using
     Timeout.new(), or Handler.timeout() if within a Handler.
     """
+    # Live timeouts, indexed by id()
     pending = {}
+    # Min-heap of [queued deadline, seq, timeout]. Cancelled timeouts, and
+    # timeouts restarted to an earlier deadline, leave stale entries behind,
+    # recognized by a seq that no longer matches the timeout's, and
+    # discarded lazily. A timeout postponed by restart() keeps its entry,
+    # which is pushed back to the new deadline when it reaches the top.
+    heap = []
+    # Live timeouts grouped by owner: id(owner) -> {id(timeout): timeout}
+    by_owner = {}
+    seq = itertools.count()
+
+    @staticmethod
+    def now():
+        # Timeouts are scheduled using a monotonic clock, immune to
+        # wall-clock adjustments (e.g. NTP or the panel setting the date)
+        return time.monotonic()
 
     @staticmethod
     def _next():
         # Returns next timeout to be run
-        to = time.time() + 86400
-        chosen = None
-        for candidate in Timeout.pending.values():
-            if candidate.absolute_to < to:
-                to = candidate.absolute_to
-                chosen = candidate
-        return to, chosen
+        heap = Timeout.heap
+        while heap:
+            absolute_to, seq, candidate = heap[0]
+            if candidate._seq != seq:
+                heapq.heappop(heap)
+            elif absolute_to < candidate.absolute_to:
+                # Postponed after being queued
+                candidate._queued_to = candidate.absolute_to
+                heapq.heapreplace(heap, [candidate.absolute_to, seq, candidate])
+            else:
+                return absolute_to, candidate
+        return Timeout.now() + 86400, None
+
+    @staticmethod
+    def _compact():
+        # Rebuilds the heap when stale entries dominate it, which happens
+        # with timeouts restarted often (e.g. communication timeouts)
+        heap = Timeout.heap
+        if len(heap) <= 64 or len(heap) <= 2 * len(Timeout.pending):
+            return
+        Timeout.heap = [entry for entry in heap if entry[2]._seq == entry[1]]
+        heapq.heapify(Timeout.heap)
 
     @staticmethod
     def next_absolute():
-        # Returns next timeout to be run, in absolute UNIX time.
+        # Returns next timeout to be run, in absolute monotonic time.
         to, chosen = Timeout._next()
         if chosen:
             chosen = chosen.label
@@ -204,27 +238,39 @@ class Timeout:
     def next_relative():
         # Returns next timeout to be run, in relative time.
         absolute_to, chosen = Timeout.next_absolute()
-        return max(0, absolute_to - time.time()), chosen
+        return max(0, absolute_to - Timeout.now()), chosen
  
     @staticmethod
     def handle():
         # Run next due timeout, calling the task back, and cancel it
         to, chosen = Timeout._next()
-        if not chosen or to > time.time():
+        if not chosen or to > Timeout.now():
             return False
 
-        del Timeout.pending[id(chosen)]
-        Log.debug2("= timeout %s" % chosen.label)
+        heapq.heappop(Timeout.heap)
+        chosen._unlink()
+        Log.debug2("= timeout", chosen.label)
         chosen.callback(chosen)
+        if isinstance(chosen.owner, Handler):
+            chosen.owner.interest_changed()
         return True
 
+    @staticmethod
+    def handle_due(budget):
+        # Run due timeouts, up to a budget. Returns the number of timeouts run.
+        # Timeouts left over are due immediately, so the next poll will not
+        # block and they will be run in the next cycle.
+        run = 0
+        while run < budget and Timeout.handle():
+            run += 1
+        return run
+
     @staticmethod
     def cancel_and_inval_by_owner(owner):
         # Cancel and invalidate all timeouts for a given owner (typically a Handler)
-        for candidate in list(Timeout.pending.values()):
-            if owner is candidate.owner:
-                candidate.invalidate()
-                del Timeout.pending[id(candidate)]
+        for candidate in list(Timeout.by_owner.get(id(owner), {}).values()):
+            candidate.invalidate()
+            candidate._unlink()
 
     @staticmethod
     def new(label, relative_to, callback):
@@ -244,8 +290,10 @@ class Timeout:
         self.relative_to = relative_to
         self.callback = callback
         self.invalidated = False
+        self._seq = None
         self._restart()
-        Log.debug2("+ timeout %s %f" % (self.label, self.relative_to))
+        # Arguments are only formatted by Log if debug2 is enabled
+        Log.debug2("+ timeout", self.label, self.relative_to)
 
     def invalidate(self):
         """
@@ -268,13 +316,34 @@ class Timeout:
         """
         if self.invalidated:
             raise Exception("called Timeout.remaining() on invalidated")
-        return max(0, self.absolute_to - time.time())
+        return max(0, self.absolute_to - Timeout.now())
 
     def _restart(self):
         if self.invalidated:
             raise Exception("called Timeout._restart() on invalidated")
-        self.absolute_to = time.time() + self.relative_to
+        self.absolute_to = Timeout.now() + self.relative_to
+        if self._seq is not None and self.absolute_to >= self._queued_to:
+            # Alive and postponed (the common case, e.g. a communication
+            # timeout restarted on every receive): the queued entry stays
+            # and is moved only if it reaches the top of the heap
+            return
+        self._seq = next(Timeout.seq)
+        self._queued_to = self.absolute_to
+        heapq.heappush(Timeout.heap, [self.absolute_to, self._seq, self])
         Timeout.pending[id(self)] = self
+        if self.owner is not None:
+            Timeout.by_owner.setdefault(id(self.owner), {})[id(self)] = self
+        Timeout._compact()
+
+    def _unlink(self):
+        # Removes from the indexes; the heap entry becomes stale
+        self._seq = None
+        del Timeout.pending[id(self)]
+        if self.owner is not None:
+            owned = Timeout.by_owner[id(self.owner)]
+            del owned[id(self)]
+            if not owned:
+                del Timeout.by_owner[id(self.owner)]
 
     def restart(self):
         """
@@ -285,7 +354,7 @@ class Timeout:
         if self.invalidated:
             raise Exception("called Timeout.restart() on invalidated")
         self._restart()
-        Log.debug2("> timeout %s %f" % (self.label, self.relative_to))
+        Log.debug2("> timeout", self.label, self.relative_to)
 
     def reset(self, relative_to):
         """
@@ -308,9 +377,8 @@ class Timeout:
             raise Exception("called Timeout.cancel() on invalidated")
         if not self.alive():
             return False
-        remaining_time = self.absolute_to - time.time()
-        Log.debug2("- timeout %s (remaining %f)" % (self.label, remaining_time))
-        del Timeout.pending[id(self)]
+        Log.debug2("- timeout", self.label, "remaining", self.absolute_to - Timeout.now())
+        self._unlink()
         return True
 
     def alive(self):
@@ -329,6 +397,8 @@ class Handler(ABC):
     """
 
     items = {}
+    # Handlers indexed by file descriptor number
+    by_fd = {}
 
     @staticmethod
     def readable_fds():
@@ -408,6 +478,7 @@ class Handler(ABC):
 
         Override it if you want to use non-blocking exceptional handling
         (e.g. TCP OOB), meaning you need to return True when apropriate.
+        Only SelectPoller supports it; pass one to EventLoop() in this case.
         """
         return False
 
@@ -424,10 +495,13 @@ class Handler(ABC):
 
     @staticmethod
     def find_by_fd(fd):
-        for handler in Handler.items.values():
-            if fd is handler.fd:
-                return handler
-        return None
+        """
+        Returns the Handler that encapsulates a file descriptor (either
+        the object or its number), or None.
+        """
+        if not isinstance(fd, int):
+            fd = fd.fileno()
+        return Handler.by_fd.get(fd, None)
 
     def __init__(self, label, fd, fd_exceptions):
         """
@@ -443,7 +517,28 @@ class Handler(ABC):
         self.fd = fd
         self.fd_exceptions = fd_exceptions
         self.destroyed = False
+        self.fdno = fd.fileno()
         Handler.items[id(self)] = self
+        Handler.by_fd[self.fdno] = self
+        # Registration is deferred to the next cycle, since subclasses
+        # typically finish their initialization after this constructor
+        self.interest_changed()
+
+    def interest_changed(self):
+        """
+        Tells the event loop that is_readable(), is_writable() or
+        is_exceptional() may return something different from the last time
+        they were evaluated, so the file descriptor registration must be
+        updated before the next poll.
+
+        The event loop calls this automatically after every callback of
+        this Handler, and after every Timeout owned by it. Call it yourself
+        when the state changes from another context, e.g. when data is
+        queued for sending by a different Handler. The ready-made TCP and
+        UDP handlers already do it in send() and sendto().
+        """
+        if not self.destroyed:
+            Poller.get().mark(self)
 
     def destroy(self):
         """
@@ -458,6 +553,9 @@ class Handler(ABC):
         self.destroyed = True
         self.log_debug2("destroyed")
         del Handler.items[id(self)]
+        if Handler.by_fd.get(self.fdno) is self:
+            del Handler.by_fd[self.fdno]
+        Poller.get().forget(self)
         Timeout.cancel_and_inval_by_owner(self)
         try:
             self.fd.close()
@@ -517,6 +615,184 @@ class Handler(ABC):
         return Timeout(self, label, relative_to, callback)
 
 
+class Poller(ABC):
+    """
+    Abstract strategy used by the event loop to wait for file descriptors
+    to become ready. A single Poller is active at any given time; it is
+    created on demand (see Poller.get()) or passed to EventLoop().
+
+    Handlers do not talk to the Poller directly. They call
+    Handler.interest_changed() and the Poller re-evaluates their
+    is_readable()/is_writable()/is_exceptional() state at the next cycle.
+    """
+
+    current = None
+
+    @staticmethod
+    def get():
+        """
+        Returns the active Poller, creating the default one if necessary.
+        """
+        if not Poller.current:
+            Poller.current = SelectorsPoller()
+        return Poller.current
+
+    @staticmethod
+    def use(poller):
+        """
+        Replaces the active Poller. Existing Handlers are carried over.
+        Arguments:
+            poller: the new Poller instance
+        """
+        if Poller.current is poller:
+            return
+        if Poller.current:
+            Poller.current.close()
+        Poller.current = poller
+        for handler in Handler.items.values():
+            poller.mark(handler)
+
+    # Lists of file descriptors, for the benefit of EventLoop.before_select().
+    # Only filled by pollers that rebuild them at every cycle.
+    crd = None
+    cwr = None
+    cex = None
+
+    @abstractmethod
+    def mark(self, handler):
+        """
+        Takes note that the interest of a Handler may have changed.
+        """
+        pass
+
+    @abstractmethod
+    def forget(self, handler):
+        """
+        Removes a Handler that is being destroyed. Called before its
+        file descriptor is closed.
+        """
+        pass
+
+    @abstractmethod
+    def prepare(self):
+        """
+        Called at every cycle before poll(). Returns whether there is any
+        file descriptor to be watched.
+        """
+        pass
+
+    @abstractmethod
+    def poll(self, timeout):
+        """
+        Waits for file descriptors to become ready, up to the given timeout
+        in seconds. Returns a list of (handler, readable, writable,
+        exceptional) tuples.
+        """
+        pass
+
+    def close(self):
+        """
+        Releases resources held by the Poller, if any.
+        """
+        pass
+
+
+class SelectPoller(Poller):
+    """
+    Poller based on select.select(). Every Handler is asked about its
+    interest at every cycle, so it costs O(handlers) per cycle and it is
+    limited to file descriptors below FD_SETSIZE (usually 1024).
+
+    It is the only Poller that supports is_exceptional().
+    """
+
+    def mark(self, handler):
+        pass
+
+    def forget(self, handler):
+        pass
+
+    def prepare(self):
+        self.crd = Handler.readable_fds()
+        self.cwr = Handler.writable_fds()
+        self.cex = Handler.exceptional_fds()
+        return not not (self.crd or self.cwr or self.cex)
+
+    def poll(self, timeout):
+        rd, wr, ex = select.select(self.crd, self.cwr, self.cex, timeout)
+        ready = []
+        for fd in rd:
+            ready.append((Handler.find_by_fd(fd), True, False, False))
+        for fd in wr:
+            ready.append((Handler.find_by_fd(fd), False, True, False))
+        for fd in ex:
+            ready.append((Handler.find_by_fd(fd), False, False, True))
+        return ready
+
+
+class SelectorsPoller(Poller):
+    """
+    Poller based on the selectors module (epoll on Linux, kqueue on BSD).
+    File descriptors stay registered between cycles, and only the Handlers
+    that called interest_changed() are re-evaluated, so the cost per cycle
+    is proportional to the activity, not to the number of Handlers.
+
+    is_exceptional() is not supported: prepare() raises an exception if
+    a Handler returns True. Use SelectPoller if you need it.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.dirty = {}
+        self.masks = {}
+
+    def mark(self, handler):
+        self.dirty[id(handler)] = handler
+
+    def forget(self, handler):
+        self.dirty.pop(id(handler), None)
+        if self.masks.pop(id(handler), 0):
+            self.selector.unregister(handler.fd)
+
+    def prepare(self):
+        for handler in self.dirty.values():
+            mask = 0
+            if handler.is_readable():
+                mask |= selectors.EVENT_READ
+            if handler.is_writable():
+                mask |= selectors.EVENT_WRITE
+            if handler.is_exceptional():
+                raise Exception("SelectorsPoller does not support is_exceptional(), use SelectPoller")
+
+            old_mask = self.masks.get(id(handler), 0)
+            if mask == old_mask:
+                continue
+            if not old_mask:
+                self.selector.register(handler.fd, mask, handler)
+            elif not mask:
+                self.selector.unregister(handler.fd)
+            else:
+                self.selector.modify(handler.fd, mask, handler)
+
+            if mask:
+                self.masks[id(handler)] = mask
+            else:
+                del self.masks[id(handler)]
+
+        self.dirty.clear()
+        return not not self.masks
+
+    def poll(self, timeout):
+        ready = []
+        for key, mask in self.selector.select(timeout):
+            ready.append((key.data, not not (mask & selectors.EVENT_READ),
+                          not not (mask & selectors.EVENT_WRITE), False))
+        return ready
+
+    def close(self):
+        self.selector.close()
+
+
 class EventLoop:
     """
     Class that represents a program-wide event loop. This class may be
@@ -524,13 +800,22 @@ class EventLoop:
     any given time.
     """
 
-    def __init__(self):
+    # Maximum number of due timeouts run per cycle, so a burst of timeouts
+    # does not delay servicing the file descriptors
+    timeout_budget = 64
+
+    def __init__(self, poller=None):
         """
         Instantiates the event loop.
+        Arguments:
+            poller: Poller instance to be used. If omitted, the currently
+                    active Poller is kept (by default, SelectorsPoller).
         """
         # typically used in TCP code to avoid unexpected signal
         # when a socket is written but was RSTed by the remote side
         signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+        if poller:
+            Poller.use(poller)
 
     def loop(self):
         """
@@ -553,37 +838,41 @@ class EventLoop:
         Called just before select() in every event loop.
         Override if you need to do something at this moment, like printing
         a message or changing the lists of file descriptors.
+
+        The lists are only available when the active Poller rebuilds them
+        at every cycle (SelectPoller); otherwise they are None.
         """
         if to_label:
-            Log.debug2("Next timeout %f %s" % (next_to, to_label))
+            Log.debug2("Next timeout", next_to, to_label)
 
     def cycle(self):
         # The main event loop cycle
         self.started_cycle()
 
-        crd = Handler.readable_fds()
-        cwr = Handler.writable_fds()
-        cex = Handler.exceptional_fds()
+        poller = Poller.get()
+        has_fds = poller.prepare()
         next_to, to_label = Timeout.next_relative()
 
-        if not crd and not cwr and not cex and not to_label:
+        if not has_fds and not to_label:
             Log.debug2("No remaining tasks")
             return False
 
-        self.before_select(crd, cwr, cex, next_to, to_label)
-
-        rd, wr, ex = select.select(crd, cwr, cex, next_to)
-
-        if rd:
-            handler = Handler.find_by_fd(rd[0])
-            handler.read_callback()
-        elif wr:
-            handler = Handler.find_by_fd(wr[0])
-            handler.write_callback()
-        elif ex:
-            handler = Handler.find_by_fd(ex[0])
-            handler.exceptional_callback()
-        else:
-            Timeout.handle()
+        self.before_select(poller.crd, poller.cwr, poller.cex, next_to, to_label)
+
+        ready = poller.poll(next_to)
+
+        # Every ready descriptor is serviced in the same cycle. Interest is
+        # checked again since an earlier callback may have changed it
+        # (or destroyed the handler altogether).
+        for handler, rd, wr, ex in ready:
+            if rd and not handler.destroyed and handler.is_readable():
+                handler.read_callback()
+            if wr and not handler.destroyed and handler.is_writable():
+                handler.write_callback()
+            if ex and not handler.destroyed and handler.is_exceptional():
+                handler.exceptional_callback()
+            handler.interest_changed()
+
+        Timeout.handle_due(self.timeout_budget)
 
         return True
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+class Buffer:
+    """
+    Byte buffer used by the stream handlers for received and pending
+    outgoing data.
+
+    Data is appended at the end and consumed from the beginning by
+    advancing an offset, so consuming never copies the remaining data.
+    The consumed area is reclaimed when it dominates the buffer.
+
+    Slicing returns a memoryview of the buffer contents, not a copy.
+    Views should not be kept beyond the callback where they were obtained;
+    use bytes() on them if the data must be retained.
+    """
+
+    # Consumed area is only reclaimed above this size, unless the buffer
+    # became empty
+    compact_threshold = 4096
+
+    def __init__(self):
+        self._data = bytearray()
+        self._start = 0
+
+    def __len__(self):
+        return len(self._data) - self._start
+
+    def __bool__(self):
+        return len(self._data) > self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.view()[i]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Buffer index out of range")
+        return self._data[self._start + i]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __iadd__(self, data):
+        self.extend(data)
+        return self
+
+    def view(self):
+        """
+        Returns a memoryview of the unconsumed data.
+        """
+        return memoryview(self._data)[self._start:]
+
+    def extend(self, data):
+        """
+        Appends data to the buffer.
+        Arguments:
+            data: bytes-like object or iterable of ints
+        """
+        if self._start and (self._start == len(self._data) or
+                (self._start >= Buffer.compact_threshold and
+                 self._start * 2 >= len(self._data))):
+            self._compact()
+        try:
+            self._data.extend(data)
+        except BufferError:
+            # Some view is still alive; move on to a new bytearray and
+            # leave the old one to the view holder
+            self._data = self._data[self._start:]
+            self._start = 0
+            self._data.extend(data)
+
+    def consume(self, n):
+        """
+        Discards n octets from the beginning of the buffer.
+        """
+        self._start = min(len(self._data), self._start + n)
+
+    def clear(self):
+        """
+        Discards all data.
+        """
+        self._start = len(self._data)
+
+    def _compact(self):
+        try:
+            del self._data[:self._start]
+        except BufferError:
+            self._data = self._data[self._start:]
+        self._start = 0
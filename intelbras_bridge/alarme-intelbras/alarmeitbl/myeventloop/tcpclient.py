@@ -3,6 +3,7 @@
 import socket, time, datetime
 from abc import ABC, abstractmethod
 from . import Timeout, Handler, EventLoop
+from .buffer import Buffer
 
 class TCPClientHandler(Handler):
     """
@@ -22,8 +23,9 @@ class TCPClientHandler(Handler):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         super().__init__("client %s:%d" % addr, sock, socket.error)
 
-        self.recv_buf = []
-        self.send_buf = []
+        self.recv_buf = Buffer()
+        self.send_buf = Buffer()
+        self.recv_area = bytearray(4096)
 
         self.fd.setblocking(0)
         self.connecting = True
@@ -35,16 +37,17 @@ class TCPClientHandler(Handler):
 
     def read_callback(self):
         try:
-            data = self.fd.recv(4096)
+            n = self.fd.recv_into(self.recv_area)
         except socket.error as err:
             self.log_warn("exception reading sk", err)
             self.destroy()
             return
 
-        if not data:
+        if not n:
             self.shutdown_callback()
             return
 
+        data = memoryview(self.recv_area)[:n]
         self.recv_buf += data
         self.recv_callback(data)
 
@@ -53,12 +56,13 @@ class TCPClientHandler(Handler):
         """
         Override this abstract method to receive data from TCP connection.
 
-        This class adds all new data to Handler.read_buf variable, so you
-        don't need to handle buffering yourself. (And you should drain
-        read_buf as data is processed, to save memory.)
+        This class adds all new data to the recv_buf Buffer, so you
+        don't need to handle buffering yourself. (And you should consume()
+        recv_buf as data is processed, to save memory.)
 
         Arguments:
-            latest: new data octets just received
+            latest: memoryview of the new data octets just received,
+                    only valid until this method returns
         """
         pass
 
@@ -103,6 +107,7 @@ class TCPClientHandler(Handler):
             data: bytes to send
         """
         self.send_buf += data
+        self.interest_changed()
 
     def send_callback(self):
         if self.connecting:
@@ -110,7 +115,7 @@ class TCPClientHandler(Handler):
             return
 
         try:
-            sent = self.fd.send(bytearray(self.send_buf[0:4096]))
+            sent = self.fd.send(self.send_buf[0:4096])
         except socket.error as err:
             self.log_warn("exception writing sk", err)
             self.destroy()
@@ -120,11 +125,14 @@ class TCPClientHandler(Handler):
             self.destroy()
             return 0
 
-        self.send_buf = self.send_buf[sent:]
+        self.send_buf.consume(sent)
+        if not self.send_buf:
+            self.interest_changed()
         return sent
 
     def _connection_callback(self):
         self.connecting = False
+        self.interest_changed()
         if self.fd.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
             self.connection_callback(False)
             self.destroy()
@@ -3,6 +3,7 @@
 import socket, time, datetime
 from abc import ABC, abstractmethod
 from . import Timeout, Handler, EventLoop
+from .buffer import Buffer
 
 class TCPServerHandler(Handler):
     """
@@ -19,21 +20,23 @@ class TCPServerHandler(Handler):
             sock: the socket file descriptor of the connection
         """
         super().__init__("%s:%d" % addr, sock, socket.error)
-        self.recv_buf = []
-        self.send_buf = []
+        self.recv_buf = Buffer()
+        self.send_buf = Buffer()
+        self.recv_area = bytearray(4096)
 
     def read_callback(self):
         try:
-            data = self.fd.recv(4096)
+            n = self.fd.recv_into(self.recv_area)
         except socket.error as err:
             self.log_warn("exception reading sk", err)
             self.destroy()
             return
 
-        if not data:
+        if not n:
             self.shutdown_callback()
             return
 
+        data = memoryview(self.recv_area)[:n]
         self.recv_buf += data
         self.recv_callback(data)
 
@@ -42,12 +45,13 @@ class TCPServerHandler(Handler):
         """
         Override this abstract method to receive data from TCP connection.
 
-        This class adds all new data to Handler.read_buf variable, so you
-        don't need to handle buffering yourself. (And you should drain
-        read_buf as data is processed, to save memory.)
+        This class adds all new data to the recv_buf Buffer, so you
+        don't need to handle buffering yourself. (And you should consume()
+        recv_buf as data is processed, to save memory.)
 
         Arguments:
-            latest: new data octets just received
+            latest: memoryview of the new data octets just received,
+                    only valid until this method returns
         """
         pass
 
@@ -71,13 +75,14 @@ class TCPServerHandler(Handler):
             data: bytes to send
         """
         self.send_buf += data
+        self.interest_changed()
 
     def write_callback(self):
         self.send_callback()
 
     def send_callback(self):
         try:
-            sent = self.fd.send(bytearray(self.send_buf[0:4096]))
+            sent = self.fd.send(self.send_buf[0:4096])
         except socket.error as err:
             self.log_warn("exception writing sk", err)
             self.destroy()
@@ -87,7 +92,9 @@ class TCPServerHandler(Handler):
             self.destroy()
             return 0
 
-        self.send_buf = self.send_buf[sent:]
+        self.send_buf.consume(sent)
+        if not self.send_buf:
+            self.interest_changed()
         return sent
 
 
@@ -127,7 +134,7 @@ class TCPServerEventLoop(EventLoop):
     """
     # listener_class expected to be subclass of TCPListener
     # handler_class expected to be subclass of TCPServerHandler
-    def __init__(self, addr, listener_class, handler_class):
+    def __init__(self, addr, listener_class, handler_class, poller=None):
         """
         Instantiates an event loop plus a TCP Server.
         Arguments:
@@ -139,6 +146,7 @@ class TCPServerEventLoop(EventLoop):
             handler_class: Class responsible for encapsulating the sockets
                            of TCP connections stemming from the listening
                            socket. Typically a subclass of TCPServerHandler.
+            poller: Poller instance to be used (see EventLoop)
         """
         listener = listener_class(addr, handler_class)
-        super().__init__()
+        super().__init__(poller)
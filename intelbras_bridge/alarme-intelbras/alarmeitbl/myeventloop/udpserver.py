@@ -52,6 +52,8 @@ class UDPServerHandler(Handler):
         except socket.error as err:
             self.log_warn("exception writing sk", err)
         self.send_buf = self.send_buf[1:]
+        if not self.send_buf:
+            self.interest_changed()
 
     def sendto(self, addr, dgram):
         """
@@ -63,8 +65,9 @@ class UDPServerHandler(Handler):
             dgram: packet data
         """
         self.send_buf.append({'addr': addr, 'dgram': dgram})
+        self.interest_changed()
 
 
 class UDPServerEventLoop(EventLoop):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, poller=None):
+        super().__init__(poller)
@@ -1,20 +1,32 @@
 #!/usr/bin/env python3
 
-import time
+import os, time, tempfile
 from .utils_proto import *
 from .comandos import ComandarCentral
 
-# Agente que obtem fotos de um evento de sensor com câmera
+# Agente que obtem fotos de eventos de sensor com câmera. Uma mesma sessão
+# autenticada obtém, em sequência, todas as fotos prontas para a central,
+# pedindo a próxima ao observador (TratadorDeFotos) a cada foto concluída.
 
 class ObtemFotosDeEvento(ComandarCentral):
-    def __init__(self, ip_addr, cport, indice, nrfoto, senha, tam_senha, observer, folder):
-        extra = [indice, nrfoto]
+    # Número de pedidos de fragmento pendentes simultaneamente.
+    # 1 = stop-and-wait (um round-trip por fragmento)
+    janela = 4
+    # A cada tantos fragmentos, o progresso é gravado de forma durável
+    intervalo_progresso = 16
+
+    def __init__(self, ip_addr, cport, item, senha, tam_senha, observer, folder):
+        extra = [item.indice, item.nrfoto]
         super().__init__(observer, ip_addr, cport, senha, tam_senha, extra)
-        self.log_info("Iniciando obtencao de foto %d:%d" % (indice, nrfoto))
-        self.indice = indice
-        self.nrfoto = nrfoto
-        self.arquivo = ""
+        self.ip_addr = ip_addr
         self.folder = folder
+        self.janela = ObtemFotosDeEvento.janela
+        # Pedidos abandonados após NAK, como (indice, foto, fragmento), cujas
+        # respostas ainda podem chegar, inclusive depois de passar à próxima foto
+        self.abandonados = set()
+        self.item = item
+        self.arquivo = ""
+        self.temporario = None
 
         # Se destruído com esse status, reporta erro fatal
         self.status = 2
@@ -23,28 +35,98 @@ class ObtemFotosDeEvento(ComandarCentral):
 
     # override completo
     def destroyed_callback(self):
-        # Informa observador sobre status final da tarefa
-        self.observer.resultado_foto(self.indice, self.nrfoto, \
-                                     self.status, self.arquivo)
+        # Informa observador sobre status final da foto em andamento
+        if self.item:
+            self.fecha_temporario()
+            self.observer.resultado_foto(self.item, self.status, self.arquivo, self.motivo)
+            self.item = None
+        self.observer.sessao_encerrada(self)
 
     def envia_comando_in(self):
-        self.fragmento_corrente = 1 # Fragmento 1 sempre existe
-        self.jpeg_corrente = []
-        self.obtem_fragmento_foto()
+        self.inicia_foto()
+
+    def inicia_foto(self):
+        self.indice = self.item.indice
+        self.nrfoto = self.item.nrfoto
+        self.log_info("Iniciando obtencao de foto %d:%d" % (self.indice, self.nrfoto))
+        self.status = 2
+        self.motivo = None
+        self.arquivo = ""
+        self.nr_fragmentos = None # Conhecido na primeira resposta
+        self.proximo_pedido = 1 # Fragmento 1 sempre existe
+        self.proximo_gravar = 1
+        self.pedidos = set() # Fragmentos pedidos e ainda não recebidos
+        self.fora_de_ordem = {} # Fragmentos recebidos à frente de proximo_gravar
+        self.retomada = False
+        if not self.abre_temporario():
+            return
+        self.pede_fragmentos()
+
+    # Reporta a foto corrente e passa à próxima da mesma central, se houver
+    def foto_concluida(self):
+        if self.status != 0:
+            self.fecha_temporario()
+        item, self.item = self.item, None
+        self.observer.resultado_foto(item, self.status, self.arquivo, self.motivo)
+
+        self.item = self.observer.proxima_foto(self.ip_addr)
+        if self.item:
+            self.inicia_foto()
+            return
+        self.despedida()
+
+    def pede_fragmentos(self):
+        # Enquanto o número de fragmentos é desconhecido, pede apenas o primeiro
+        ultimo = self.nr_fragmentos or 1
+        while len(self.pedidos) < self.janela and self.proximo_pedido <= ultimo:
+            fragmento = self.proximo_pedido
+            self.proximo_pedido += 1
+            if fragmento < self.proximo_gravar or fragmento in self.fora_de_ordem \
+                    or fragmento in self.pedidos:
+                continue
+            self.obtem_fragmento_foto(fragmento)
 
-    def obtem_fragmento_foto(self):
-        self.log_debug("Conexao foto: obtendo fragmento %d" % self.fragmento_corrente)
-        payload = self.be16(self.indice) + [ self.nrfoto, self.fragmento_corrente ]
+    def obtem_fragmento_foto(self, fragmento):
+        self.log_debug("Conexao foto: obtendo fragmento %d" % fragmento)
+        payload = self.be16(self.indice) + [ self.nrfoto, fragmento ]
+        self.pedidos.add(fragmento)
         self.envia_comando(0x0bb0, payload, self.resposta_comando_in)
 
+    def nak(self, payload):
+        if self.tratador != self.resposta_comando:
+            # NAK da autenticação
+            super().nak(payload)
+            return
+
+        if len(self.pedidos) > 1:
+            # Não se sabe a qual pedido o NAK se refere; refaz os pendentes
+            # um de cada vez. Respostas atrasadas dos pedidos antigos ainda
+            # são aproveitadas.
+            self.log_info("Conexao foto: NAK com pedidos em paralelo, passando a stop-and-wait")
+            self.janela = 1
+            self.abandonados.update((self.indice, self.nrfoto, f) for f in self.pedidos)
+            self.pedidos.clear()
+            self.proximo_pedido = self.proximo_gravar
+            self.pede_fragmentos()
+            return
+
+        if len(payload) != 1:
+            self.log_info("NAK invalido")
+            self.destroy()
+            return
+
+        # NAK referente à foto corrente; a sessão segue com a próxima
+        self.motivo = payload[0]
+        self.log_info("Conexao foto: NAK motivo %02x" % self.motivo)
+        self.status = 1
+        self.foto_concluida()
+
     def resposta_comando_in(self, payload):
         if len(payload) < 6:
             self.log_info("Conexao foto: resp frag muito curta")
             self.destroy()
             return
 
-        self.log_debug("Conexao foto: resposta fragmento %d" % self.fragmento_corrente)
-
         indice = self.parse_be16(payload[0:2])
         foto = payload[2]
         nr_fotos = payload[3]
@@ -52,6 +134,16 @@ class ObtemFotosDeEvento(ComandarCentral):
         nr_fragmentos = payload[5]
         fragmento_jpeg = payload[6:]
 
+        self.log_debug("Conexao foto: resposta fragmento %d/%d" % (fragmento, nr_fragmentos))
+
+        if (indice, foto, fragmento) in self.abandonados:
+            self.abandonados.discard((indice, foto, fragmento))
+            if indice != self.indice or foto != self.nrfoto:
+                self.log_debug("Conexao foto: resposta atrasada de foto anterior")
+                self.conn_timeout.restart()
+                return
+            # Da foto corrente: aproveitada normalmente
+
         if indice != self.indice:
             self.log_info("Conexao foto: indice invalido")
             self.destroy()
@@ -62,26 +154,153 @@ class ObtemFotosDeEvento(ComandarCentral):
             self.destroy()
             return
 
-        if fragmento != self.fragmento_corrente:
+        if self.nr_fragmentos is None:
+            self.nr_fragmentos = nr_fragmentos
+        elif self.retomada and nr_fragmentos != self.nr_fragmentos:
+            # A foto na central não é a mesma do download interrompido
+            self.log_info("Conexao foto: foto mudou desde o download anterior, reiniciando")
+            if not self.reinicia_temporario():
+                return
+            self.nr_fragmentos = nr_fragmentos
+        self.retomada = False
+
+        if fragmento < 1 or fragmento > self.nr_fragmentos or nr_fragmentos != self.nr_fragmentos:
             self.log_info("Conexao foto: frag corrente invalido")
             self.destroy()
             return
 
-        self.jpeg_corrente += fragmento_jpeg
+        self.pedidos.discard(fragmento)
+        if fragmento == self.proximo_gravar:
+            # Caso comum: grava direto do buffer de recepção, sem cópia
+            if not self.grava_fragmento(fragmento_jpeg):
+                return
+        elif fragmento > self.proximo_gravar and fragmento not in self.fora_de_ordem:
+            self.fora_de_ordem[fragmento] = bytes(fragmento_jpeg)
+        while self.proximo_gravar in self.fora_de_ordem:
+            if not self.grava_fragmento(self.fora_de_ordem.pop(self.proximo_gravar)):
+                return
 
-        if fragmento < nr_fragmentos:
-            self.fragmento_corrente += 1
-            self.obtem_fragmento_foto()
+        if self.proximo_gravar <= self.nr_fragmentos:
+            if not self.pedidos and self.proximo_pedido > self.nr_fragmentos:
+                # Algum fragmento ficou para trás (e.g. após NAK)
+                self.proximo_pedido = self.proximo_gravar
+            self.pede_fragmentos()
+            self.conn_timeout.restart()
             return
 
         self.log_info("Conexao foto: salvando imagem")
-        self.arquivo = self.folder + "/" + \
+        arquivo = self.folder + "/" + \
                 "imagem.%d.%d.%.6f.jpeg" % (indice, foto, time.time())
-        f = open(self.arquivo, "wb")
-        f.write(bytearray(self.jpeg_corrente))
-        f.close()
+        if not self.finaliza_temporario(arquivo):
+            return
+        self.arquivo = arquivo
 
-        self.despedida()
+        self.status = 0
+        self.foto_concluida()
+
+    # A imagem é gravada fragmento a fragmento num arquivo temporário, que
+    # só recebe o nome definitivo quando completo. Uma transferência
+    # interrompida nunca deixa um arquivo .jpeg parcial; o temporário é
+    # mantido, e a próxima tentativa continua do último fragmento gravado
+    # de forma durável (ver FilaFotos).
+
+    def abre_temporario(self):
+        item = self.item
+        try:
+            if item.temporario and item.nr_fragmentos and \
+                    0 < item.gravados < item.nr_fragmentos and \
+                    os.path.getsize(item.temporario) >= item.bytes_gravados:
+                self.arquivo_temporario = open(item.temporario, "r+b")
+                self.arquivo_temporario.truncate(item.bytes_gravados)
+                self.arquivo_temporario.seek(item.bytes_gravados)
+                self.nr_fragmentos = item.nr_fragmentos
+                self.proximo_pedido = self.proximo_gravar = item.gravados + 1
+                self.retomada = True
+                self.log_info("Conexao foto: continuando do fragmento %d/%d" % \
+                              (self.proximo_gravar, self.nr_fragmentos))
+            else:
+                if item.temporario:
+                    self.arquivo_temporario = open(item.temporario, "wb")
+                else:
+                    fd, item.temporario = tempfile.mkstemp(dir=self.folder, \
+                        prefix=".imagem.%d.%d." % (self.indice, self.nrfoto), suffix=".parcial")
+                    self.arquivo_temporario = os.fdopen(fd, "wb")
+                item.nr_fragmentos = None
+                item.gravados = item.bytes_gravados = 0
+                self.observer.progresso_foto(item)
+        except OSError as e:
+            self.log_warn("Conexao foto: erro abrindo arquivo temporario", e)
+            self.status = 1
+            self.destroy()
+            return False
+        self.temporario = item.temporario
+        return True
+
+    def reinicia_temporario(self):
+        try:
+            self.arquivo_temporario.seek(0)
+            self.arquivo_temporario.truncate()
+        except OSError as e:
+            self.log_warn("Conexao foto: erro reiniciando arquivo temporario", e)
+            self.status = 1
+            self.destroy()
+            return False
+        self.proximo_gravar = self.proximo_pedido = 1
+        self.fora_de_ordem.clear()
+        return True
+
+    def grava_fragmento(self, dados):
+        try:
+            self.arquivo_temporario.write(dados)
+        except OSError as e:
+            self.log_warn("Conexao foto: erro gravando fragmento", e)
+            self.status = 1
+            self.destroy()
+            return False
+        self.proximo_gravar += 1
+        if (self.proximo_gravar - 1) % self.intervalo_progresso == 0 and \
+                self.proximo_gravar <= self.nr_fragmentos:
+            self.grava_progresso()
+        return True
+
+    # Torna durável o que foi gravado e registra o progresso na fila
+    def grava_progresso(self):
+        try:
+            self.arquivo_temporario.flush()
+            os.fsync(self.arquivo_temporario.fileno())
+        except OSError as e:
+            self.log_warn("Conexao foto: erro gravando progresso", e)
+            return
+        self.item.nr_fragmentos = self.nr_fragmentos
+        self.item.gravados = self.proximo_gravar - 1
+        self.item.bytes_gravados = self.arquivo_temporario.tell()
+        self.observer.progresso_foto(self.item)
+
+    def finaliza_temporario(self, arquivo):
+        try:
+            self.arquivo_temporario.flush()
+            os.fsync(self.arquivo_temporario.fileno())
+            self.arquivo_temporario.close()
+            os.rename(self.temporario, arquivo)
+        except OSError as e:
+            self.log_warn("Conexao foto: erro finalizando arquivo", e)
+            self.status = 1
+            self.destroy()
+            return False
+        self.temporario = self.item.temporario = None
+        return True
+
+    # Foto não concluída: preserva o temporário para a próxima tentativa
+    def fecha_temporario(self):
+        if not self.temporario:
+            return
+        if not self.arquivo_temporario.closed:
+            self.grava_progresso()
+        try:
+            self.arquivo_temporario.close()
+        except OSError as e:
+            self.log_warn("Conexao foto: erro fechando arquivo temporario", e)
+        self.temporario = None
 
     # Motivos NAK (nem todos se aplicam a download de fotos):
     # 00    Mensagem Ok (Por que NAK então? ACK = cmd 0xf0fe)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import importlib
+from typing import NamedTuple, Optional
+from .myeventloop import Log
+
+# Plugins em Python: alternativa aos ganchos (scripts externos).
+#
+# Um plugin é um módulo Python carregado uma vez, na inicialização, que
+# pode definir as funções abaixo. Elas são chamadas de dentro do event
+# loop, portanto devem retornar rapidamente (delegar trabalho demorado
+# para uma thread, se necessário).
+#
+#   evento_alarme(evento)   recebe um EventoAlarme
+#   foto_obtida(foto)       recebe uma FotoObtida
+#   heartbeat(central)      heartbeat (0xf7) recebido da central
+#   central_identificada(central)
+#                           central (re)conectada e identificada
+#
+# Nas duas últimas, central é o endereço IP da conexão com a central.
+#
+# Exceções levantadas por um plugin são registradas no log e ignoradas.
+
+class EventoAlarme(NamedTuple):
+    central: str                # endereço IP da conexão com a central
+    codigo: int                 # código Contact ID (e.g. 130 = disparo)
+    particao: int
+    zona: int
+    qualificador: int           # 1 = abertura/disparo, 3 = restauro
+    tipo_msg: int               # 18 = Contact ID
+    descricao: str              # descrição legível, "" se desconhecido
+    indice_foto: Optional[int]  # índice das fotos na central, se houver
+    nr_fotos: int
+
+
+class FotoObtida(NamedTuple):
+    central: str
+    indice: int
+    nrfoto: int
+    arquivo: str
+
+
+class Plugins:
+    def __init__(self):
+        self.tratadores_evento = []
+        self.tratadores_foto = []
+        self.tratadores_heartbeat = []
+        self.tratadores_identificacao = []
+
+    def registrar(self, evento_alarme=None, foto_obtida=None, heartbeat=None, central_identificada=None):
+        if evento_alarme:
+            self.tratadores_evento.append(evento_alarme)
+        if foto_obtida:
+            self.tratadores_foto.append(foto_obtida)
+        if heartbeat:
+            self.tratadores_heartbeat.append(heartbeat)
+        if central_identificada:
+            self.tratadores_identificacao.append(central_identificada)
+
+    def carregar(self, nome):
+        modulo = importlib.import_module(nome)
+        evento_alarme = getattr(modulo, "evento_alarme", None)
+        foto_obtida = getattr(modulo, "foto_obtida", None)
+        heartbeat = getattr(modulo, "heartbeat", None)
+        central_identificada = getattr(modulo, "central_identificada", None)
+        if not evento_alarme and not foto_obtida and not heartbeat and not central_identificada:
+            Log.warn("plugin %s nao define nenhuma funcao de plugin" % nome)
+            return
+        self.registrar(evento_alarme, foto_obtida, heartbeat, central_identificada)
+        Log.info("plugin %s carregado" % nome)
+
+    # Carrega uma lista de módulos separados por vírgula
+    def carregar_lista(self, nomes):
+        for nome in nomes.split(","):
+            nome = nome.strip()
+            if nome:
+                self.carregar(nome)
+
+    def evento(self, evento):
+        self._despachar(self.tratadores_evento, evento)
+
+    def foto(self, foto):
+        self._despachar(self.tratadores_foto, foto)
+
+    def heartbeat(self, central):
+        self._despachar(self.tratadores_heartbeat, central)
+
+    def identificacao(self, central):
+        self._despachar(self.tratadores_identificacao, central)
+
+    def _despachar(self, tratadores, objeto):
+        for tratador in tratadores:
+            try:
+                tratador(objeto)
+            except Exception as e:
+                Log.error("plugin %s falhou:" % getattr(tratador, "__module__", "?"), repr(e))
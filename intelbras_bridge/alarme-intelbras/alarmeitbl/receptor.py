@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import os, sys, re
+from .myeventloop import Timeout, Log, SelectPoller, SelectorsPoller
+from .tratador import Tratador, TCPServerEventLoop, TCPListener, Handler
+from .tratador_fotos import TratadorDeFotos, ObtemFotosDeEvento
+from .fila_fotos import FilaFotos
+from .ganchos import ExecutorGanchos
+from .canal_eventos import CanalEventos
+
+# Montagem do Receptor IP a partir da seção [receptorip] da configuração.
+#
+# Usado pelo programa receptorip e por quem embute o receptor no próprio
+# processo (addon_main.py), registrando um plugin para receber os eventos
+# já decodificados (EventoAlarme) em vez de interpretar o texto do log.
+#
+# O event loop deve ser criado na thread principal (instala tratador de
+# SIGPIPE), mas pode rodar em outra thread; ele é o único a tocar nos
+# objetos do receptor, de modo que os plugins devem apenas repassar os
+# eventos para a thread do programa principal.
+
+def configura_receptor(config):
+    host = config.get('addr', '').lower().strip()
+    port = config.getint('port')
+    caddr = config.get('caddr', '').lower().strip()
+    cport = config.getint('cport')
+    senha = config.getint('senha')
+    tam_senha = config.getint('tamanho')
+    centrais = re.compile(config.get('centrais', '.*')) # Acepta cualquier central si no se especifica
+    maxconn = config.getint('maxconn')
+    folder_dlfoto = config.get('folder_dlfoto', '.') # Carpeta actual si no se especifica
+    # Procesamiento inmediato de eventos (ACK al llegar); 'no' restaura el modo cadenciado con backoff
+    imediato = config.getboolean('imediato', True)
+    # Ejecución asíncrona de ganchos: procesos simultáneos y tiempo límite (s) de cada uno
+    ganchos_simultaneos = config.getint('ganchos_simultaneos', 4)
+    ganchos_tempo_limite = config.getint('ganchos_tempo_limite', 60)
+    # Sesiones de descarga de fotos simultáneas, en total y por central
+    # (cada sesión obtiene en secuencia todas las fotos pendientes de su central)
+    fotos_simultaneas = config.getint('fotos_simultaneas', 4)
+    fotos_por_central = config.getint('fotos_por_central', 1)
+    # Pedidos de fragmentos de foto en paralelo (1 = uno a la vez)
+    fotos_janela = config.getint('fotos_janela', 4)
+    # Cola persistente de fotos (SQLite); 'none' la mantiene solo en memoria
+    fila_fotos = config.get('fila_fotos', os.path.join(folder_dlfoto, '.fila_fotos.sqlite'))
+    # Plugins Python (módulos separados por coma, buscados también en la carpeta plugins/)
+    plugins = config.get('plugins', '')
+    # Backend del event loop: 'selectors' (epoll, por defecto) o 'select' (legado, limitado a 1024 fds)
+    poller = config.get('poller', 'selectors').lower().strip()
+    # Socket Unix del canal de eventos estructurados (JSON por línea); vacío = desactivado
+    canal_eventos = config.get('canal_eventos', '').strip()
+
+    Log.info(f"Iniciando receptor IP en {host}:{port}")
+
+    # --- Watchdog (sin ganchos externos) ---
+    def watchdog(to_obj):
+        Log.info("Receptor en funcionamiento (watchdog)")
+        Log.info(Tratador.latencia_eventos.resumo())
+        to_obj.reset(3600)
+
+    Timeout.new("watchdog", 15, watchdog)
+
+    # --- Executor de ganchos, compartido por Tratador y TratadorDeFotos ---
+    Tratador.executor_ganchos = ExecutorGanchos(ganchos_simultaneos, ganchos_tempo_limite)
+
+    # --- Plugins Python, cargados una sola vez ---
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+    Tratador.plugins.carregar_lista(plugins)
+
+    # --- Canal de eventos estructurados, opcional ---
+    if canal_eventos:
+        Tratador.canal_eventos = CanalEventos(canal_eventos)
+        Tratador.plugins.registrar(foto_obtida=Tratador.canal_eventos.foto)
+
+    # --- Configuración del TratadorDeFotos (sin ganchos) ---
+    ObtemFotosDeEvento.janela = max(1, fotos_janela)
+    # Se pasa ":" como primer argumento ya que no se usará el gancho de archivo
+    Tratador.tratador_de_fotos = TratadorDeFotos(":", folder_dlfoto, caddr, cport, senha, tam_senha,
+                                                 Tratador.executor_ganchos, Tratador.plugins,
+                                                 fotos_simultaneas, fotos_por_central,
+                                                 FilaFotos(fila_fotos.lower() == "none" and ":memory:" or fila_fotos))
+
+    # --- Funciones de Validación ---
+    def valida_central(id_central):
+        # La validación sigue siendo la misma, pero el logeo es más limpio
+        return centrais.match(id_central)
+
+    def centrais_conectadas():
+        n = 0
+        for h in Handler.items.values():
+            if isinstance(h, Tratador) and h.central_identificada:
+                n += 1
+        return n
+
+    def valida_maxconn():
+        return centrais_conectadas() < maxconn
+
+    # --- Asignación de funciones y ganchos ---
+    Tratador.valida_central = valida_central
+    Tratador.processamento_imediato = imediato
+    Tratador.valida_maxconn = valida_maxconn
+
+    # SOLUCIÓN: Asignar el comando "no-op" a todos los ganchos para desactivarlos de forma segura
+    Tratador.gancho_arquivo = ":"
+    Tratador.gancho_central = ":"
+    Tratador.gancho_ev = ":"
+    Tratador.gancho_msg = ":"
+    Tratador.gancho_watchdog = ":"
+
+    # --- Monitoreo de Conexión (sin ganchos externos) ---
+    def central_nao_conectada(to_obj):
+        if not centrais_conectadas():
+            if central_nao_conectada.alarme <= 0:
+                central_nao_conectada.alarme = 1
+                # En lugar de llamar a un script, solo se registra en el log
+                Log.info("ALERTA: Ninguna central conectada.")
+        else:
+            if central_nao_conectada.alarme > 0:
+                central_nao_conectada.alarme = 0
+                # Se registra la reconexión
+                Log.info("INFO: Central(es) conectada(s) nuevamente.")
+
+        to_obj.restart()
+
+    central_nao_conectada.alarme = 0
+    Timeout.new("central_nc", 3600, central_nao_conectada)
+
+    # --- Servidor ---
+    Log.info(f"Creando servidor TCP en {host}:{port}")
+    ev = TCPServerEventLoop((host, port), TCPListener, Tratador,
+                            poller == 'select' and SelectPoller() or SelectorsPoller())
+    Log.info("Servidor TCP creado. Aguardando conexoes...")
+    return ev
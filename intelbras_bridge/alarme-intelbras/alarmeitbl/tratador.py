@@ -1,14 +1,34 @@
 #!/usr/bin/env python3
 
-import datetime, os, shlex
+import datetime, time
 
 from .myeventloop.tcpserver import *
 from .utils_proto import *
+from .metricas import Latencia
+from .ganchos import ExecutorGanchos
+from .plugins import Plugins, EventoAlarme
 
 class Tratador(TCPServerHandler, UtilsProtocolo):
     backoff_minimo = 0.125
     recuo_backoff_minimo = 1.0 # Deve ser bem maior que RTT esperado
 
+    # Se verdadeiro, cada frame completo é tratado e confirmado assim que
+    # chega. O processamento cadenciado (com backoff) só é adotado para
+    # centrais que apresentarem anomalias (checksum errado, frames nulos
+    # ou desconhecidos) em número igual ou maior que limite_anomalias.
+    processamento_imediato = True
+    limite_anomalias = 3
+
+    # Tempo entre a chegada de um evento de alarme e o envio aos ganchos
+    latencia_eventos = Latencia("latencia chegada-gancho")
+
+    # Ganchos rodam fora do event loop; substituível pelo programa principal
+    executor_ganchos = ExecutorGanchos()
+    # Plugins Python que recebem os eventos decodificados
+    plugins = Plugins()
+    # Canal de eventos estruturados (CanalEventos), se configurado
+    canal_eventos = None
+
     eventos_contact_id = {
         100: {'*': "Emergencia medica"},
         110: {'*': "Alarme de incendio"},
@@ -112,6 +132,12 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         self.to_incompleta = None
         self.to_backoff = None
 
+        self.cadenciado = not Tratador.processamento_imediato
+        self.anomalias = 0
+        # Momento de chegada dos dados mais antigos ainda no buffer
+        self.chegada = None
+        self.ultima_chegada = None
+
         self.ip_addr = addr[0]
 
         if not Tratador.valida_maxconn():
@@ -145,15 +171,21 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
     def envia_curto(self, resposta):
         self._envia(resposta)
 
-    def recv_callback(self, _):
+    def recv_callback(self, latest):
         if self.ignorar:
-            self.recv_buf = []
+            self.recv_buf.clear()
             return
 
+        self.ultima_chegada = time.monotonic()
+        if len(self.recv_buf) == len(latest):
+            self.chegada = self.ultima_chegada
+
         self.log_debug("evento")
         self.log_debug("buf =", self.hexprint(self.recv_buf))
         self.to_comm.restart()
-        if not self.to_processa:
+        if not self.cadenciado:
+            self.processar_imediato()
+        elif not self.to_processa:
             self.to_processa = self.timeout("proc_msg", self.backoff, self.processar_msg)
 
     def shutdown_callback(self):
@@ -172,9 +204,28 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         if msgs_pendentes:
             self.to_processa = self.timeout("proc_msg", self.backoff, self.processar_msg)
 
+    def processar_imediato(self):
+        # Trata e confirma todos os frames completos presentes no buffer
+        while not self.destroyed and not self.cadenciado:
+            msg_aceita, msgs_pendentes = self.consome_msg()
+            if not msgs_pendentes:
+                return
+
+        # Passou a modo cadenciado no meio do caminho
+        if not self.destroyed and self.recv_buf and not self.to_processa:
+            self.to_processa = self.timeout("proc_msg", self.backoff, self.processar_msg)
+
+    def registrar_anomalia(self, motivo):
+        self.anomalias += 1
+        self.log_debug("anomalia %s (%d)" % (motivo, self.anomalias))
+        if not self.cadenciado and self.anomalias >= Tratador.limite_anomalias:
+            self.log_warn("central com comportamento anomalo, adotando processamento cadenciado")
+            self.cadenciado = True
+
     def consome_msg(self):
         if self.consome_frame_curto() or self.consome_frame_longo():
             # Processou uma mensagem
+            self.chegada = self.recv_buf and self.ultima_chegada or None
             if self.to_incompleta:
                 self.to_incompleta.cancel()
                 self.to_incompleta = None
@@ -210,10 +261,16 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
                 max(Tratador.recuo_backoff_minimo, self.backoff * 2),
                 self.recuar_backoff)
 
+    def publicar_evento(self, tipo, **campos):
+        if Tratador.canal_eventos:
+            Tratador.canal_eventos.publicar(dict(campos, tipo=tipo, central=self.ip_addr))
+
     def consome_frame_curto(self):
         if self.recv_buf and self.recv_buf[0] == 0xf7:
-            self.recv_buf = self.recv_buf[1:]
+            self.recv_buf.consume(1)
             self.log_debug("heartbeat da central")
+            self.publicar_evento("heartbeat")
+            Tratador.plugins.heartbeat(self.ip_addr)
             resposta = [0xfe]
             self.envia_curto(resposta)
             return True
@@ -227,12 +284,14 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         if len(self.recv_buf) < esperado:
             return False
 
+        # rawmsg é uma memoryview, válida enquanto o frame é tratado
         rawmsg = self.recv_buf[:esperado]
-        self.recv_buf = self.recv_buf[esperado:]
+        self.recv_buf.consume(esperado)
 
         # checksum de pacote sufixado com checksum resulta em 0
         if self.checksum(rawmsg) != 0x00:
             self.log_warn("checksum errado, rawmsg =", self.hexprint(rawmsg))
+            self.registrar_anomalia("checksum")
             return True
 
         # Mantém checksum no final pois, em algumas mensagens, o último octeto
@@ -241,6 +300,7 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
 
         if not msg:
             self.log_warn("mensagem nula")
+            self.registrar_anomalia("nula")
             return True
 
         tipo = msg[0]
@@ -256,6 +316,8 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
             self.evento_alarme(msg, True)
         else:
             self.log_warn("solicitacao desconhecida %02x payload =" % tipo, self.hexprint(msg))
+            self.publicar_evento("desconhecida", tipo_frame=tipo, payload=msg.hex())
+            self.registrar_anomalia("desconhecida")
             self.resposta_generica(msg)
         return True
 
@@ -275,6 +337,7 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         macaddr = msg[3:6]
         macaddr_s = (":".join(["%02x" % i for i in macaddr])).lower()
         self.log_info("identificacao central conta %d mac %s" % (conta, macaddr_s))
+        self.publicar_evento("identificacao", canal=canal, conta=conta, mac=macaddr_s)
 
         if not Tratador.valida_central(macaddr_s):
             self.log_info("central nao autorizada")
@@ -292,11 +355,13 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         if self.to_ident:
             self.to_ident.cancel()
             self.to_ident = None
+        Tratador.plugins.identificacao(self.ip_addr)
 
         self.envia_curto(resposta)
 
     def solicita_data_hora(self, msg):
         self.log_debug("solicitacao de data/hora pela central")
+        self.publicar_evento("data_hora")
         agora = datetime.datetime.now()
         # proto: 0 = domingo; weekday(): 0 = segunda
         dow = (agora.weekday() + 1) % 7
@@ -305,17 +370,18 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
         self.envia_longo(resposta)
 
     def msg_para_gancho(self, *msg):
+        if ExecutorGanchos.nulo(Tratador.gancho_msg):
+            return
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         msgw = now
         for item in msg:
             msgw += " "
             msgw += str(item)
-        p = os.popen(Tratador.gancho_msg + " " + shlex.quote(msgw), 'w')
-        p.close()
+        Tratador.executor_ganchos.executar(self.ip_addr, Tratador.gancho_msg, msgw)
 
     def ev_para_gancho(self, codigo, particao, zona, qualificador):
-        p = os.popen("%s %d %d %d %d" % (Tratador.gancho_ev, codigo, particao, zona, qualificador), 'w')
-        p.close()
+        Tratador.executor_ganchos.executar(self.ip_addr, Tratador.gancho_ev, \
+                                           codigo, particao, zona, qualificador)
 
     def evento_alarme(self, msg, com_foto):
         compr = com_foto and 20 or 17
@@ -339,6 +405,7 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
 
         self.ev_para_gancho(codigo, particao, zona, qualificador)
 
+        descricao = ""
         desconhecido = True
         if tipo_msg == 18 and codigo in Tratador.eventos_contact_id:
             if qualificador == 1:
@@ -359,6 +426,7 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
                 if com_foto:
                     fotos = "(com fotos, i=%d n=%d)" % (indice, nr_fotos)
                 descricao_humana = scodigo.format(zona=zona, particao=particao)
+                descricao = descricao_humana
                 self.log_info(descricao_humana, fotos)
                 self.msg_para_gancho(descricao_humana, fotos)
 
@@ -373,5 +441,19 @@ class Tratador(TCPServerHandler, UtilsProtocolo):
             self.log_info(msg)
             self.msg_para_gancho(msg)
 
+        if Tratador.plugins.tratadores_evento or Tratador.canal_eventos:
+            evento = EventoAlarme(self.ip_addr, codigo, particao, zona, \
+                qualificador, tipo_msg, descricao, indice if com_foto else None, \
+                nr_fotos if com_foto else 0)
+            Tratador.plugins.evento(evento)
+            if Tratador.canal_eventos:
+                Tratador.canal_eventos.publicar(dict(evento._asdict(), tipo="alarme", \
+                    canal=canal, contact_id=contact_id))
+
+        if self.chegada is not None:
+            latencia = time.monotonic() - self.chegada
+            Tratador.latencia_eventos.registrar(latencia)
+            self.log_debug("latencia chegada-gancho %.1fms" % (latencia * 1000))
+
         resposta = [0xfe]
         self.envia_curto(resposta)
@@ -1,81 +1,223 @@
 #!/usr/bin/env python3
 
-import os
+import os, random
+from collections import deque
 from .myeventloop import Timeout, Log
 from .obtem_fotos import *
+from .fila_fotos import FilaFotos
+from .ganchos import ExecutorGanchos
+from .plugins import Plugins, FotoObtida
 
 # Tratador de fotos obtidas via eventos 0xb5. Desacoplado do tratador 
 # principal pois usa conexões separadas, e as fotos ficam armazenadas
 # por tempo indeterminado na central, não sendo atreladas à conexão com
 # o Receptor IP.
 #
-# Numa implementação futura os índices das fotos poderiam ser até
-# armazenados num banco de dados local, para que não se percam quando
-# o programa é reiniciado.
+# Os índices das fotos ficam numa fila persistente (FilaFotos), de modo
+# que não se percam quando o programa é reiniciado.
+
+# Foto pendente. Cada item tem seu próprio timer de (re)tentativa, de modo
+# que um item lento não atrasa os demais.
+class ItemFoto:
+    def __init__(self, ip_addr_cli, indice, nrfoto, tentativas):
+        self.ip_addr_cli = ip_addr_cli
+        self.indice = indice
+        self.nrfoto = nrfoto
+        self.tentativas = tentativas
+        self.esperas = 0
+        self.task = None
+        # Progresso do download, para continuar de onde parou
+        self.nr_fragmentos = None
+        self.gravados = 0
+        self.bytes_gravados = 0
+        self.temporario = None
+
 
 class TratadorDeFotos:
-    def __init__(self, gancho, folder, caddr, cport, senha, tam_senha):
+    # Fotos de sensor 8000 demoram para gravar (NAK 0x28 = foto não gravada),
+    # mas a espera é tratada pelo backoff abaixo
+    atraso_inicial = 3
+    # Erros genéricos (conexão, timeout, NAK não previsto)
+    atraso_retentativa = 20
+    tentativas = 10
+    # Foto ainda sendo gravada ou central ocupada: backoff exponencial curto
+    # com jitter, sem consumir as tentativas acima
+    atraso_espera = 1.5
+    atraso_espera_max = 15
+    jitter = 0.25
+    esperas = 40
+
+    motivos = { 0x23: "evento sem foto associada",
+                0x24: "indice de foto invalido",
+                0x25: "fragmento invalido",
+                0x28: "foto ainda sendo gravada",
+                0xf0f7: "central ocupada" }
+    # NAKs após os quais não adianta tentar de novo
+    motivos_descarte = (0x23, 0x24)
+    motivos_espera = (0x28, 0xf0f7)
+
+    def __init__(self, gancho, folder, caddr, cport, senha, tam_senha, executor=None, plugins=None,
+                 max_simultaneas=4, max_por_central=1, fila=None):
         self.gancho = gancho
+        self.executor = executor or ExecutorGanchos()
+        self.plugins = plugins or Plugins()
         self.folder = folder
         self.caddr = caddr
         self.cport = cport
         self.senha = senha
         self.tam_senha = tam_senha
-        self.fila = [] # [endereço IP, indice, nr. foto, tentativas restantes]
-        self.task = None
+        self.max_simultaneas = max_simultaneas # sessões, no total
+        self.max_por_central = max_por_central # sessões por central
+        self.pendentes = {} # itens aguardando o timer de tentativa
+        self.filas = {} # endereço IP -> deque de itens prontos para download
+        self.sessoes = {} # endereço IP -> nr. de sessões em curso
+        self.total_sessoes = 0
+        self.fila = fila or FilaFotos()
+
+        # Fotos pendentes de uma execução anterior
+        for central, indice, nrfoto, tentativas, nr_fragmentos, gravados, \
+                bytes_gravados, temporario in self.fila.pendentes():
+            item = ItemFoto(central, indice, nrfoto, tentativas)
+            item.nr_fragmentos = nr_fragmentos
+            item.gravados = gravados
+            item.bytes_gravados = bytes_gravados
+            item.temporario = temporario
+            Log.info("tratador de fotos: retomando %s:%d:%d (%d fragmentos gravados)" % \
+                          (central, indice, nrfoto, gravados))
+            self.agendar(item)
 
     # Recebe nova foto de algum Tratador para a fila
     def enfileirar(self, ip_addr_cli, indice, nrfoto):
         if self.tam_senha <= 0:
             return
-        self.fila.append([ip_addr_cli, indice, nrfoto, 10])
-        if not self.task:
-            # Fotos de sensor 8000 demoram para gravar (NAK 0x28 = foto não gravada)
-            self.task = Timeout.new("trata_foto", 20, self.obtem_foto)
+        if not self.fila.adicionar(ip_addr_cli, indice, nrfoto, TratadorDeFotos.tentativas):
+            Log.info("tratador de fotos: %s:%d:%d ja enfileirada" % (ip_addr_cli, indice, nrfoto))
+            return
+        self.agendar(ItemFoto(ip_addr_cli, indice, nrfoto, TratadorDeFotos.tentativas))
+
+    def agendar(self, item):
+        item.task = Timeout.new("foto %d:%d" % (item.indice, item.nrfoto), \
+                                TratadorDeFotos.atraso_inicial, \
+                                lambda _: self.pronto(item))
+        self.pendentes[id(item)] = item
 
     # Reduz tempo de timeout (caso de uso: comando CLI)
     def imediato(self):
-        self.task.reset(0.1)
-
-    def obtem_foto(self, task):
-        if not self.fila:
-            self.task = None
-            return
+        for item in self.pendentes.values():
+            item.task.reset(0.1)
 
-        ip_addr_cli, indice, nrfoto, tentativas = self.fila[0]
+    def pronto(self, item):
+        del self.pendentes[id(item)]
+        self.filas.setdefault(self.endereco(item), deque()).append(item)
+        self.despachar()
 
-        # Usar endereço da central detectado ou manualmente especificado?
-        ip_addr = ip_addr_cli
+    # Usar endereço da central detectado ou manualmente especificado?
+    def endereco(self, item):
         if self.caddr != "auto":
-            ip_addr = self.caddr
+            return self.caddr
+        return item.ip_addr_cli
+
+    def despachar(self):
+        for ip_addr, fila in list(self.filas.items()):
+            while fila and self.total_sessoes < self.max_simultaneas and \
+                    self.sessoes.get(ip_addr, 0) < self.max_por_central:
+                self.obtem_foto(ip_addr, fila.popleft())
+            if not fila:
+                del self.filas[ip_addr]
+
+    # Abre uma sessão com a central, começando pelo item dado
+    def obtem_foto(self, ip_addr, item):
+        self.sessoes[ip_addr] = self.sessoes.get(ip_addr, 0) + 1
+        self.total_sessoes += 1
 
         Log.info("tratador de fotos: obtendo %s:%d:%d tentativas %d" % \
-                      (ip_addr, indice, nrfoto, tentativas))
+                      (ip_addr, item.indice, item.nrfoto, item.tentativas))
 
-        ObtemFotosDeEvento(ip_addr, self.cport, indice, nrfoto, \
+        ObtemFotosDeEvento(ip_addr, self.cport, item, \
                             self.senha, self.tam_senha, self, self.folder)
 
-    def msg_para_gancho_arquivo(self, arquivo):
-        p = os.popen(self.gancho + " " + arquivo, 'w')
-        p.close()
+    # Chamado pela sessão ao concluir uma foto: próximo item da mesma central
+    def proxima_foto(self, ip_addr):
+        fila = self.filas.get(ip_addr, None)
+        if not fila:
+            return None
+        item = fila.popleft()
+        if not fila:
+            del self.filas[ip_addr]
+        Log.info("tratador de fotos: obtendo %s:%d:%d tentativas %d (mesma sessao)" % \
+                      (ip_addr, item.indice, item.nrfoto, item.tentativas))
+        return item
+
+    def sessao_encerrada(self, sessao):
+        self.sessoes[sessao.ip_addr] -= 1
+        if not self.sessoes[sessao.ip_addr]:
+            del self.sessoes[sessao.ip_addr]
+        self.total_sessoes -= 1
+        self.despachar()
+
+    # Chamado pela sessão ao gravar fragmentos de forma durável
+    def progresso_foto(self, item):
+        self.fila.atualizar(item)
+
+    # Desiste da foto, removendo o que foi gravado até aqui
+    def descartar(self, item):
+        if item.temporario:
+            try:
+                os.unlink(item.temporario)
+            except OSError:
+                pass
+            item.temporario = None
+        self.fila.encerrar(item, "descartada")
 
-    # observer chamado quando ObtemFotosDeEvento finaliza
-    def resultado_foto(self, indice, nrfoto, status, arquivo):
+    def msg_para_gancho_arquivo(self, ip_addr, arquivo):
+        self.executor.executar(ip_addr, self.gancho, arquivo)
+
+    def descricao_motivo(self, motivo):
+        if motivo is None:
+            return "erro"
+        return "NAK %02x (%s)" % (motivo, TratadorDeFotos.motivos.get(motivo, "?"))
+
+    def atraso_backoff(self, item):
+        atraso = min(TratadorDeFotos.atraso_espera_max,
+                     TratadorDeFotos.atraso_espera * 2 ** (item.esperas - 1))
+        return atraso * random.uniform(1 - TratadorDeFotos.jitter, 1 + TratadorDeFotos.jitter)
+
+    def reagendar(self, item, atraso):
+        self.fila.atualizar(item)
+        self.pendentes[id(item)] = item
+        item.task.reset(atraso)
+
+    # observer chamado a cada foto finalizada por ObtemFotosDeEvento
+    def resultado_foto(self, item, status, arquivo, motivo=None):
+        indice, nrfoto = item.indice, item.nrfoto
         if status == 0:
             Log.info("Fotos indice %d:%d: sucesso" % (indice, nrfoto))
             Log.info("Arquivo de foto %s" % arquivo)
-            if self.gancho:
-                self.msg_para_gancho_arquivo(arquivo)
-            del self.fila[0]
-        elif status == 2:
-            Log.info("Fotos indice %d:%d: erro fatal" % (indice, nrfoto))
-            del self.fila[0]
+            self.fila.encerrar(item, "concluida")
+            self.msg_para_gancho_arquivo(item.ip_addr_cli, arquivo)
+            self.plugins.foto(FotoObtida(item.ip_addr_cli, indice, nrfoto, arquivo))
+        elif status == 2 or motivo in TratadorDeFotos.motivos_descarte:
+            Log.info("Fotos indice %d:%d: erro fatal, %s" % (indice, nrfoto, self.descricao_motivo(motivo)))
+            self.descartar(item)
+        elif motivo in TratadorDeFotos.motivos_espera:
+            item.esperas += 1
+            if item.esperas > TratadorDeFotos.esperas:
+                Log.info("Fotos indice %d:%d: tempo de espera esgotado" % (indice, nrfoto))
+                self.descartar(item)
+                return
+            atraso = self.atraso_backoff(item)
+            Log.info("Fotos indice %d:%d: %s, nova tentativa em %.1fs" % \
+                     (indice, nrfoto, self.descricao_motivo(motivo), atraso))
+            self.reagendar(item, atraso)
         else:
-            self.fila[0][3] -= 1
-            if self.fila[0][3] <= 0:
+            if motivo == 0x25:
+                # Fragmento inexistente: o progresso gravado não vale mais
+                item.gravados = 0
+            item.tentativas -= 1
+            if item.tentativas <= 0:
                 Log.info("Fotos indice %d:%d: tentativas esgotadas" % (indice, nrfoto))
-                del self.fila[0]
+                self.descartar(item)
             else:
-                Log.info("Fotos indice %d:%d: erro temporario" % (indice, nrfoto))
-
-        self.task.restart()
+                Log.info("Fotos indice %d:%d: erro temporario, %s" % \
+                         (indice, nrfoto, self.descricao_motivo(motivo)))
+                self.reagendar(item, TratadorDeFotos.atraso_retentativa)
@@ -19,11 +19,9 @@ class UtilsProtocolo:
     # Decodifica número no formato "Contact ID"
     # Retorna -1 se aparenta estar corrompido
     def contact_id_decode(self, dados):
-        dados_rev = dados[:]
-        dados_rev.reverse()
         numero = 0
         posicao = 1
-        for digito in dados_rev:
+        for digito in reversed(dados):
             if digito == 0x0a: # zero
                 pass
             elif digito >= 0x01 and digito <= 0x09:
@@ -53,12 +51,9 @@ class UtilsProtocolo:
         return ((n // 10) << 4) + (n % 10)
     
     def from_bcd(self, dados):
-        n = 0
-        dados_rev = dados[:]
-        dados_rev.reverse()
         numero = 0
         posicao = 1
-        for nibbles in dados_rev:
+        for nibbles in reversed(dados):
             numero += (nibbles >> 4) * 10 * posicao
             numero += (nibbles & 0x04) * posicao
             posicao *= 100
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Microbenchmark da fila de timeouts do myeventloop: compara a
+# implementação atual (min-heap com remoção preguiçosa e índice por dono)
+# com a implementação anterior (varredura linear de Timeout.pending),
+# reproduzida abaixo como LegacyTimeout.
+#
+# Uso: python3 benchmarks/bench_timeouts.py [nr. de timeouts vivos]
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import Timeout, Log
+
+class LegacyTimeout:
+    pending = {}
+
+    @staticmethod
+    def _next():
+        to = time.time() + 86400
+        chosen = None
+        for candidate in LegacyTimeout.pending.values():
+            if candidate.absolute_to < to:
+                to = candidate.absolute_to
+                chosen = candidate
+        return to, chosen
+
+    @staticmethod
+    def next_relative():
+        to, chosen = LegacyTimeout._next()
+        return max(0, to - time.time()), chosen
+
+    @staticmethod
+    def handle():
+        to, chosen = LegacyTimeout._next()
+        if not chosen or to > time.time():
+            return False
+        del LegacyTimeout.pending[id(chosen)]
+        chosen.callback(chosen)
+        return True
+
+    @staticmethod
+    def cancel_and_inval_by_owner(owner):
+        for candidate in list(LegacyTimeout.pending.values()):
+            if owner is candidate.owner:
+                candidate.invalidated = True
+                del LegacyTimeout.pending[id(candidate)]
+
+    def __init__(self, owner, label, relative_to, callback):
+        self.owner = owner
+        self.label = label
+        self.relative_to = relative_to
+        self.callback = callback
+        self.invalidated = False
+        self.restart()
+
+    def restart(self):
+        self.absolute_to = time.time() + self.relative_to
+        LegacyTimeout.pending[id(self)] = self
+        Log.debug2("> timeout %s %f" % (self.label, self.relative_to))
+
+
+def medir(nome, funcao, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    total = time.perf_counter() - inicio
+    print("    %-28s %10.2f us/op" % (nome, total / repeticoes * 1e6))
+    return total
+
+
+def cenario(classe, nr_vivos):
+    classe.pending.clear()
+    if classe is Timeout:
+        Timeout.heap.clear()
+        Timeout.by_owner.clear()
+
+    rnd = random.Random(1)
+    donos = [object() for _ in range(nr_vivos // 5)]
+    vivos = []
+    for i in range(nr_vivos):
+        # 5 timeouts por dono, como um Tratador (ident, comm, proc_msg, ...)
+        dono = donos[i // 5]
+        vivos.append(classe(dono, "t%d" % i, 60 + rnd.random() * 600, lambda t: None))
+
+    def ciclo():
+        # Um ciclo ocioso do event loop: next_relative() + handle()
+        classe.next_relative()
+        classe.handle()
+
+    def reinicio():
+        # Recepção de dados: to_comm.restart()
+        vivos[rnd.randrange(nr_vivos)].restart()
+
+    def destruicao():
+        # Destruição de um Handler e recriação de seus timeouts
+        dono = donos[rnd.randrange(len(donos))]
+        classe.cancel_and_inval_by_owner(dono)
+        for i in range(5):
+            vivos.append(classe(dono, "n", 60 + rnd.random() * 600, lambda t: None))
+
+    print("%s (%d timeouts vivos)" % (classe.__name__, nr_vivos))
+    return (medir("ciclo ocioso", ciclo, 200),
+            medir("restart()", reinicio, 2000),
+            medir("destruicao de dono", destruicao, 200))
+
+
+if __name__ == "__main__":
+    nr_vivos = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    Log.set_level(Log.ERROR)
+    novo = cenario(Timeout, nr_vivos)
+    antigo = cenario(LegacyTimeout, nr_vivos)
+    print("Ganho: ciclo %.0fx, restart %.1fx, destruicao %.0fx" %
+          tuple(a / n for a, n in zip(antigo, novo)))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Microbenchmark da decodificação de zonas do status da AMT-8000: compara
+# o decodificador atual (bitmask via int.from_bytes, zonas alteradas por
+# XOR com o sondeio anterior) com o anterior (laço bit a bit gerando um
+# dict de 64 strings, comparado zona a zona com o estado anterior),
+# reproduzido abaixo como decodificador legado.
+#
+# Uso: python3 benchmarks/bench_zonas.py [nr. de sondeios]
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from client import ZONE_STATUS_PAYLOAD_OFFSET, MAX_ZONES, zones_open_mask, zones_in_mask, \
+    paired_sensors_mask
+
+def legacy_zones(payload, num_zones=MAX_ZONES):
+    zones_status_dict = {}
+    required_bytes_for_zones = (num_zones + 7) // 8
+    bytes_to_process = payload[ZONE_STATUS_PAYLOAD_OFFSET : ZONE_STATUS_PAYLOAD_OFFSET + required_bytes_for_zones]
+    zone_current_idx = 0
+    for byte_val in bytes_to_process:
+        for bit_index in range(8):
+            if zone_current_idx < num_zones:
+                zone_number = zone_current_idx + 1
+                is_open = bool(byte_val & (1 << bit_index))
+                zones_status_dict[str(zone_number)] = "open" if is_open else "closed"
+                zone_current_idx += 1
+            else:
+                break
+        if zone_current_idx >= num_zones:
+            break
+    return zones_status_dict
+
+def legacy_paired(return_data):
+    paired_zones = {}
+    for byte_index in range(8):
+        if len(return_data) > 8 + byte_index:
+            byte_value = return_data[8 + byte_index]
+            for bit in range(8):
+                zone_number = (byte_index * 8) + bit + 1
+                if (byte_value & (1 << bit)) > 0:
+                    paired_zones[str(zone_number)] = True
+    return paired_zones
+
+# Sequência de payloads de status onde, a cada sondeio, 0 a 2 zonas mudam
+def gera_payloads(n):
+    rnd = random.Random(1)
+    mask = rnd.getrandbits(MAX_ZONES)
+    payloads = []
+    for _ in range(n):
+        for _ in range(rnd.randint(0, 2)):
+            mask ^= 1 << rnd.randrange(MAX_ZONES)
+        p = bytearray(140)
+        p[ZONE_STATUS_PAYLOAD_OFFSET:ZONE_STATUS_PAYLOAD_OFFSET + 8] = mask.to_bytes(8, "little")
+        payloads.append(bytes(p))
+    return payloads
+
+def sondeio_legado(payloads):
+    anterior = legacy_zones(payloads[0])
+    alteradas = 0
+    for p in payloads[1:]:
+        zonas = legacy_zones(p)
+        for zona, estado in zonas.items():
+            if anterior.get(zona) != estado:
+                alteradas += 1
+        anterior = zonas
+    return alteradas
+
+def sondeio_bitmask(payloads):
+    anterior = zones_open_mask(payloads[0])
+    alteradas = 0
+    for p in payloads[1:]:
+        mask = zones_open_mask(p)
+        alteradas += len(zones_in_mask(mask ^ anterior))
+        anterior = mask
+    return alteradas
+
+def mede(nome, funcao, arg, repeticoes):
+    t0 = time.perf_counter()
+    resultado = funcao(arg)
+    total = time.perf_counter() - t0
+    print("    %-28s %10.2f us/op" % (nome, total / repeticoes * 1e6))
+    return total, resultado
+
+if __name__ == "__main__":
+    n = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    payloads = gera_payloads(n)
+    pareados = bytes(8) + random.Random(2).getrandbits(64).to_bytes(8, "little") + bytes(1)
+
+    print("Sondeio de status (%d sondeios, 64 zonas)" % n)
+    t_leg, r_leg = mede("legado (dict + comparacao)", sondeio_legado, payloads, n)
+    t_bit, r_bit = mede("bitmask + XOR", sondeio_bitmask, payloads, n)
+    assert r_leg == r_bit, (r_leg, r_bit)
+
+    print("Sensores pareados (%d decodificacoes)" % n)
+    t_pleg, _ = mede("legado (laco bit a bit)", lambda _: [legacy_paired(pareados) for _ in range(n)], None, n)
+    t_pbit, _ = mede("bitmask", lambda _: [paired_sensors_mask(pareados) for _ in range(n)], None, n)
+    assert set(legacy_paired(pareados)) == set(map(str, zones_in_mask(paired_sensors_mask(pareados))))
+
+    print("Ganho: sondeio %.0fx, pareados %.0fx" % (t_leg / t_bit, t_pleg / t_pbit))
@@ -2,11 +2,13 @@
 
 import socket
 import logging
+import time
 from typing import Dict, Any, List
 
 LOGGER = logging.getLogger(__name__)
 
 timeout = 2  # Set the timeout to 2 seconds
+keepalive_interval = 30  # Idle seconds before a keepalive is sent (0 disables)
 
 dst_id = [0x00, 0x00]
 our_id = [0x8F, 0xFF]
@@ -15,9 +17,20 @@ commands = {
     "status": [0x0B, 0x4A],
     "arm_disarm": [0x40, 0x1e],
     "panic": [0x40, 0x1a],
-    "paired_sensors": [0x0B, 0x01]
+    "paired_sensors": [0x0B, 0x01],
+    # There is no dedicated keepalive command; the short paired-sensors
+    # query is used instead
+    "keepalive": [0x0B, 0x01],
 }
 
+NAK = 0xF0FD
+NAK_AUTH_REQUIRED = 0x1F
+
+# ISECNet2 frame: dst_id (2) + our_id (2) + length (2) + command (2), then
+# payload and checksum. The length field counts command and payload.
+HEADER_LENGTH = 8
+RECV_BUFFER_SIZE = 1024
+
 # Constantes para el procesamiento de zonas (offset de la versión que funciona)
 ZONE_STATUS_PAYLOAD_OFFSET = 22 # The first zone byte within the payload (from the working fork)
 MAX_ZONES = 64 # Maximum number of zones that can be read (8 bytes * 8 bits)
@@ -44,6 +57,12 @@ def merge_octets(buf):
     """Merge octets."""
     return buf[0] * 256 + buf[1]
 
+def nak_reason(frame):
+    """Return the NAK reason of a response frame, or None if it is not a NAK."""
+    if len(frame) > 8 and merge_octets(frame[6:8]) == NAK:
+        return frame[8]
+    return None
+
 def battery_status_for(resp):
     """Retrieve the battery status."""
     if len(resp) <= 134:
@@ -76,41 +95,42 @@ def get_status(payload):
     LOGGER.debug("Unknown arming status code: 0x%02x", status)
     return "unknown"
 
-def get_zones_status_from_payload(payload: bytearray, num_zones: int = MAX_ZONES) -> Dict[str, str]:
+def zones_open_mask(payload, num_zones: int = MAX_ZONES) -> int:
     """
-    Decodes the zone status from the payload.
-    The zone status bytes start at ZONE_STATUS_PAYLOAD_OFFSET (22) in the status payload.
-    Each bit represents a zone (0 = closed, 1 = open/faulted).
-    Returns a dictionary of zone_id (str) to "open" or "closed".
+    Decodes the zone open bitmask from the status payload.
+    Bit n-1 set means zone n is open/faulted; the zone bytes start at
+    ZONE_STATUS_PAYLOAD_OFFSET (22), least significant zone first.
     """
-    zones_status_dict = {}
-    
     required_bytes_for_zones = (num_zones + 7) // 8
-    
-    if len(payload) < ZONE_STATUS_PAYLOAD_OFFSET + required_bytes_for_zones:
+    zone_bytes = payload[ZONE_STATUS_PAYLOAD_OFFSET : ZONE_STATUS_PAYLOAD_OFFSET + required_bytes_for_zones]
+    if len(zone_bytes) < required_bytes_for_zones:
         LOGGER.warning(f"Payload too short to decode all {num_zones} zones from offset {ZONE_STATUS_PAYLOAD_OFFSET}. Required at least {ZONE_STATUS_PAYLOAD_OFFSET + required_bytes_for_zones} bytes, got {len(payload)}.")
-        bytes_to_process = payload[ZONE_STATUS_PAYLOAD_OFFSET:]
-    else:
-        bytes_to_process = payload[ZONE_STATUS_PAYLOAD_OFFSET : ZONE_STATUS_PAYLOAD_OFFSET + required_bytes_for_zones]
-
-    zone_current_idx = 0
-    for byte_val in bytes_to_process:
-        for bit_index in range(8):
-            if zone_current_idx < num_zones:
-                zone_number = zone_current_idx + 1
-                is_open = bool(byte_val & (1 << bit_index))
-                zones_status_dict[str(zone_number)] = "open" if is_open else "closed"
-                zone_current_idx += 1
-            else:
-                break
-        if zone_current_idx >= num_zones:
-            break
-
+    return int.from_bytes(zone_bytes, "little") & ((1 << num_zones) - 1)
+
+def zones_in_mask(mask: int) -> List[int]:
+    """Returns the zone numbers (1-based) whose bits are set in the mask."""
+    zones = []
+    while mask:
+        lowest = mask & -mask
+        zones.append(lowest.bit_length())
+        mask ^= lowest
+    return zones
+
+def zones_dict_from_mask(mask: int, num_zones: int = MAX_ZONES, on="open", off="closed") -> Dict[str, str]:
+    """Builds a zone_id (str) -> state view of a bitmask."""
+    return {str(zone): on if (mask >> (zone - 1)) & 1 else off for zone in range(1, num_zones + 1)}
+
+def get_zones_status_from_payload(payload, num_zones: int = MAX_ZONES) -> Dict[str, str]:
+    """
+    Decodes the zone status from the payload.
+    Returns a dictionary of zone_id (str) to "open" or "closed".
+    """
+    zones_status_dict = zones_dict_from_mask(zones_open_mask(payload, num_zones), num_zones)
     LOGGER.debug(f"Decoded zones status: {zones_status_dict}")
     return zones_status_dict
 
 
-def build_status(data: bytearray) -> Dict[str, Any]:
+def build_status(data) -> Dict[str, Any]:
     """Build the amt-8000 status from a given array of bytes, including zone status."""
     if len(data) < 8:
         LOGGER.error("Received status data is too short (less than 8 bytes). Data: %s", data.hex())
@@ -123,7 +143,8 @@ def build_status(data: bytearray) -> Dict[str, Any]:
             "siren": False,
             "batteryStatus": "unknown",
             "tamper": False,
-            "zones": {}
+            "zones": {},
+            "zonesOpenMask": 0
         }
 
     length_bytes = data[4:6]
@@ -138,7 +159,8 @@ def build_status(data: bytearray) -> Dict[str, Any]:
             "siren": False,
             "batteryStatus": "unknown",
             "tamper": False,
-            "zones": {}
+            "zones": {},
+            "zonesOpenMask": 0
         }
 
     expected_payload_length = merge_octets(data[4:6])
@@ -182,7 +204,10 @@ def build_status(data: bytearray) -> Dict[str, Any]:
     else:
         LOGGER.debug("Payload too short for tamper status. Length: %d", len(payload))
 
-    status_data["zones"] = get_zones_status_from_payload(payload)
+    # Bitmask (bit n-1 = zone n), plus the per-zone view built from it
+    open_mask = zones_open_mask(payload)
+    status_data["zones"] = zones_dict_from_mask(open_mask)
+    status_data["zonesOpenMask"] = open_mask
 
     LOGGER.debug("Decoded status: %s", status_data)
     return status_data
@@ -206,10 +231,96 @@ class AuthError(Exception):
         super().__init__(self.message)
 
 
+def build_frame(command, params=()) -> bytes:
+    """Build a complete ISECNet2 frame for a command and its parameters."""
+    data = dst_id + our_id + split_into_octets(len(command) + len(params)) + command + list(params)
+    return bytes(data + [calculate_checksum(data)])
+
+def auth_params(password, device_type, software_version):
+    """Validate the password and build the authentication parameters."""
+    if not isinstance(password, str):
+        LOGGER.error(f"Password provided to auth() is not a string. Type: {type(password)}, Value: {password}")
+        raise CommunicationError("Password must be a string of 6 digits.")
+
+    if len(password) != 6 or not password.isdigit():
+        raise CommunicationError(
+            "Cannot parse password, only 6 digits long are accepted"
+        )
+
+    return [device_type] + [int(char) for char in password] + [software_version]
+
+def auth_result(return_data):
+    """Check the authentication response; raises AuthError if refused."""
+    if len(return_data) < 9:
+        raise CommunicationError(f"Authentication response too short. Length: {len(return_data)}. Raw: {return_data.hex()}")
+
+    result = return_data[8:9][0]
+
+    if result == 0:
+        LOGGER.info("Authentication successful.")
+        return True
+    if result == 1:
+        raise AuthError("Invalid password")
+    if result == 2:
+        raise AuthError("Incorrect software version")
+    if result == 3:
+        raise AuthError("Alarm panel will call back")
+    if result == 4:
+        raise AuthError("Waiting for user permission")
+    raise CommunicationError(f"Unknown payload response for authentication: 0x{result:02x}")
+
+def arm_result(return_data):
+    """Interpret the response to an arm command."""
+    if len(return_data) > 9 and return_data[9] in [0x91, 0x99]:
+    # Determinamos qué tipo de armado fue para un log más claro
+        arm_type = "con bypass de zonas" if return_data[9] == 0x99 else "normal"
+        LOGGER.info(f"Sistema armado exitosamente ({arm_type}).")
+        return 'armed'
+        
+    LOGGER.warning("Arm command failed. Response: %s", return_data.hex())
+    return 'not_armed'
+
+def disarm_result(return_data):
+    """Interpret the response to a disarm command."""
+    if len(return_data) > 9 and return_data[9] == 0x90:
+        LOGGER.info("System disarmed successfully.")
+        return 'disarmed'
+        
+    LOGGER.warning("Disarm command failed. Response: %s", return_data.hex())
+    return 'not_disarmed'
+
+def panic_result(return_data):
+    """Interpret the response to a panic command."""
+    if len(return_data) > 7 and return_data[7] == 0xfe:
+        LOGGER.info("Panic alarm triggered.")
+        return 'triggered'
+        
+    LOGGER.warning("Panic command failed. Response: %s", return_data.hex())
+    return 'not_triggered'
+
+def paired_sensors_mask(return_data) -> int:
+    """Decode the paired sensors response as a bitmask (bit n-1 = zone n paired)."""
+    # Check for error response first (0xfd at index 8, if panel sends it)
+    if len(return_data) > 8 and return_data[8] == 0xfd:
+        LOGGER.warning("Panel returned error for get_paired_sensors command (0xfd).")
+        return 0 # No zones if command failed
+
+    # The response starts in the byte 8 (after header): 8 bytes, 1 bit per zone
+    zone_bytes = return_data[8:16]
+    if len(zone_bytes) < 8:
+        LOGGER.warning(f"Datos de paired zones incompletos: {len(zone_bytes)} de 8 bytes.")
+    return int.from_bytes(zone_bytes, "little")
+
+def paired_sensors_from(return_data) -> Dict[str, bool]:
+    """Decode the paired sensors response."""
+    return {str(zone): True for zone in zones_in_mask(paired_sensors_mask(return_data))}
+
+
 class Client:
     """Client to communicate with amt-8000."""
 
-    def __init__(self, host, port, device_type=1, software_version=0x10):
+    def __init__(self, host, port, device_type=1, software_version=0x10,
+                 keepalive_interval=keepalive_interval):
         """Initialize the client."""
         self.host = host
         self.port = port
@@ -217,6 +328,11 @@ class Client:
         self.software_version = software_version
         self._socket = None # Usar un atributo privado para el socket
         self._is_connected = False # Nuevo flag para el estado de la conexión persistente
+        self._recv_buffer = bytearray(RECV_BUFFER_SIZE) # Reutilizado en cada respuesta
+        self.keepalive_interval = keepalive_interval
+        self._password = None # Contraseña de la última autenticación exitosa
+        self._authenticated = False # Sesión autenticada sobre la conexión actual
+        self._last_activity = 0.0
 
     def connect(self):
         """Establish a persistent socket connection."""
@@ -239,6 +355,7 @@ class Client:
             self._socket.settimeout(timeout)
             self._socket.connect((self.host, self.port))
             self._is_connected = True
+            self._authenticated = False
             LOGGER.info("Persistent connection established to %s:%d.", self.host, self.port)
             return True
         except (socket.timeout, ConnectionRefusedError, OSError) as e:
@@ -259,17 +376,59 @@ class Client:
                 self._socket = None
                 self._is_connected = False
 
-    def _send_command_and_receive_response(self, data_to_send: bytes) -> bytearray:
-        """Helper to send a command and receive its response using the persistent connection."""
+    def _recv_exactly(self, view: memoryview):
+        """Fill the given view with data from the socket."""
+        received = 0
+        while received < len(view):
+            n = self._socket.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionResetError("Connection closed by the panel")
+            received += n
+
+    def _receive_frame(self) -> memoryview:
+        """
+        Read one complete ISECNet2 frame from the socket.
+        The header is read first, then the declared length plus checksum.
+        Returns a memoryview of the whole frame (header, payload and
+        checksum), backed by a buffer that is reused by the next command.
+        """
+        buf = self._recv_buffer
+        self._recv_exactly(memoryview(buf)[:HEADER_LENGTH])
+
+        length = merge_octets(buf[4:6])
+        if length < 2:
+            raise CommunicationError(f"Invalid frame length {length}. Header: {buf[:HEADER_LENGTH].hex()}")
+        total = 6 + length + 1
+        if total > len(buf):
+            buf = bytearray(total)
+            buf[:HEADER_LENGTH] = self._recv_buffer[:HEADER_LENGTH]
+            self._recv_buffer = buf
+
+        self._recv_exactly(memoryview(buf)[HEADER_LENGTH:total])
+        frame = memoryview(buf)[:total]
+        if calculate_checksum(frame[:-1]) != frame[-1]:
+            raise CommunicationError(f"Invalid checksum in response: {frame.hex()}")
+        return frame
+
+    def _send_command_and_receive_response(self, data_to_send: bytes) -> memoryview:
+        """
+        Helper to send a command and receive its response using the persistent connection.
+        The returned memoryview is only valid until the next command.
+        """
         if not self._is_connected or not self._socket:
             LOGGER.warning("Attempting to send command without an active connection. Reconnecting.")
             self.connect() # Intenta reconectar si no está conectado
 
         try:
-            self._socket.send(data_to_send)
-            return_data = bytearray(self._socket.recv(1024))
+            self._socket.sendall(data_to_send)
+            return_data = self._receive_frame()
+            self._last_activity = time.monotonic()
             LOGGER.debug("Received response for command: %s", return_data.hex())
             return return_data
+        except CommunicationError:
+            # Trama inválida: el flujo quedó desincronizado
+            self.close()
+            raise
         except (socket.timeout, ConnectionResetError, BrokenPipeError) as e:
             # En caso de error de comunicación, marcar como desconectado para forzar reconexión
             self._is_connected = False 
@@ -280,65 +439,66 @@ class Client:
             self._socket = None
             raise CommunicationError(f"OS error during command communication: {e}")
 
+    def _send_authenticated_command(self, data_to_send: bytes) -> memoryview:
+        """
+        Send a command within the authenticated session.
+        Authenticates again only after a reconnect or when the panel
+        answers with an auth-required NAK (0x1f).
+        """
+        if self._password and not (self._is_connected and self._authenticated):
+            self.connect()
+            self.auth(self._password)
+
+        return_data = self._send_command_and_receive_response(data_to_send)
+        if self._password and nak_reason(return_data) == NAK_AUTH_REQUIRED:
+            LOGGER.info("Panel requires authentication again.")
+            self.auth(self._password)
+            return_data = self._send_command_and_receive_response(data_to_send)
+        return return_data
+
+    def ensure_session(self, password):
+        """Connect and authenticate, unless the current session already is."""
+        self.connect()
+        if self._is_connected and self._authenticated and password == self._password:
+            return True
+        return self.auth(password)
+
+    def keepalive(self):
+        """
+        Send a lightweight request if the session has been idle for
+        keepalive_interval seconds, so the panel keeps it open.
+        Returns True if a request was sent.
+        """
+        if not self.keepalive_interval or not self._is_connected or not self._authenticated:
+            return False
+        if time.monotonic() - self._last_activity < self.keepalive_interval:
+            return False
+
+        payload = build_frame(commands["keepalive"])
+
+        LOGGER.debug("Sending keepalive: %s", payload.hex())
+        self._send_authenticated_command(payload)
+        return True
+
     def auth(self, password):
         """Create an authentication for the current connection."""
-        if not isinstance(password, str):
-            LOGGER.error(f"Password provided to auth() is not a string. Type: {type(password)}, Value: {password}")
-            raise CommunicationError("Password must be a string of 6 digits.")
-
-        pass_array = []
-        if len(password) != 6 or not password.isdigit():
-            raise CommunicationError(
-                "Cannot parse password, only 6 digits long are accepted"
-            )
-            
-        for char in password:
-            pass_array.append(int(char))
-
-        length = [0x00, 0x0a]
-        data = (
-            dst_id
-            + our_id
-            + length
-            + commands["auth"]
-            + [self.device_type]
-            + pass_array
-            + [self.software_version]
-        )
-
-        cs = calculate_checksum(data)
-        payload = bytes(data + [cs])
+        payload = build_frame(commands["auth"], auth_params(password, self.device_type, self.software_version))
 
         LOGGER.debug("Sending authentication: %s", payload.hex())
+        self._authenticated = False
         return_data = self._send_command_and_receive_response(payload)
 
-        if len(return_data) < 9:
-            raise CommunicationError(f"Authentication response too short. Length: {len(return_data)}. Raw: {return_data.hex()}")
-
-        result = return_data[8:9][0]
-
-        if result == 0:
-            LOGGER.info("Authentication successful.")
-            return True
-        if result == 1:
-            raise AuthError("Invalid password")
-        if result == 2:
-            raise AuthError("Incorrect software version")
-        if result == 3:
-            raise AuthError("Alarm panel will call back")
-        if result == 4:
-            raise AuthError("Waiting for user permission")
-        raise CommunicationError(f"Unknown payload response for authentication: 0x{result:02x}")
+        auth_result(return_data)
+        self._password = password
+        self._authenticated = True
+        return True
 
     def status(self):
         """Return the current status."""
-        length = [0x00, 0x02]
-        status_data = dst_id + our_id + length + commands["status"]
-        cs = calculate_checksum(status_data)
-        payload = bytes(status_data + [cs])
+        payload = build_frame(commands["status"])
 
         LOGGER.debug("Sending status command: %s", payload.hex())
-        return_data = self._send_command_and_receive_response(payload)
+        return_data = self._send_authenticated_command(payload)
         
         status = build_status(return_data)
         return status
@@ -348,95 +508,38 @@ class Client:
         if partition == 0:
             partition = 0xFF
 
-        length = [0x00, 0x04]
-        arm_data = dst_id + our_id + length + commands["arm_disarm"] + [ partition, 0x01 ] # 0x01 for arm
-        cs = calculate_checksum(arm_data)
-        payload = bytes(arm_data + [cs])
+        payload = build_frame(commands["arm_disarm"], [ partition, 0x01 ]) # 0x01 for arm
 
         LOGGER.debug("Sending arm command: %s", payload.hex())
-        return_data = self._send_command_and_receive_response(payload)
-        
-        if len(return_data) > 9 and return_data[9] in [0x91, 0x99]:
-        # Determinamos qué tipo de armado fue para un log más claro
-            arm_type = "con bypass de zonas" if return_data[9] == 0x99 else "normal"
-            LOGGER.info(f"Sistema armado exitosamente ({arm_type}).")
-            return 'armed'
-            
-        LOGGER.warning("Arm command failed. Response: %s", return_data.hex())
-        return 'not_armed'
+        return arm_result(self._send_authenticated_command(payload))
 
     def disarm_system(self, partition):
         """Disarm the system for a given partition."""
         if partition == 0:
             partition = 0xFF
 
-        length = [0x00, 0x04]
-        disarm_data = dst_id + our_id + length + commands["arm_disarm"] + [ partition, 0x00 ] # 0x00 for disarm
-        cs = calculate_checksum(disarm_data)
-        payload = bytes(disarm_data + [cs])
+        payload = build_frame(commands["arm_disarm"], [ partition, 0x00 ]) # 0x00 for disarm
 
         LOGGER.debug("Sending disarm command: %s", payload.hex())
-        return_data = self._send_command_and_receive_response(payload)
-        
-        if len(return_data) > 9 and return_data[9] == 0x90:
-            LOGGER.info("System disarmed successfully.")
-            return 'disarmed'
-            
-        LOGGER.warning("Disarm command failed. Response: %s", return_data.hex())
-        return 'not_disarmed'
+        return disarm_result(self._send_authenticated_command(payload))
 
     def panic(self, panic_type):
         """Trigger a panic alarm."""
-        length = [0x00, 0x03]
-        panic_data = dst_id + our_id + length + commands["panic"] +[ panic_type ]
-        cs = calculate_checksum(panic_data)
-        payload = bytes(panic_data + [cs])
+        payload = build_frame(commands["panic"], [ panic_type ])
 
         LOGGER.debug("Sending panic command: %s", payload.hex())
-        return_data = self._send_command_and_receive_response(payload)
-        
-        if len(return_data) > 7 and return_data[7] == 0xfe:
-            LOGGER.info("Panic alarm triggered.")
-            return 'triggered'
-            
-        LOGGER.warning("Panic command failed. Response: %s", return_data.hex())
-        return 'not_triggered'
+        return panic_result(self._send_authenticated_command(payload))
     
     def get_paired_sensors(self) -> Dict[str, bool]:
         """Get the list of paired sensors from the alarm panel."""
-        length = [0x00, 0x02] # Command is 2 bytes
-        sensors_data = dst_id + our_id + length + commands["paired_sensors"]
-        cs = calculate_checksum(sensors_data)
-        payload = bytes(sensors_data + [cs])
+        payload = build_frame(commands["paired_sensors"])
 
         LOGGER.debug("Sending paired sensors command: %s", payload.hex())
-        return_data = self._send_command_and_receive_response(payload)
+        return paired_sensors_from(self._send_authenticated_command(payload))
 
-        # Check for error response first (0xfd at index 8, if panel sends it)
-        if len(return_data) > 8 and return_data[8] == 0xfd:
-            LOGGER.warning("Panel returned error for get_paired_sensors command (0xfd).")
-            return {} # Return empty if command failed
+    def get_paired_sensors_mask(self) -> int:
+        """Get the paired sensors as a bitmask (bit n-1 = zone n paired)."""
+        payload = build_frame(commands["paired_sensors"])
 
-        # The response starts in the byte 8 (after header)
-        # Each byte represents 8 zones (1 bit per zone)
-        paired_zones = {}
-        try:
-            # Skip header (8 bytes) and read the 8 bytes of zone data
-            for byte_index in range(8):  # 8 bytes = 64 zones
-                # Ensure we have enough data in return_data for the current byte
-                if len(return_data) > 8 + byte_index:
-                    byte_value = return_data[8 + byte_index]
-                    for bit in range(8):
-                        zone_number = (byte_index * 8) + bit + 1
-                        # If the bit is 1, the zone is paired
-                        if (byte_value & (1 << bit)) > 0:
-                            paired_zones[str(zone_number)] = True
-                else:
-                    LOGGER.warning(f"Datos de paired zones incompletos en el byte {byte_index} del payload esperado.")
-                    break # Exit if no more data
-
-        except Exception as e:
-            LOGGER.error(f"Error procesando datos de sensores emparejados: {e}", exc_info=True)
-            return {} # Return an empty dictionary in case of error
-
-        return paired_zones
+        LOGGER.debug("Sending paired sensors command: %s", payload.hex())
+        return paired_sensors_mask(self._send_authenticated_command(payload))
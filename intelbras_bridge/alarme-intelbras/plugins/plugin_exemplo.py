@@ -0,0 +1,23 @@
+# Exemplo de plugin Python para o receptorip.
+#
+# Para ativar, inclua na configuração:
+#
+#     plugins = plugin_exemplo
+#
+# As funções são chamadas dentro do event loop, sem criar processos,
+# e recebem objetos EventoAlarme e FotoObtida (ver alarmeitbl/plugins.py).
+
+from alarmeitbl.myeventloop import Log
+
+# Códigos de ativação/desativação (ver alarmeitbl/tratador.py)
+ATIVACAO = (401, 403, 404, 407)
+
+def evento_alarme(evento):
+    if evento.codigo in ATIVACAO:
+        estado = evento.qualificador == 3 and "Ativado" or "Desativado"
+        Log.info("plugin exemplo: particao %d %s" % (evento.particao, estado))
+    elif evento.codigo == 130 and evento.qualificador == 1:
+        Log.info("plugin exemplo: disparo da zona %d" % evento.zona)
+
+def foto_obtida(foto):
+    Log.info("plugin exemplo: foto %d:%d em %s" % (foto.indice, foto.nrfoto, foto.arquivo))
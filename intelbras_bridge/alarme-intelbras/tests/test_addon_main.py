@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Testes do actor de estado do addon_main.py, com um cliente MQTT falso
+# que registra as publicações: republicação completa (reconexão ao broker
+# e ressincronização periódica) e mapeamento dos eventos Contact ID do
+# receptor embebido.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import paho.mqtt.client
+except ImportError:
+    paho = None
+
+if paho:
+    import addon_main
+    from alarmeitbl.plugins import EventoAlarme
+
+
+# Globais do addon_main alterados pelos testes e restaurados depois
+SALVOS = ("request_poll", "panic_event", "mqtt_client", "COMPACT_STATE", "ZONE_COUNT", "ZONES_MASK")
+
+
+class Publicacao:
+    rc = 0
+
+
+class MQTTFalso:
+    def __init__(self):
+        self.publicado = []
+
+    def publish(self, topico, valor, retain=False):
+        self.publicado.append((topico, valor))
+        return Publicacao()
+
+    def topicos(self):
+        return {topico: valor for topico, valor in self.publicado}
+
+
+@unittest.skipUnless(paho, "paho-mqtt não instalado")
+class AddonTestes(unittest.TestCase):
+    def setUp(self):
+        self.salvo = {nome: getattr(addon_main, nome) for nome in SALVOS}
+        self.dicts = [(d, dict(d)) for d in (addon_main.zone_masks, addon_main.zone_states, addon_main.panel_state)]
+        self.mqtt = addon_main.mqtt_client = MQTTFalso()
+        addon_main.COMPACT_STATE = False
+        addon_main.ZONE_COUNT = 2; addon_main.ZONES_MASK = 3
+        addon_main.zone_masks.update(active=3, open=0, alarm=0, known=0)
+        addon_main.zone_states.clear(); addon_main.zone_states.update({"1": "Desconocido", "2": "Desconocido"})
+        addon_main.panel_state.clear()
+        addon_main.last_published.clear()
+        # O pedido de sondeo dirigido não deve acordar nada durante o teste
+        addon_main.request_poll = lambda motivo: None
+
+    def tearDown(self):
+        for nome, valor in self.salvo.items():
+            setattr(addon_main, nome, valor)
+        for d, original in self.dicts:
+            d.clear()
+            d.update(original)
+        addon_main.last_published.clear()
+
+
+class TestRepublicacao(AddonTestes):
+    def estado_conhecido(self):
+        addon_main.set_armed(True)
+        addon_main.set_panel_flag("ac_power", "off")
+        addon_main.set_panel_flag("system_battery", "on")
+        addon_main.zone_triggered(2)
+        self.mqtt.publicado.clear()
+
+    def test_ressincronizacao_republica_tudo(self):
+        self.estado_conhecido()
+        addon_main.republish_all()
+        topicos = self.mqtt.topicos()
+        self.assertEqual(topicos["intelbras/alarm/state"], "Disparada")
+        self.assertEqual(topicos["intelbras/alarm/ac_power"], "off")
+        self.assertEqual(topicos["intelbras/alarm/system_battery"], "on")
+        self.assertEqual(topicos["intelbras/alarm/zone_1"], "Desconocido")
+        self.assertEqual(topicos["intelbras/alarm/zone_2"], "Disparada")
+        self.assertIn("homeassistant/sensor/intelbras_alarm/zone_1/config", topicos)
+
+        # Sem mudanças, a publicação seguinte não repete nada
+        self.mqtt.publicado.clear()
+        addon_main.publish_zone_states()
+        self.assertEqual(self.mqtt.publicado, [])
+
+    def test_reconexao_mqtt_republica_ultimos_valores(self):
+        self.estado_conhecido()
+        addon_main.mqtt_connected()
+        topicos = self.mqtt.topicos()
+        self.assertEqual(topicos["intelbras/alarm/availability"], "online")
+        self.assertEqual(topicos["intelbras/alarm/state"], "Disparada")
+        self.assertEqual(topicos["intelbras/alarm/ac_power"], "off")
+        self.assertEqual(topicos["intelbras/alarm/zone_2"], "Disparada")
+
+    def test_primeira_conexao_publica_padroes(self):
+        addon_main.mqtt_connected()
+        topicos = self.mqtt.topicos()
+        self.assertEqual(topicos["intelbras/alarm/ac_power"], "on")
+        self.assertEqual(topicos["intelbras/alarm/system_battery"], "on")
+        self.assertEqual(topicos["intelbras/alarm/zone_1"], "Desconocido")
+
+    def test_modo_compacto(self):
+        addon_main.COMPACT_STATE = True
+        self.estado_conhecido()
+        addon_main.republish_all()
+        topicos = self.mqtt.topicos()
+        self.assertNotIn("intelbras/alarm/state", topicos)
+        self.assertIn('"state": "Disparada"', topicos["intelbras/alarm/json"])
+
+
+
+class TestEventosContactID(AddonTestes):
+    def setUp(self):
+        super().setUp()
+        self.panicos = []
+        addon_main.panic_event = self.panicos.append
+
+    def evento(self, codigo, qualificador, zona=0, tipo_msg=18, descricao=""):
+        addon_main.handle_alarm_event(EventoAlarme("10.0.0.2", codigo, 1, zona, qualificador, tipo_msg, descricao, None, 0))
+        return self.mqtt.topicos()
+
+    def test_armado_e_desarmado(self):
+        for codigo in addon_main.ARM_EVENT_CODES:
+            # Restauração = ativação, abertura = desativação
+            self.assertEqual(self.evento(codigo, 3)["intelbras/alarm/state"], "Armada")
+            self.assertEqual(self.evento(codigo, 1)["intelbras/alarm/state"], "Desarmada")
+
+    def test_desarme_fecha_zonas_disparadas(self):
+        self.evento(401, 3)
+        self.assertEqual(self.evento(130, 1, zona=2)["intelbras/alarm/zone_2"], "Disparada")
+        topicos = self.evento(401, 1)
+        self.assertEqual(topicos["intelbras/alarm/zone_2"], "Cerrada")
+        self.assertEqual(addon_main.zone_masks["alarm"], 0)
+
+    def test_disparo_e_restauracao_de_zona(self):
+        topicos = self.evento(130, 1, zona=1)
+        self.assertEqual(topicos["intelbras/alarm/zone_1"], "Disparada")
+        self.assertEqual(topicos["intelbras/alarm/state"], "Disparada")
+        self.assertEqual(self.evento(130, 3, zona=1)["intelbras/alarm/zone_1"], "Cerrada")
+        # Códigos de disparo sem restauração valem com qualquer qualificador
+        self.assertEqual(self.evento(133, 3, zona=2)["intelbras/alarm/zone_2"], "Disparada")
+
+    def test_energia_e_bateria(self):
+        self.assertEqual(self.evento(301, 1)["intelbras/alarm/ac_power"], "off")
+        self.assertEqual(self.evento(301, 3)["intelbras/alarm/ac_power"], "on")
+        self.assertEqual(self.evento(302, 1)["intelbras/alarm/system_battery"], "on")
+        self.assertEqual(self.evento(302, 3)["intelbras/alarm/system_battery"], "off")
+
+    def test_panico(self):
+        self.evento(120, 1, descricao="Panico")
+        self.evento(122, 1)
+        self.assertEqual(self.panicos, ["Panico", 122])
+
+    def test_eventos_ignorados(self):
+        self.evento(401, 3, tipo_msg=17)
+        self.evento(401, 6)
+        self.evento(602, 1)
+        self.assertEqual(self.mqtt.publicado, [])
+        self.assertEqual(self.panicos, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Testes do Buffer (consumo por deslocamento, fatias como memoryview) e da
+# recepção com recv_into() nos handlers TCP do myeventloop.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, socket, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import EventLoop, Handler, Poller, SelectorsPoller, Timeout, Log
+from alarmeitbl.myeventloop.buffer import Buffer
+from alarmeitbl.myeventloop.tcpserver import TCPServerHandler
+
+class TestBuffer(unittest.TestCase):
+    def test_acrescenta_e_consome(self):
+        b = Buffer()
+        self.assertFalse(b)
+        b += b"abcdef"
+        b += [0x67, 0x68]
+        self.assertEqual(len(b), 8)
+        b.consume(2)
+        self.assertTrue(b)
+        self.assertEqual(len(b), 6)
+        self.assertEqual(b[0], ord("c"))
+        self.assertEqual(b[-1], ord("h"))
+        with self.assertRaises(IndexError):
+            b[6]
+        self.assertEqual(bytes(b), b"cdefgh")
+        self.assertEqual(list(b)[:2], [ord("c"), ord("d")])
+
+        # Consumir além do fim apenas esvazia
+        b.consume(100)
+        self.assertEqual(len(b), 0)
+        b += b"xy"
+        self.assertEqual(bytes(b), b"xy")
+        b.clear()
+        self.assertFalse(b)
+
+    def test_fatia_e_view(self):
+        b = Buffer()
+        b += b"0123456789"
+        b.consume(3)
+        fatia = b[1:4]
+        self.assertIsInstance(fatia, memoryview)
+        self.assertEqual(bytes(fatia), b"456")
+        self.assertEqual(bytes(b[-2:]), b"89")
+        self.assertEqual(bytes(b[0:100]), b"3456789")
+
+    def test_compacta_area_consumida(self):
+        b = Buffer()
+        b += bytes(10000)
+        b.consume(9000)
+        b += b"fim"
+        self.assertEqual(b._start, 0)
+        self.assertEqual(len(b._data), 1003)
+
+        # Pequeno demais para compactar: só avança o deslocamento
+        b.consume(10)
+        b += b"!"
+        self.assertEqual(b._start, 10)
+        self.assertEqual(bytes(b[-4:]), b"fim!")
+
+    def test_view_viva_durante_extend(self):
+        b = Buffer()
+        b += b"abc" * 2000
+        b.consume(5000)
+        viva = b[0:3]
+        # Compactar ou crescer com a view viva não pode falhar
+        b += b"xyz" * 1000
+        self.assertEqual(bytes(viva), b"cab")
+        self.assertEqual(len(b), 1000 + 3000)
+        self.assertEqual(bytes(b[-3:]), b"xyz")
+
+
+class Conexao(TCPServerHandler):
+    def __init__(self, sock):
+        sock.setblocking(False)
+        super().__init__(("127.0.0.1", 1), sock)
+        self.latest = []
+        self.registros = []
+
+    def recv_callback(self, latest):
+        self.latest.append((type(latest), len(latest)))
+        # Registros de tamanho fixo; o resto fica no buffer
+        while len(self.recv_buf) >= 100:
+            self.registros.append(bytes(self.recv_buf[:100]))
+            self.recv_buf.consume(100)
+
+
+class TestRecvInto(unittest.TestCase):
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        self.reinicia()
+        self.loop = EventLoop(SelectorsPoller())
+        a, self.outro = socket.socketpair()
+        self.conexao = Conexao(a)
+
+    def tearDown(self):
+        for h in list(Handler.items.values()):
+            h.destroy()
+        self.outro.close()
+        self.reinicia()
+        Log.set_level(self.nivel)
+
+    def reinicia(self):
+        Handler.items.clear()
+        Handler.by_fd.clear()
+        Timeout.pending.clear()
+        Timeout.heap = []
+        Timeout.by_owner.clear()
+        if Poller.current:
+            Poller.current.close()
+        Poller.current = None
+
+    def test_recepcao_em_blocos(self):
+        dados = bytes(i % 251 for i in range(10050))
+        self.outro.sendall(dados)
+        Timeout.new("limite", 1, lambda t: None)
+        while sum(n for _, n in self.conexao.latest) < len(dados):
+            self.loop.cycle()
+
+        # Área de recepção fixa: no máximo 4096 octetos por leitura, sem cópia
+        self.assertGreaterEqual(len(self.conexao.latest), 3)
+        for tipo, n in self.conexao.latest:
+            self.assertIs(tipo, memoryview)
+            self.assertLessEqual(n, 4096)
+        self.assertEqual(b"".join(self.conexao.registros), dados[:10000])
+        self.assertEqual(bytes(self.conexao.recv_buf), dados[10000:])
+
+    def test_envio_e_fechamento(self):
+        self.conexao.send(b"ola")
+        Timeout.new("limite", 1, lambda t: None)
+        self.loop.cycle()
+        self.assertEqual(self.outro.recv(10), b"ola")
+        self.assertFalse(self.conexao.send_buf)
+
+        self.outro.shutdown(socket.SHUT_WR)
+        self.loop.cycle()
+        self.assertTrue(self.conexao.destroyed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Testes do canal de eventos estruturados: um registro JSON por linha para
+# cada consumidor, com "seq" e "ts", e descarte limitado por max_pendente
+# quando o consumidor é lento, seguido do registro "descartados".
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, json, socket, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import Handler, Poller, Timeout, Log
+from alarmeitbl.canal_eventos import CanalEventos, ConsumidorEventos
+
+def reinicia_event_loop():
+    Handler.items.clear()
+    Handler.by_fd.clear()
+    Timeout.pending.clear()
+    Timeout.heap = []
+    Timeout.by_owner.clear()
+    if Poller.current:
+        Poller.current.close()
+    Poller.current = None
+
+
+class TestCanalEventos(unittest.TestCase):
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        reinicia_event_loop()
+        self.max_pendente = ConsumidorEventos.max_pendente
+        self.dir = tempfile.TemporaryDirectory()
+        self.canal = CanalEventos(os.path.join(self.dir.name, "eventos.sock"))
+        self.cliente = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.cliente.connect(self.canal.caminho)
+        self.canal.read_callback()
+        self.consumidor, = self.canal.consumidores
+
+    def tearDown(self):
+        ConsumidorEventos.max_pendente = self.max_pendente
+        self.cliente.close()
+        for handler in list(Handler.items.values()):
+            handler.destroy()
+        self.dir.cleanup()
+        reinicia_event_loop()
+        Log.set_level(self.nivel)
+
+    def esvazia(self):
+        # Envia o buffer do consumidor e lê as linhas recebidas pelo cliente
+        while self.consumidor.is_writable():
+            self.consumidor.write_callback()
+        self.cliente.setblocking(False)
+        dados = b""
+        try:
+            while True:
+                dados += self.cliente.recv(65536)
+        except BlockingIOError:
+            pass
+        return [json.loads(linha) for linha in dados.decode().splitlines()]
+
+    def test_registros_com_seq_e_ts(self):
+        self.canal.publicar({"tipo": "heartbeat", "central": "10.0.0.2"})
+        self.canal.publicar({"tipo": "alarme", "central": "10.0.0.2", "codigo": 130})
+        registros = self.esvazia()
+        self.assertEqual([r["seq"] for r in registros], [1, 2])
+        self.assertEqual(registros[1]["codigo"], 130)
+        for registro in registros:
+            self.assertIn("ts", registro)
+            self.assertEqual(registro["central"], "10.0.0.2")
+
+    def test_consumidor_lento_descarta(self):
+        linha = len(CanalEventos.serializar(self.canal.carimbar({"tipo": "heartbeat", "central": "10.0.0.2"})))
+        ConsumidorEventos.max_pendente = 3 * linha
+        for i in range(10):
+            self.canal.publicar({"tipo": "heartbeat", "central": "10.0.0.2"})
+        self.assertEqual(self.consumidor.descartados, 7)
+        self.assertEqual(len(self.consumidor.send_buf), 3 * linha)
+
+        registros = self.esvazia()
+        self.assertEqual([r["seq"] for r in registros[:3]], [1, 2, 3])
+        aviso = registros[3]
+        self.assertEqual(aviso["tipo"], "descartados")
+        self.assertEqual(aviso["n"], 7)
+        # Carimbado com o último seq publicado, sem consumir um número
+        self.assertEqual(aviso["seq"], 10)
+        self.assertIn("ts", aviso)
+        self.assertEqual(self.consumidor.descartados, 0)
+
+        self.canal.publicar({"tipo": "heartbeat", "central": "10.0.0.2"})
+        self.assertEqual([r["seq"] for r in self.esvazia()], [11])
+
+    def test_sem_consumidores_seq_avanca(self):
+        self.cliente.close()
+        self.consumidor.read_callback()
+        self.assertEqual(self.canal.consumidores, set())
+        self.canal.publicar({"tipo": "heartbeat", "central": "10.0.0.2"})
+        self.assertEqual(self.canal.seq, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Testes do enquadramento e da sessão persistente do client.py sobre um
+# socketpair: cabeçalho curto, checksum inválido, reautenticação após NAK
+# 0x1f, reuso do buffer de recepção e keepalive (0x0B01) só quando ocioso;
+# decodificação das zonas em build_status().
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, socket, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import client
+from client import Client, CommunicationError, build_frame, commands
+
+SENHA = "123456"
+
+def resposta(comando, params=()):
+    # Resposta da central; o checksum é o mesmo das tramas enviadas
+    return build_frame(comando, params)
+
+def nak(motivo):
+    return resposta([0xF0, 0xFD], [motivo])
+
+def auth_ok():
+    return resposta(commands["auth"], [0])
+
+def sensores(mascara):
+    # Resposta à consulta de sensores pareados: 8 octetos, 1 bit por zona
+    return resposta(commands["paired_sensors"], mascara.to_bytes(8, "little"))
+
+def tramas(dados):
+    # Separa as tramas enviadas pelo cliente, devolvendo o comando de cada
+    lista = []
+    while dados:
+        total = 6 + client.merge_octets(dados[4:6]) + 1
+        lista.append(client.merge_octets(dados[6:8]))
+        dados = dados[total:]
+    return lista
+
+
+class ClientePar(Client):
+    # Em vez de conectar via TCP, entrega a próxima ponta de socketpair
+    def __init__(self, pontas, **kw):
+        super().__init__("central", 9009, **kw)
+        self.pontas = pontas
+        self.conexoes = 0
+
+    def connect(self):
+        if self._is_connected and self._socket:
+            return True
+        self._socket = self.pontas.pop(0)
+        self._socket.settimeout(1)
+        self._is_connected = True
+        self._authenticated = False
+        self.conexoes += 1
+        return True
+
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self.centrais = []
+        pontas = []
+        for i in range(2):
+            a, b = socket.socketpair()
+            pontas.append(a)
+            self.centrais.append(b)
+        self.central = self.centrais[0]
+        self.cliente = ClientePar(pontas)
+
+    def tearDown(self):
+        self.cliente.close()
+        for s in self.centrais + self.cliente.pontas:
+            s.close()
+
+    def recebido(self, central=None):
+        central = central or self.central
+        central.setblocking(False)
+        dados = b""
+        try:
+            while True:
+                parte = central.recv(4096)
+                if not parte:
+                    break
+                dados += parte
+        except BlockingIOError:
+            pass
+        return dados
+
+    def autenticado(self):
+        self.central.send(auth_ok())
+        self.assertTrue(self.cliente.ensure_session(SENHA))
+        self.assertEqual(tramas(self.recebido()), [0xF0F0])
+
+    def test_cabecalho_curto(self):
+        self.cliente.connect()
+        self.central.send(auth_ok()[:5])
+        self.central.close()
+        with self.assertRaises(CommunicationError):
+            self.cliente.auth(SENHA)
+        self.assertFalse(self.cliente._is_connected)
+        self.assertIsNone(self.cliente._socket)
+
+    def test_checksum_invalido(self):
+        self.cliente.connect()
+        trama = bytearray(auth_ok())
+        trama[-1] ^= 0x55
+        self.central.send(trama)
+        with self.assertRaises(CommunicationError):
+            self.cliente.auth(SENHA)
+        # Fluxo dessincronizado: a conexão é fechada
+        self.assertFalse(self.cliente._is_connected)
+        self.assertIsNone(self.cliente._socket)
+        self.assertEqual(tramas(self.recebido()), [0xF0F0])
+        self.assertEqual(self.central.recv(1), b"")
+
+    def test_nak_pede_reautenticacao(self):
+        self.autenticado()
+        self.central.send(nak(client.NAK_AUTH_REQUIRED) + auth_ok()
+                          + sensores(0x03))
+        self.assertEqual(self.cliente.get_paired_sensors_mask(), 0x03)
+        self.assertEqual(tramas(self.recebido()), [0x0B01, 0xF0F0, 0x0B01])
+        self.assertEqual(self.cliente.conexoes, 1)
+
+    def test_nak_de_outro_motivo_nao_reautentica(self):
+        self.autenticado()
+        self.central.send(nak(0x01))
+        self.cliente.get_paired_sensors_mask()
+        self.assertEqual(tramas(self.recebido()), [0x0B01])
+
+    def test_reconexao_reautentica(self):
+        self.autenticado()
+        self.central.close()
+        with self.assertRaises(CommunicationError):
+            self.cliente.get_paired_sensors_mask()
+
+        central = self.centrais[1]
+        central.send(auth_ok() + sensores(0x05))
+        self.assertEqual(self.cliente.get_paired_sensors_mask(), 0x05)
+        self.assertEqual(self.cliente.conexoes, 2)
+        self.assertEqual(tramas(self.recebido(central)), [0xF0F0, 0x0B01])
+
+    def test_buffer_reusado_entre_tramas(self):
+        self.autenticado()
+        buf = self.cliente._recv_buffer
+
+        self.central.send(sensores(0x01) + sensores(0x02))
+        self.assertEqual(self.cliente.get_paired_sensors_mask(), 0x01)
+        self.assertEqual(self.cliente.get_paired_sensors_mask(), 0x02)
+        self.assertIs(self.cliente._recv_buffer, buf)
+
+        # Trama maior que o buffer: cresce uma vez e continua reusado
+        grande = [0xAA] * (client.RECV_BUFFER_SIZE + 100)
+        self.central.send(resposta(commands["status"], grande))
+        self.cliente._send_authenticated_command(build_frame(commands["status"]))
+        maior = self.cliente._recv_buffer
+        self.assertGreater(len(maior), client.RECV_BUFFER_SIZE)
+
+        self.central.send(sensores(0x04))
+        self.assertEqual(self.cliente.get_paired_sensors_mask(), 0x04)
+        self.assertIs(self.cliente._recv_buffer, maior)
+
+    def test_keepalive_so_quando_ocioso(self):
+        self.autenticado()
+        self.assertFalse(self.cliente.keepalive())
+        self.assertEqual(self.recebido(), b"")
+
+        self.cliente._last_activity = time.monotonic() - self.cliente.keepalive_interval
+        self.central.send(resposta(commands["keepalive"], [0x00]))
+        self.assertTrue(self.cliente.keepalive())
+        self.assertEqual(tramas(self.recebido()), [0x0B01])
+
+        # A resposta conta como atividade
+        self.assertFalse(self.cliente.keepalive())
+
+    def test_keepalive_desabilitado(self):
+        self.cliente.keepalive_interval = 0
+        self.autenticado()
+        self.cliente._last_activity = 0
+        self.assertFalse(self.cliente.keepalive())
+        self.assertEqual(self.recebido(), b"")
+
+
+
+class TestBuildStatus(unittest.TestCase):
+    def test_zonas_e_mascara(self):
+        payload = bytearray(72)
+        payload[0] = 1
+        payload[client.ZONE_STATUS_PAYLOAD_OFFSET] = 0b101
+        payload[client.ZONE_STATUS_PAYLOAD_OFFSET + 1] = 0x80
+        status = client.build_status(resposta(commands["status"], payload))
+        self.assertEqual(status["model"], "AMT-8000")
+        self.assertEqual(status["zonesOpenMask"], 0x8005)
+        self.assertEqual(client.zones_in_mask(status["zonesOpenMask"]), [1, 3, 16])
+        self.assertEqual(len(status["zones"]), client.MAX_ZONES)
+        self.assertEqual([z for z, estado in status["zones"].items() if estado == "open"], ["1", "3", "16"])
+        self.assertEqual(status["zones"]["2"], "closed")
+
+    def test_resposta_curta(self):
+        status = client.build_status(b"\x00" * 4)
+        self.assertEqual(status["zones"], {})
+        self.assertEqual(status["zonesOpenMask"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Testes do ciclo do EventLoop: todos os descritores prontos são atendidos
+# no mesmo ciclo, o interesse é reavaliado após cada callback e timeout do
+# Handler, e um Handler destruído por outro no mesmo ciclo não é chamado.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, socket, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import EventLoop, Handler, Poller, SelectPoller, SelectorsPoller, Timeout, Log
+
+class Ponta(Handler):
+    def __init__(self, sock, nome):
+        sock.setblocking(False)
+        super().__init__(nome, sock, OSError)
+        self.escrita = False
+        self.eventos = []
+        self.ao_ler = None
+
+    def is_writable(self):
+        return self.escrita
+
+    def read_callback(self):
+        dados = self.fd.recv(4096)
+        self.eventos.append(("leitura", dados))
+        if self.ao_ler:
+            self.ao_ler()
+
+    def write_callback(self):
+        self.eventos.append(("escrita",))
+        self.escrita = False
+
+
+class CicloTestes:
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        self.reinicia()
+        self.loop = EventLoop(self.poller())
+        self.pares = []
+
+    def tearDown(self):
+        for h in list(Handler.items.values()):
+            h.destroy()
+        for s in self.pares:
+            s.close()
+        self.reinicia()
+        Log.set_level(self.nivel)
+
+    def reinicia(self):
+        Handler.items.clear()
+        Handler.by_fd.clear()
+        Timeout.pending.clear()
+        Timeout.heap = []
+        Timeout.by_owner.clear()
+        if Poller.current:
+            Poller.current.close()
+        Poller.current = None
+
+    def ponta(self, nome):
+        a, b = socket.socketpair()
+        self.pares.append(b)
+        return Ponta(a, nome), b
+
+    def test_todos_prontos_no_mesmo_ciclo(self):
+        pontas = [self.ponta("p%d" % i) for i in range(5)]
+        self.assertEqual(Handler.find_by_fd(pontas[2][0].fd), pontas[2][0])
+        # Registra os descritores antes de haver dados
+        Timeout.new("limite", 0.01, lambda t: None)
+        self.loop.cycle()
+        for i, (_, outro) in enumerate(pontas):
+            outro.send(b"%d" % i)
+        Timeout.new("limite", 1, lambda t: None)
+        self.loop.cycle()
+        for i, (p, _) in enumerate(pontas):
+            self.assertEqual(p.eventos, [("leitura", b"%d" % i)])
+
+    def test_destruido_no_mesmo_ciclo_nao_e_chamado(self):
+        a, outro_a = self.ponta("a")
+        b, outro_b = self.ponta("b")
+        a.ao_ler = lambda: b.destroy() if not b.destroyed else None
+        b.ao_ler = lambda: a.destroy() if not a.destroyed else None
+        outro_a.send(b"x")
+        outro_b.send(b"y")
+        Timeout.new("limite", 1, lambda t: None)
+        self.loop.cycle()
+        # Só o primeiro atendido leu; o outro foi destruído antes
+        self.assertEqual(len(a.eventos) + len(b.eventos), 1)
+        self.assertEqual(len(Handler.items), 1)
+
+    def test_interesse_reavaliado_apos_callback(self):
+        p, outro = self.ponta("p")
+        def quer_escrever():
+            p.escrita = True
+        p.ao_ler = quer_escrever
+        outro.send(b"x")
+        Timeout.new("limite", 1, lambda t: None)
+        self.loop.cycle()
+        # Sem interest_changed() explícito, a escrita é atendida no próximo ciclo
+        self.loop.cycle()
+        self.assertEqual(p.eventos, [("leitura", b"x"), ("escrita",)])
+
+    def test_interesse_reavaliado_apos_timeout_do_dono(self):
+        p, _ = self.ponta("p")
+        def quer_escrever(t):
+            p.escrita = True
+        p.timeout("escreve", 0, quer_escrever)
+        self.loop.cycle()
+        self.loop.cycle()
+        self.assertEqual(p.eventos, [("escrita",)])
+
+    def test_termina_sem_tarefas(self):
+        executados = []
+        Timeout.new("unico", 0, lambda t: executados.append(t.label))
+        self.loop.loop()
+        self.assertEqual(executados, ["unico"])
+        self.assertFalse(self.loop.cycle())
+
+
+class TestCicloSelect(CicloTestes, unittest.TestCase):
+    def poller(self):
+        return SelectPoller()
+
+
+class TestCicloSelectors(CicloTestes, unittest.TestCase):
+    def poller(self):
+        return SelectorsPoller()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Testes da fila persistente de fotos (deduplicação, progresso e retenção).
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.fila_fotos import FilaFotos
+from alarmeitbl.tratador_fotos import ItemFoto
+
+class TestFilaFotos(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.caminho = os.path.join(self.dir.name, "fila.sqlite")
+        self.retencao = FilaFotos.retencao
+        self.intervalo_expurgo = FilaFotos.intervalo_expurgo
+
+    def tearDown(self):
+        FilaFotos.retencao = self.retencao
+        FilaFotos.intervalo_expurgo = self.intervalo_expurgo
+        self.dir.cleanup()
+
+    def test_foto_repetida_recusada(self):
+        fila = FilaFotos(":memory:")
+        self.assertTrue(fila.adicionar("10.0.0.1", 7, 0, 10))
+        self.assertFalse(fila.adicionar("10.0.0.1", 7, 0, 10))
+        # Outra foto do mesmo evento, ou o mesmo índice de outra central
+        self.assertTrue(fila.adicionar("10.0.0.1", 7, 1, 10))
+        self.assertTrue(fila.adicionar("10.0.0.2", 7, 0, 10))
+        self.assertEqual(len(fila.pendentes()), 3)
+
+    def test_progresso_preservado(self):
+        fila = FilaFotos(":memory:")
+        fila.adicionar("10.0.0.1", 7, 0, 10)
+        item = ItemFoto("10.0.0.1", 7, 0, 9)
+        item.nr_fragmentos = 40
+        item.gravados = 16
+        item.bytes_gravados = 16 * 1024
+        item.temporario = "/tmp/.imagem.7.0.parcial"
+        fila.atualizar(item)
+        self.assertEqual(fila.pendentes(),
+                         [("10.0.0.1", 7, 0, 9, 40, 16, 16 * 1024, "/tmp/.imagem.7.0.parcial")])
+
+    def test_pendentes_sobrevivem_a_reinicio(self):
+        fila = FilaFotos(self.caminho)
+        fila.adicionar("10.0.0.1", 7, 0, 10)
+        fila.adicionar("10.0.0.1", 8, 0, 10)
+        fila.encerrar(ItemFoto("10.0.0.1", 8, 0, 10), "concluida")
+        fila.db.close()
+
+        fila = FilaFotos(self.caminho)
+        self.assertEqual([p[:3] for p in fila.pendentes()], [("10.0.0.1", 7, 0)])
+        # A encerrada continua deduplicando dentro da retenção
+        self.assertFalse(fila.adicionar("10.0.0.1", 8, 0, 10))
+
+    def test_encerradas_expiram_apos_retencao(self):
+        fila = FilaFotos(self.caminho)
+        fila.adicionar("10.0.0.1", 7, 0, 10)
+        fila.adicionar("10.0.0.1", 8, 0, 10)
+        fila.encerrar(ItemFoto("10.0.0.1", 7, 0, 10), "descartada")
+        fila.db.close()
+
+        FilaFotos.retencao = -1
+        fila = FilaFotos(self.caminho)
+        self.assertTrue(fila.adicionar("10.0.0.1", 7, 0, 10))
+        # Pendentes nunca expiram
+        self.assertFalse(fila.adicionar("10.0.0.1", 8, 0, 10))
+
+    def test_encerradas_expiram_sem_reiniciar(self):
+        fila = FilaFotos(":memory:")
+        for indice in (7, 8, 9):
+            fila.adicionar("10.0.0.1", indice, 0, 10)
+        fila.encerrar(ItemFoto("10.0.0.1", 7, 0, 10), "concluida")
+
+        FilaFotos.retencao = -1
+        # Dentro do intervalo de expurgo nada é removido
+        fila.encerrar(ItemFoto("10.0.0.1", 8, 0, 10), "descartada")
+        self.assertFalse(fila.adicionar("10.0.0.1", 7, 0, 10))
+
+        FilaFotos.intervalo_expurgo = 0
+        fila.encerrar(ItemFoto("10.0.0.1", 8, 0, 10), "descartada")
+        self.assertTrue(fila.adicionar("10.0.0.1", 7, 0, 10))
+        self.assertTrue(fila.adicionar("10.0.0.1", 8, 0, 10))
+        self.assertFalse(fila.adicionar("10.0.0.1", 9, 0, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Testes do executor de ganchos com processos reais (comandos curtos de
+# shell): ordem por chave, limite de simultâneos, tempo limite e coleta do
+# status ao fim da saída.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, time, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import EventLoop, Handler, Poller, SelectorsPoller, Timeout, Log
+from alarmeitbl.ganchos import ExecutorGanchos, ProcessoGancho
+
+class TestGanchos(unittest.TestCase):
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        self.reinicia()
+        self.loop = EventLoop(SelectorsPoller())
+        self.dir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.dir.name, "saida")
+        self.terminados = []
+        self.max_executando = 0
+
+    def tearDown(self):
+        for h in list(Handler.items.values()):
+            h.proc.kill()
+            h.proc.wait()
+            h.destroy()
+        self.reinicia()
+        self.dir.cleanup()
+        Log.set_level(self.nivel)
+
+    def reinicia(self):
+        Handler.items.clear()
+        Handler.by_fd.clear()
+        Timeout.pending.clear()
+        Timeout.heap = []
+        Timeout.by_owner.clear()
+        if Poller.current:
+            Poller.current.close()
+        Poller.current = None
+
+    def executor(self, max_simultaneos=4, tempo_limite=10):
+        executor = ExecutorGanchos(max_simultaneos, tempo_limite)
+        terminado = executor.terminado
+        def registra(processo):
+            self.terminados.append((processo.chave, processo.status, bytes(processo.saida)))
+            terminado(processo)
+        executor.terminado = registra
+        return executor
+
+    def roda(self, executor, limite=10):
+        inicio = time.monotonic()
+        while executor.pendentes():
+            self.assertLess(time.monotonic() - inicio, limite)
+            self.max_executando = max(self.max_executando, len(executor.executando))
+            Timeout.new("ciclo", 0.5, lambda t: None)
+            self.loop.cycle()
+        return time.monotonic() - inicio
+
+    def conteudo(self):
+        with open(self.arquivo) as f:
+            return f.read()
+
+    def test_ordem_por_chave(self):
+        e = self.executor()
+        for i in range(4):
+            e.executar("10.0.0.1", "sleep 0.0%d; echo %d >> %s" % (4 - i, i, self.arquivo))
+        # Um de cada vez para a mesma chave, os demais aguardam na fila
+        self.assertEqual(len(e.executando), 1)
+        self.assertEqual(e.pendentes(), 4)
+        self.roda(e)
+        self.assertEqual(self.max_executando, 1)
+        self.assertEqual(self.conteudo().split(), ["0", "1", "2", "3"])
+
+    def test_chaves_diferentes_em_paralelo_ate_o_limite(self):
+        e = self.executor(max_simultaneos=2)
+        for i in range(4):
+            e.executar("central %d" % i, "sleep 0.3")
+        self.assertEqual(len(e.executando), 2)
+        duracao = self.roda(e)
+        self.assertEqual(self.max_executando, 2)
+        self.assertGreaterEqual(duracao, 0.6)
+        self.assertLess(duracao, 1.2)
+        self.assertEqual(sorted(k for k, _, _ in self.terminados), ["central %d" % i for i in range(4)])
+
+    def test_status_e_saida(self):
+        e = self.executor()
+        # Argumentos chegam ao gancho sem interpretação pelo shell
+        e.executar("a", "sh -c 'printf \"%s|\" \"$@\"; exit 3' gancho", "com espaço", "it's", ";")
+        self.roda(e)
+        (chave, status, saida), = self.terminados
+        self.assertEqual(status, 3)
+        self.assertEqual(saida, "com espaço|it's|;|".encode())
+
+    def test_saida_limitada(self):
+        e = self.executor()
+        e.executar("a", "head -c 100000 /dev/zero")
+        self.roda(e)
+        (_, status, saida), = self.terminados
+        self.assertEqual(status, 0)
+        self.assertEqual(len(saida), ProcessoGancho.max_saida)
+
+    def test_tempo_limite(self):
+        e = self.executor(tempo_limite=0.3)
+        e.executar("a", "sleep 5")
+        e.executar("a", "echo depois > %s" % self.arquivo)
+        duracao = self.roda(e)
+        self.assertLess(duracao, 2)
+        self.assertEqual([s for _, s, _ in self.terminados], [-9, 0])
+        self.assertEqual(self.conteudo(), "depois\n")
+
+    def test_tempo_limite_com_neto_segurando_a_saida(self):
+        e = self.executor(tempo_limite=0.3)
+        # O neto herda a saída e a mantém aberta após o filho ser morto
+        e.executar("a", "sleep 3 & sleep 5")
+        duracao = self.roda(e)
+        self.assertLess(duracao, 2)
+        self.assertEqual(self.terminados[0][1], -9)
+
+    def test_coleta_no_fim_da_saida(self):
+        e = self.executor()
+        e.executar("a", "true 1")
+        processo = e.executando["a"]
+        self.roda(e)
+        # Coletado ao fim da saída, sem deixar processo zumbi
+        self.assertEqual(processo.proc.returncode, 0)
+        self.assertTrue(processo.destroyed)
+        self.assertEqual(Timeout.by_owner.get(id(processo)), None)
+
+    def test_gancho_nulo_nao_executa(self):
+        e = self.executor()
+        for gancho in (None, "", ":", " true ", "/bin/true"):
+            e.executar("a", gancho, "x")
+        self.assertEqual(e.pendentes(), 0)
+        self.assertEqual(Handler.items, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
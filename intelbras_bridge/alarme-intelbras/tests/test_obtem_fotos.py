@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# Testes da obtenção de fragmentos de foto em janela (ObtemFotosDeEvento),
+# sem conexão: envia_comando() é substituído por um falso que apenas
+# registra os pedidos, e as respostas da central são injetadas no tratador.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import Log
+from alarmeitbl.obtem_fotos import ObtemFotosDeEvento
+from alarmeitbl.tratador_fotos import ItemFoto
+
+CMD_FOTO = 0x0bb0
+NAK = 0xf0fd
+
+def dados(indice, nrfoto, fragmento):
+    return bytes([indice, nrfoto, fragmento]) * 10
+
+def resposta(indice, nrfoto, fragmento, nr_fragmentos, conteudo=None):
+    if conteudo is None:
+        conteudo = dados(indice, nrfoto, fragmento)
+    # Como em pacote_isecnet2_parse(), o payload é uma fatia do buffer
+    return memoryview(bytes([indice >> 8, indice & 0xff, nrfoto, 1, fragmento, nr_fragmentos]) + conteudo)
+
+
+class TimeoutFalso:
+    def restart(self):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class ObservadorFalso:
+    def __init__(self, proximas=()):
+        self.resultados = []
+        self.progressos = []
+        self.proximas = list(proximas)
+
+    def resultado_foto(self, item, status, arquivo, motivo=None):
+        self.resultados.append((item.indice, item.nrfoto, status, arquivo, motivo))
+
+    def progresso_foto(self, item):
+        self.progressos.append((item.nr_fragmentos, item.gravados, item.bytes_gravados))
+
+    def proxima_foto(self, ip_addr):
+        return self.proximas and self.proximas.pop(0) or None
+
+    def sessao_encerrada(self, sessao):
+        pass
+
+
+class SessaoFalsa(ObtemFotosDeEvento):
+    # Sem conexão nem autenticação: apenas o estado usado pelo download
+    def __init__(self, item, observer, folder, janela=4):
+        self.label = "teste"
+        self.observer = observer
+        self.ip_addr = "10.0.0.1"
+        self.folder = folder
+        self.janela = janela
+        self.abandonados = set()
+        self.item = item
+        self.arquivo = ""
+        self.temporario = None
+        self.status = 2
+        self.motivo = None
+        self.tratador = None
+        self.conn_timeout = TimeoutFalso()
+        self.destroyed = False
+        self.pedidos_enviados = []
+        self.encerrada = False
+
+    def envia_comando(self, cmd, payload, tratador_in):
+        self.pedidos_enviados.append(payload[3])
+        self.cmd = cmd
+        self.tratador = self.resposta_comando
+        self.tratador_in = tratador_in
+
+    def despedida(self):
+        self.encerrada = True
+
+    def destroy(self):
+        self.destroyed = True
+        self.destroyed_callback()
+
+    def responde(self, *args, **kwargs):
+        self.tratador(CMD_FOTO, resposta(*args, **kwargs))
+
+    def recusa(self, motivo):
+        self.tratador(NAK, memoryview(bytes([motivo])))
+
+
+class TestObtemFotos(unittest.TestCase):
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        Log.set_level(self.nivel)
+        self.dir.cleanup()
+
+    def sessao(self, *itens, janela=4):
+        self.observador = ObservadorFalso(itens[1:])
+        sessao = SessaoFalsa(itens[0], self.observador, self.dir.name, janela)
+        sessao.envia_comando_in()
+        return sessao
+
+    def imagem(self, arquivo):
+        with open(arquivo, "rb") as f:
+            return f.read()
+
+    def esperado(self, indice, nrfoto, nr_fragmentos):
+        return b"".join(dados(indice, nrfoto, f) for f in range(1, nr_fragmentos + 1))
+
+    def parciais(self):
+        return [n for n in os.listdir(self.dir.name) if n.endswith(".parcial")]
+
+    def test_janela_em_ordem(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10))
+        # Número de fragmentos desconhecido: só o primeiro é pedido
+        self.assertEqual(s.pedidos_enviados, [1])
+        s.responde(7, 0, 1, 10)
+        self.assertEqual(s.pedidos_enviados, [1, 2, 3, 4, 5])
+        for fragmento in range(2, 11):
+            s.responde(7, 0, fragmento, 10)
+            self.assertLessEqual(len(s.pedidos), 4)
+
+        self.assertEqual(s.pedidos_enviados, list(range(1, 11)))
+        (indice, nrfoto, status, arquivo, motivo), = self.observador.resultados
+        self.assertEqual((indice, nrfoto, status, motivo), (7, 0, 0, None))
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 10))
+        self.assertEqual(self.parciais(), [])
+        self.assertTrue(s.encerrada)
+
+    def test_stop_and_wait(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10), janela=1)
+        s.responde(7, 0, 1, 3)
+        self.assertEqual(s.pedidos_enviados, [1, 2])
+        s.responde(7, 0, 2, 3)
+        s.responde(7, 0, 3, 3)
+        self.assertEqual(s.pedidos_enviados, [1, 2, 3])
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual(status, 0)
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 3))
+
+    def test_fragmentos_fora_de_ordem(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10))
+        s.responde(7, 0, 1, 6)
+        for fragmento in (3, 5, 2, 4):
+            s.responde(7, 0, fragmento, 6)
+        s.responde(7, 0, 6, 6)
+
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual(status, 0)
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 6))
+
+    def test_nak_com_pedidos_em_paralelo(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10))
+        s.responde(7, 0, 1, 6)
+        self.assertEqual(s.pedidos, {2, 3, 4, 5})
+
+        # NAK sem saber de qual pedido: refaz um de cada vez
+        s.recusa(0x25)
+        self.assertEqual(s.janela, 1)
+        self.assertEqual(s.abandonados, {(7, 0, 2), (7, 0, 3), (7, 0, 4), (7, 0, 5)})
+        self.assertEqual(s.pedidos, {2})
+        self.assertEqual(self.observador.resultados, [])
+
+        # Resposta atrasada de um pedido abandonado ainda é aproveitada
+        s.responde(7, 0, 4, 6)
+        self.assertEqual(s.pedidos, {2})
+        self.assertNotIn((7, 0, 4), s.abandonados)
+        s.responde(7, 0, 2, 6)
+        self.assertEqual(s.pedidos, {3})
+        for fragmento in (3, 5, 6):
+            s.responde(7, 0, fragmento, 6)
+            self.assertLessEqual(len(s.pedidos), 1)
+
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual(status, 0)
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 6))
+
+    def test_respostas_atrasadas_de_foto_anterior(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10), ItemFoto("10.0.0.1", 8, 0, 10))
+        s.responde(7, 0, 1, 6)
+        s.recusa(0x25)
+        # Pedido único recusado: a foto 7 falha e a sessão passa à 8
+        s.recusa(0x28)
+        self.assertEqual(self.observador.resultados[0], (7, 0, 1, "", 0x28))
+        self.assertEqual(s.indice, 8)
+
+        # As 3 respostas pendentes da foto 7 são ignoradas, sem derrubar a sessão
+        for fragmento in (3, 4, 5):
+            s.responde(7, 0, fragmento, 6)
+        self.assertFalse(s.destroyed)
+        # Resta o pedido refeito do fragmento 2, que pode ainda ser respondido
+        self.assertEqual(s.abandonados, {(7, 0, 2)})
+
+        s.responde(8, 0, 1, 2)
+        s.responde(8, 0, 2, 2)
+        self.assertEqual(self.observador.resultados[1][:3], (8, 0, 0))
+        self.assertEqual(self.imagem(self.observador.resultados[1][3]), self.esperado(8, 0, 2))
+
+        # Resposta de outra foto sem pedidos abandonados é erro
+        s2 = self.sessao(ItemFoto("10.0.0.1", 9, 0, 10))
+        s2.responde(7, 0, 1, 6)
+        self.assertTrue(s2.destroyed)
+
+    def test_abandonados_drenados_entre_fotos(self):
+        s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10), ItemFoto("10.0.0.1", 8, 0, 10))
+        s.responde(7, 0, 1, 6)
+        s.recusa(0x25)
+        # Todas as respostas abandonadas chegam ainda durante a foto 7
+        for fragmento in (4, 2, 3, 5, 6):
+            s.responde(7, 0, fragmento, 6)
+        self.assertEqual(self.observador.resultados[0][:3], (7, 0, 0))
+        self.assertEqual(s.indice, 8)
+        self.assertEqual(s.abandonados, set())
+
+        # Nada mais é esperado da foto 7: resposta de outra foto é erro
+        s.responde(99, 0, 1, 2)
+        self.assertTrue(s.destroyed)
+        self.assertEqual(self.observador.resultados[1][:3], (8, 0, 2))
+
+    def item_interrompido(self, nr_fragmentos, gravados):
+        item = ItemFoto("10.0.0.1", 7, 0, 10)
+        item.temporario = os.path.join(self.dir.name, ".imagem.7.0.teste.parcial")
+        conteudo = self.esperado(7, 0, gravados)
+        with open(item.temporario, "wb") as f:
+            # Lixo após o último fragmento durável, a ser descartado
+            f.write(conteudo + b"lixo")
+        item.nr_fragmentos = nr_fragmentos
+        item.gravados = gravados
+        item.bytes_gravados = len(conteudo)
+        return item
+
+    def test_retomada(self):
+        s = self.sessao(self.item_interrompido(6, 2))
+        self.assertEqual(s.pedidos_enviados, [3, 4, 5, 6])
+        for fragmento in (3, 4, 5, 6):
+            s.responde(7, 0, fragmento, 6)
+
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual(status, 0)
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 6))
+        self.assertEqual(self.parciais(), [])
+
+    def test_retomada_de_foto_que_mudou(self):
+        s = self.sessao(self.item_interrompido(6, 2))
+        # A central agora tem 4 fragmentos para este índice: recomeça do 1,
+        # aproveitando o fragmento 3 já recebido da foto nova
+        s.responde(7, 0, 3, 4)
+        self.assertFalse(s.destroyed)
+        self.assertEqual(s.proximo_gravar, 1)
+        self.assertIn(1, s.pedidos)
+        for fragmento in (1, 2, 4):
+            s.responde(7, 0, fragmento, 4)
+
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual(status, 0)
+        self.assertEqual(self.imagem(arquivo), self.esperado(7, 0, 4))
+
+    def test_falha_preserva_progresso(self):
+        ObtemFotosDeEvento.intervalo_progresso, intervalo = 2, ObtemFotosDeEvento.intervalo_progresso
+        try:
+            s = self.sessao(ItemFoto("10.0.0.1", 7, 0, 10))
+            for fragmento in (1, 2, 3):
+                s.responde(7, 0, fragmento, 6)
+            s.destroy()
+        finally:
+            ObtemFotosDeEvento.intervalo_progresso = intervalo
+
+        (_, _, status, arquivo, _), = self.observador.resultados
+        self.assertEqual((status, arquivo), (2, ""))
+        # Progresso final: os 3 fragmentos gravados, temporário mantido
+        self.assertEqual(self.observador.progressos[-1], (6, 3, len(self.esperado(7, 0, 3))))
+        self.assertEqual(len(self.parciais()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Testes dos pollers do myeventloop (SelectPoller e SelectorsPoller) sobre
+# um socketpair: prontidão, reavaliação do interesse via interest_changed()
+# e remoção do descritor na destruição do Handler.
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, socket, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import Handler, Poller, SelectPoller, SelectorsPoller, Timeout, Log
+
+def reinicia_event_loop():
+    Handler.items.clear()
+    Handler.by_fd.clear()
+    Timeout.pending.clear()
+    Timeout.heap = []
+    Timeout.by_owner.clear()
+    if Poller.current:
+        Poller.current.close()
+    Poller.current = None
+
+
+class Ponta(Handler):
+    def __init__(self, sock):
+        sock.setblocking(False)
+        super().__init__("ponta %d" % sock.fileno(), sock, OSError)
+        self.leitura = True
+        self.escrita = False
+        self.excecao = False
+        self.recebido = b""
+
+    def is_readable(self):
+        return self.leitura
+
+    def is_writable(self):
+        return self.escrita
+
+    def is_exceptional(self):
+        return self.excecao
+
+    def read_callback(self):
+        self.recebido += self.fd.recv(4096)
+
+
+class PollerTestes:
+    # Casos comuns aos dois pollers; poller() cria o poller testado
+
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        reinicia_event_loop()
+        Poller.use(self.poller())
+        a, self.outro = socket.socketpair()
+        self.ponta = Ponta(a)
+
+    def tearDown(self):
+        if not self.ponta.destroyed:
+            self.ponta.destroy()
+        self.outro.close()
+        reinicia_event_loop()
+        Log.set_level(self.nivel)
+
+    def ciclo(self, timeout=0):
+        poller = Poller.get()
+        if not poller.prepare():
+            return None
+        return poller.poll(timeout)
+
+    def test_leitura(self):
+        self.assertEqual(self.ciclo(), [])
+        self.outro.send(b"abc")
+        self.assertEqual(self.ciclo(1), [(self.ponta, True, False, False)])
+        self.ponta.read_callback()
+        self.assertEqual(self.ponta.recebido, b"abc")
+        self.assertEqual(self.ciclo(), [])
+
+    def test_escrita_apos_interest_changed(self):
+        self.ponta.escrita = True
+        self.ponta.interest_changed()
+        self.assertEqual(self.ciclo(), [(self.ponta, False, True, False)])
+
+        # Sem interesse algum, o descritor não é observado
+        self.ponta.leitura = self.ponta.escrita = False
+        self.ponta.interest_changed()
+        self.assertIsNone(self.ciclo())
+
+    def test_destruido_deixa_de_ser_observado(self):
+        self.assertEqual(self.ciclo(), [])
+        self.ponta.destroy()
+        self.assertIsNone(self.ciclo())
+        self.assertIsNone(Handler.find_by_fd(self.ponta.fdno))
+
+
+class TestSelectPoller(PollerTestes, unittest.TestCase):
+    def poller(self):
+        return SelectPoller()
+
+    def test_excecao(self):
+        self.ponta.excecao = True
+        self.assertEqual(self.ciclo(), [])
+        self.assertIn(self.ponta.fd, Poller.get().cex)
+
+
+class TestSelectorsPoller(PollerTestes, unittest.TestCase):
+    def poller(self):
+        return SelectorsPoller()
+
+    def test_interesse_avaliado_so_quando_marcado(self):
+        self.assertEqual(self.ciclo(), [])
+        # Sem interest_changed() o registro antigo (só leitura) é mantido
+        self.ponta.escrita = True
+        self.assertEqual(self.ciclo(), [])
+        self.ponta.interest_changed()
+        self.assertEqual(self.ciclo(), [(self.ponta, False, True, False)])
+
+    def test_excecao_nao_suportada(self):
+        self.ponta.excecao = True
+        self.ponta.interest_changed()
+        with self.assertRaises(Exception):
+            self.ciclo()
+
+    def test_troca_de_poller_preserva_handlers(self):
+        self.assertEqual(self.ciclo(), [])
+        Poller.use(SelectPoller())
+        self.outro.send(b"x")
+        self.assertEqual(self.ciclo(1), [(self.ponta, True, False, False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Testes da fila de timeouts do myeventloop (heap com remoção preguiçosa e
+# índice por dono), com um relógio falso no lugar de Timeout.now().
+#
+# Uso: python3 -m unittest discover tests (ou python3 -m pytest tests)
+
+import os, sys, socket, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alarmeitbl.myeventloop import Handler, Poller, Timeout, Log
+
+class Dono(Handler):
+    def __init__(self, sock):
+        super().__init__("dono", sock, OSError)
+
+    def read_callback(self):
+        pass
+
+
+class TestTimeout(unittest.TestCase):
+    def setUp(self):
+        self.nivel = Log.log_level
+        Log.set_level(Log.ERROR)
+        Timeout.pending.clear()
+        Timeout.heap = []
+        Timeout.by_owner.clear()
+        self.agora = 1000.0
+        self.now = Timeout.__dict__["now"]
+        Timeout.now = staticmethod(lambda: self.agora)
+        self.executados = []
+
+    def tearDown(self):
+        Timeout.now = self.now
+        for t in list(Timeout.pending.values()):
+            t.cancel()
+        Log.set_level(self.nivel)
+
+    def novo(self, label, relative_to):
+        return Timeout.new(label, relative_to, lambda t: self.executados.append(t.label))
+
+    def avanca(self, segundos):
+        self.agora += segundos
+        Timeout.handle_due(1000)
+
+    def test_ordem(self):
+        for label, to in (("c", 3), ("a", 1), ("d", 3.5), ("b", 2)):
+            self.novo(label, to)
+        self.assertEqual(Timeout.next_relative(), (1, "a"))
+        self.avanca(2)
+        self.assertEqual(self.executados, ["a", "b"])
+        self.avanca(5)
+        self.assertEqual(self.executados, ["a", "b", "c", "d"])
+        self.assertEqual(Timeout.pending, {})
+        self.assertEqual(Timeout.next_absolute()[1], None)
+
+    def test_cancel(self):
+        t = self.novo("a", 1)
+        self.novo("b", 2)
+        self.assertTrue(t.cancel())
+        self.assertFalse(t.cancel())
+        self.assertFalse(t.alive())
+        # A entrada cancelada fica no heap, mas é ignorada
+        self.assertEqual(Timeout.next_relative(), (2, "b"))
+        self.avanca(3)
+        self.assertEqual(self.executados, ["b"])
+
+        # Cancelado pode ser rearmado
+        t.restart()
+        self.avanca(1)
+        self.assertEqual(self.executados, ["b", "a"])
+
+    def test_restart_adia_sem_crescer_heap(self):
+        t = self.novo("a", 5)
+        for _ in range(1000):
+            self.agora += 0.003
+            t.restart()
+        self.assertEqual(len(Timeout.heap), 1)
+        self.assertAlmostEqual(t.remaining(), 5)
+
+        # Ao chegar ao topo no prazo antigo, a entrada é reposicionada
+        self.avanca(3)
+        self.assertEqual(self.executados, [])
+        self.assertEqual(len(Timeout.heap), 1)
+        self.assertAlmostEqual(Timeout.next_relative()[0], 2)
+        self.avanca(2)
+        self.assertEqual(self.executados, ["a"])
+
+    def test_reset_antecipa(self):
+        t = self.novo("a", 10)
+        t.reset(2)
+        self.assertEqual(Timeout.next_relative(), (2, "a"))
+        self.avanca(2)
+        self.assertEqual(self.executados, ["a"])
+        # A entrada antiga (10 s) é obsoleta
+        self.avanca(10)
+        self.assertEqual(self.executados, ["a"])
+
+    def test_compactacao(self):
+        ts = [self.novo("t%d" % i, 100) for i in range(10)]
+        for i in range(1000):
+            # Antecipar deixa a entrada antiga para trás
+            ts[i % 10].reset(100 - i * 0.01)
+        self.assertLessEqual(len(Timeout.heap), 64 + 1)
+        self.assertEqual(len(Timeout.pending), 10)
+
+    def test_orcamento_por_ciclo(self):
+        for i in range(5):
+            self.novo("t%d" % i, 1)
+        self.agora += 1
+        self.assertEqual(Timeout.handle_due(3), 3)
+        self.assertEqual(Timeout.handle_due(3), 2)
+        self.assertEqual(len(self.executados), 5)
+
+    def test_destruicao_do_dono(self):
+        a, b = socket.socketpair()
+        try:
+            dono = Dono(a)
+            proprios = [dono.timeout("p%d" % i, i + 1, lambda t: None) for i in range(3)]
+            outro = self.novo("global", 1)
+            self.assertEqual(len(Timeout.by_owner[id(dono)]), 3)
+
+            dono.destroy()
+            self.assertNotIn(id(dono), Timeout.by_owner)
+            self.assertEqual(list(Timeout.pending.values()), [outro])
+            for t in proprios:
+                self.assertTrue(t.invalidated)
+                with self.assertRaises(Exception):
+                    t.restart()
+            with self.assertRaises(Exception):
+                dono.timeout("depois", 1, lambda t: None)
+
+            self.avanca(5)
+            self.assertEqual(self.executados, ["global"])
+        finally:
+            b.close()
+            Handler.items.clear()
+            Handler.by_fd.clear()
+            Poller.current = None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,36 +16,49 @@ log "Iniciando Intelbras MQTT Bridge Add-on (v7.5 - Corrección Device Class)"
 export ALARM_IP=$(bashio::config 'alarm_ip'); export ALARM_PORT=$(bashio::config 'alarm_port'); export ALARM_PASS=$(bashio::config 'alarm_password')
 export MQTT_BROKER=$(bashio::config 'mqtt_broker'); export MQTT_PORT=$(bashio::config 'mqtt_port'); export MQTT_USER=$(bashio::config 'mqtt_user'); export MQTT_PASS=$(bashio::config 'mqtt_password')
 export POLLING_INTERVAL_MINUTES=$(bashio::config 'polling_interval_minutes' 5)
+export POLL_DEBOUNCE_SECONDS=$(bashio::config 'poll_debounce_seconds' 5)
+export POLL_BACKOFF_MAX=$(bashio::config 'poll_backoff_max' 4)
+export KEEPALIVE_SECONDS=$(bashio::config 'keepalive_seconds' 30)
+export FULL_RESYNC_MINUTES=$(bashio::config 'full_resync_minutes' 60)
+export COMPACT_STATE=$(bashio::config 'compact_state' false)
+export AUTO_ZONES=$(bashio::config 'auto_zones' true)
+export PAIRED_REFRESH_MINUTES=$(bashio::config 'paired_refresh_minutes' 60)
+export EMBEDDED_RECEPTOR=$(bashio::config 'embedded_receptor' false)
 export ZONE_COUNT=$(bashio::config 'zone_count' 0)
 PASSWORD_LENGTH=$(bashio::config 'password_length')
 MQTT_OPTS=(-h "$MQTT_BROKER" -p "$MQTT_PORT"); [[ -n "$MQTT_USER" ]] && MQTT_OPTS+=(-u "$MQTT_USER" -P "$MQTT_PASS")
-AVAILABILITY_TOPIC="intelbras/alarm/availability"; DEVICE_ID="intelbras_alarm"; DISCOVERY_PREFIX="homeassistant"
+AVAILABILITY_TOPIC="intelbras/alarm/availability"; DEVICE_ID="intelbras_alarm"; DISCOVERY_PREFIX="homeassistant"; STATE_JSON_TOPIC="intelbras/alarm/json"
 log "Configuración cargada. Zonas a gestionar: $ZONE_COUNT."
 
 # --- FUNCIONES DE DISCOVERY (formato legible) ---
+# En modo compacto las entidades leen su valor del documento JSON de estado
+state_topic_fields() {
+    local uid=$1
+    if [[ "$COMPACT_STATE" != "true" ]]; then echo "\"state_topic\":\"intelbras/alarm/${uid}\","; return; fi
+    echo "\"state_topic\":\"${STATE_JSON_TOPIC}\",\"value_template\":\"{{ value_json.${uid} }}\","
+}
 publish_device_info() {
     echo "\"device\":{\"identifiers\":[\"${DEVICE_ID}\"],\"name\":\"Alarme Intelbras\",\"model\":\"AMT-8000\",\"manufacturer\":\"Intelbras\"}"
 }
 publish_binary_sensor_discovery() {
     local name=$1; local uid=$2; local device_class=$3; local icon=${4:-}
-    local payload='{'; payload+="\"name\":\"${name}\",\"state_topic\":\"intelbras/alarm/${uid}\",\"unique_id\":\"${uid}\",\"device_class\":\"${device_class}\","; payload+="\"payload_on\":\"on\",\"payload_off\":\"off\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; [[ -n "$icon" ]] && payload+="\"icon\":\"${icon}\","; payload+="$(publish_device_info)"; payload+='}';
+    local payload='{'; payload+="\"name\":\"${name}\",$(state_topic_fields "$uid")\"unique_id\":\"${uid}\",\"device_class\":\"${device_class}\","; payload+="\"payload_on\":\"on\",\"payload_off\":\"off\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; [[ -n "$icon" ]] && payload+="\"icon\":\"${icon}\","; payload+="$(publish_device_info)"; payload+='}';
     mosquitto_pub "${MQTT_OPTS[@]}" -r -t "${DISCOVERY_PREFIX}/binary_sensor/${DEVICE_ID}/${uid}/config" -m "${payload}"
 }
 publish_text_sensor_discovery() {
     local name=$1; local uid=$2; local icon=$3
-    local state_topic="intelbras/alarm/${uid}"
-    local payload='{'; payload+="\"name\":\"${name}\",\"state_topic\":\"${state_topic}\",\"unique_id\":\"${uid}\",\"icon\":\"${icon}\","; payload+="\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="$(publish_device_info)"; payload+='}';
+    local payload='{'; payload+="\"name\":\"${name}\",$(state_topic_fields "$uid")\"unique_id\":\"${uid}\",\"icon\":\"${icon}\","; payload+="\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="$(publish_device_info)"; payload+='}';
     mosquitto_pub "${MQTT_OPTS[@]}" -r -t "${DISCOVERY_PREFIX}/sensor/${DEVICE_ID}/${uid}/config" -m "${payload}"
 }
 publish_numeric_sensor_discovery() {
     local name=$1; local uid=$2; local device_class=$3; local unit=$4; local icon=$5
-    local state_topic="intelbras/alarm/${uid}"
-    local payload='{'; payload+="\"name\":\"${name}\",\"state_topic\":\"${state_topic}\",\"unique_id\":\"${uid}\",\"device_class\":\"${device_class}\","; payload+="\"unit_of_measurement\":\"${unit}\",\"icon\":\"${icon}\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="$(publish_device_info)"; payload+='}';
+    local payload='{'; payload+="\"name\":\"${name}\",$(state_topic_fields "$uid")\"unique_id\":\"${uid}\",\"device_class\":\"${device_class}\","; payload+="\"unit_of_measurement\":\"${unit}\",\"icon\":\"${icon}\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="$(publish_device_info)"; payload+='}';
     mosquitto_pub "${MQTT_OPTS[@]}" -r -t "${DISCOVERY_PREFIX}/sensor/${DEVICE_ID}/${uid}/config" -m "${payload}"
 }
 publish_alarm_panel_discovery() {
-    log "Publicando Painel de Alarme..."; local uid="${DEVICE_ID}_panel"; local command_topic="intelbras/alarm/command"; local state_topic="intelbras/alarm/state"
-    local payload='{'; payload+="\"name\":\"Painel de Alarma Intelbras\",\"unique_id\":\"${uid}\",\"state_topic\":\"${state_topic}\","; payload+="\"command_topic\":\"${command_topic}\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="\"value_template\":\"{% if value == 'Disparada' %}triggered{% elif value == 'Armada' %}armed_away{% else %}disarmed{% endif %}\","; payload+="\"payload_disarm\":\"DISARM\",\"payload_arm_away\":\"ARM_AWAY\",\"supported_features\":[\"arm_away\"],"; payload+="\"code_arm_required\":false,\"code_disarm_required\":false,"; payload+="$(publish_device_info)"; payload+='}';
+    log "Publicando Painel de Alarme..."; local uid="${DEVICE_ID}_panel"; local command_topic="intelbras/alarm/command"; local state_topic="intelbras/alarm/state"; local value="value"; local extra=""
+    [[ "$COMPACT_STATE" == "true" ]] && { state_topic="${STATE_JSON_TOPIC}"; value="value_json.state"; extra="\"json_attributes_topic\":\"${STATE_JSON_TOPIC}\","; }
+    local payload='{'; payload+="\"name\":\"Painel de Alarma Intelbras\",\"unique_id\":\"${uid}\",\"state_topic\":\"${state_topic}\",${extra}"; payload+="\"command_topic\":\"${command_topic}\",\"availability_topic\":\"${AVAILABILITY_TOPIC}\","; payload+="\"value_template\":\"{% if ${value} == 'Disparada' %}triggered{% elif ${value} == 'Armada' %}armed_away{% else %}disarmed{% endif %}\","; payload+="\"payload_disarm\":\"DISARM\",\"payload_arm_away\":\"ARM_AWAY\",\"supported_features\":[\"arm_away\"],"; payload+="\"code_arm_required\":false,\"code_disarm_required\":false,"; payload+="$(publish_device_info)"; payload+='}';
     mosquitto_pub "${MQTT_OPTS[@]}" -r -t "${DISCOVERY_PREFIX}/alarm_control_panel/${DEVICE_ID}/config" -m "${payload}"
 }
 publish_button_discovery() {
@@ -72,10 +85,7 @@ publish_binary_sensor_discovery "Alimentación AC" "ac_power" "power"
 publish_binary_sensor_discovery "Batería del Sistema" "system_battery" "battery"
 # --- FIN: LÍNEAS CORREGIDAS ---
 
-log "Publicando sensores de zona de texto individuales..."
-for i in $(seq 1 "$ZONE_COUNT"); do
-    publish_text_sensor_discovery "Zona $i" "zone_$i" "mdi:door"
-done
+# Los sensores de zona los publica addon_main.py, solo para las zonas emparejadas (auto_zones)
 
 # --- GENERACIÓN DE CONFIG.CFG ---
 log "Generando config.cfg para receptorip..."